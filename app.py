@@ -1,21 +1,81 @@
 from flask import Flask
+import click
 import os
+import sys
 
-def create_app():
+if sys.version_info[0] < 3:
+  raise RuntimeError('The reference browser needs Python 3 (see the readme).')
+
+def create_app(test_config=None):
+  """Create the app.
+
+  |test_config|, if given, replaces the instance configuration and must hold
+  the password in TEST_PASSWORD."""
   dirpath = os.path.dirname(os.path.abspath(__file__))
 
   app = Flask(__name__)
   app.config.from_pyfile(os.path.join(dirpath, 'config.py'))
-  app.config.from_pyfile(os.path.join(dirpath, 'instance', 'config.py'))
+  if test_config is None:
+    app.config.from_pyfile(os.path.join(dirpath, 'instance', 'config.py'))
+  else:
+    app.config.update(test_config)
+  if app.config.get('TEMPLATE_BYTECODE_CACHE'):
+    # Set before anything creates the Jinja environment.
+    from jinja2 import FileSystemBytecodeCache
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=
+        FileSystemBytecodeCache(app.config.get('TEMPLATE_BYTECODE_CACHE_DIR')))
+
+  if app.config.get('SERVE_IMMUTABLE'):
+    from browser.serving import ServingEngineOptions
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = ServingEngineOptions(app)
 
   from browser.models import db, SetTestPassword
   db.init_app(app)
-  with open(os.path.join(dirpath, 'instance', 'password.txt'), 'r') as f:
-    SetTestPassword(f.readline().strip())
+  if test_config is None:
+    with open(os.path.join(dirpath, 'instance', 'password.txt'), 'r') as f:
+      SetTestPassword(f.readline().strip())
+  else:
+    SetTestPassword(test_config['TEST_PASSWORD'])
 
   from browser.views import browsing, login_manager
+  from browser.api import api
+  from browser.instrumentation import Instrument
+  from browser.assets import InitAssets
+  from browser.page_cache import InitPageCache
+  from browser.profiling import InitProfiling
   app.register_blueprint(browsing)
+  app.register_blueprint(api)
   login_manager.init_app(app)
+  Instrument(app)
+  InitAssets(app, os.path.join(dirpath, 'browser', 'dist'))
+  InitPageCache(app)
+  InitProfiling(app)
+
+  from browser.derivatives import DerivativeCache
+  protected_dir = app.config['PROTECTED_DIR'] or \
+                  os.path.join(dirpath, 'browser', 'protected')
+  app.config['PROTECTED_DIR'] = protected_dir
+  cache = DerivativeCache(protected_dir,
+                          app.config['DERIVATIVE_CACHE_DIR'] or
+                          os.path.join(protected_dir, 'cache'),
+                          app.config['DERIVATIVE_CACHE_BYTES'])
+  app.extensions['derivative_cache'] = cache
+
+  from browser.packs import PackArchive
+  app.extensions['packs'] = PackArchive(os.path.join(protected_dir, 'packs'))
+
+  @app.cli.command('warm-cache')
+  @click.option('--islands', default=2,
+                help='Number of islands to warm up (default 2).')
+  def WarmCache(islands):
+    """Make the derivatives of the most visited islands."""
+    from browser.models import Derivative
+    for symbol in cache.MostVisitedIslands(islands):
+      for derivative in Derivative.query.filter_by(island=symbol):
+        if not os.path.exists(cache.CachePath(derivative.path)):
+          print('%s: %s' % (symbol, derivative.path))
+          cache.Generate(derivative.path, derivative.kind, derivative.source,
+                         symbol)
 
   return app
 
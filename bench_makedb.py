@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""Benchmark makedb on generated asset trees of increasing size.
+
+Each scale gets its own tree (see make_fake_tree.py) under the work
+directory, which is kept between runs as generating it is slow. The files
+makedb derives from the tree are deleted before each run so that every run
+does the full build. Results are written as JSON:
+
+  [{"scale": 1, "images": ..., "movies": ..., "wall_s": ...,
+    "stages": {"LoadFiles": <wall seconds>, ...},
+    "jobs": {"thumbnail": {"count": ..., "wall_ms": ..., ...}, ...}}, ...]
+"""
+
+from build_trace import tracer
+from make_fake_tree import TreeGenerator
+from makedb import Loader
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+class Options(object):
+  def __init__(self):
+    self.scales = [1, 10, 100]
+    self.work_dir = None
+    self.output = None
+
+  def Parse(self):
+    desc = "Benchmark makedb on generated asset trees."
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--scales', default='1,10,100',
+                        help='Comma separated tree scales (default 1,10,100).')
+    parser.add_argument('--work-dir', default='bench',
+                        help='Where the generated trees are kept.')
+    parser.add_argument('-o', '--output',
+                        help='Write the JSON results to this file instead '
+                             'of stdout.')
+    args = parser.parse_args()
+    self.scales = [int(s) for s in args.scales.split(',')]
+    self.work_dir = os.path.abspath(args.work_dir)
+    self.output = args.output
+
+def RemoveDerivatives(tree_dir):
+  """Delete the files makedb created in |tree_dir| on a previous run."""
+  protected_dir = os.path.join(tree_dir, Loader.protected_dir)
+  for dir_name in ['maps', 'bundles', 'images']:
+    shutil.rmtree(os.path.join(protected_dir, dir_name), ignore_errors=True)
+  shutil.rmtree(os.path.join(tree_dir, 'shards'), ignore_errors=True)
+  for dirpath, dirnames, filenames in os.walk(protected_dir):
+    for filename in filenames:
+      if 'thumbnail' in filename or \
+         os.path.splitext(filename)[1] in ('.gif', '.m4v', '.jpg'):
+        os.remove(os.path.join(dirpath, filename))
+  try:
+    os.remove(os.path.join(tree_dir, 'riven.sqlite'))
+  except FileNotFoundError:
+    pass
+
+def RunScale(work_dir, scale):
+  tree_dir = os.path.join(work_dir, 'scale-%d' % scale)
+  generator = TreeGenerator(tree_dir, scale, seed=scale)
+  print('Generating the %dx tree...' % scale, file=sys.stderr)
+  generator.Generate()
+  RemoveDerivatives(tree_dir)
+
+  cwd = os.getcwd()
+  os.chdir(tree_dir)
+  try:
+    tracer.Reset()
+    tracer.Enable()
+    start = time.perf_counter()
+    with tracer.Span('CreateDB', 'stage'):
+      Loader(Loader.ProtectPath('DVD')).CreateDB()
+    wall = time.perf_counter() - start
+  finally:
+    os.chdir(cwd)
+
+  stages = dict()
+  for event in tracer.events:
+    if event['cat'] == 'stage':
+      stages[event['name']] = event['dur'] / 1e6
+  return {
+    'scale': scale,
+    'images': generator.num_images,
+    'movies': generator.num_movies,
+    'wall_s': wall,
+    'stages': stages,
+    'jobs': tracer.JobTotals(),
+  }
+
+if __name__ == '__main__':
+  options = Options()
+  options.Parse()
+  # makedb prints a line per job. Keep stdout for the results.
+  results = []
+  real_stdout = sys.stdout
+  sys.stdout = sys.stderr
+  try:
+    for scale in options.scales:
+      results.append(RunScale(options.work_dir, scale))
+  finally:
+    sys.stdout = real_stdout
+  if options.output:
+    with open(options.output, 'w') as f:
+      json.dump(results, f, indent=2)
+  else:
+    json.dump(results, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+"""Benchmark the browser's pages against a generated riven.sqlite.
+
+A database of the requested size is built with makedb's own tables, and
+each page is requested through the Flask test client, logged in. For each
+page the latency percentiles, the number of SQL statements per request and
+the response size are reported, for each number of viewpoints per island,
+as JSON:
+
+  [{"viewpoints_per_island": 10,
+    "pages": {"island": {"p50_ms": ..., "p90_ms": ..., "p99_ms": ...,
+                         "mean_ms": ..., "queries": ..., "bytes": ...},
+              ...}}, ...]
+
+With --page-cache, the pages are served from the rendered-page cache after
+the first request.
+
+The database and the files the protected page serves are written to a
+temporary directory, which the app is pointed at (PROTECTED_DIR).
+"""
+
+from app import create_app
+from makedb import (
+  Island,
+  Loader,
+  Map,
+  Object,
+  ObjectImageAssocation,
+  ObjectMovieAssocation,
+  Position,
+  RivenImg,
+  RivenMovie,
+  RouteIndex,
+  SearchIndex,
+  StandardImageSize,
+  Viewpoint
+)
+from sqlalchemy import event
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+Password = 'bench'
+# Files served by the protected page, relative to the protected directory,
+# which is in the temporary directory of the run.
+BenchDir = 'bench'
+ThumbnailPath = os.path.join(BenchDir, 'thumbnail.png')
+ImagePath = os.path.join(BenchDir, 'image.png')
+MoviePath = os.path.join(BenchDir, 'movie.m4v')
+
+class Options(object):
+  def __init__(self):
+    self.viewpoints = [10, 100, 1000]
+    self.islands = 3
+    self.images = 4
+    self.movies = 1
+    self.objects = 100
+    self.requests = 50
+    self.output = None
+    self.page_cache = False
+
+  def Parse(self):
+    desc = "Benchmark the browser's pages against a generated database."
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--viewpoints', default='10,100,1000',
+                        help='Comma separated viewpoints per island '
+                             '(default 10,100,1000).')
+    parser.add_argument('--islands', type=int, default=3,
+                        help='Number of islands (default 3, max %d).' %
+                             len(Island.info))
+    parser.add_argument('--images', type=int, default=4,
+                        help='Images per viewpoint (default 4).')
+    parser.add_argument('--movies', type=int, default=1,
+                        help='Movies per viewpoint (default 1).')
+    parser.add_argument('--objects', type=int, default=100,
+                        help='Number of objects (default 100).')
+    parser.add_argument('-n', '--requests', type=int, default=50,
+                        help='Requests per page (default 50).')
+    parser.add_argument('-o', '--output',
+                        help='Write the JSON results to this file instead '
+                             'of stdout.')
+    parser.add_argument('--page-cache', action='store_true',
+                        help='Measure with the rendered-page cache '
+                             'enabled.')
+    args = parser.parse_args()
+    self.viewpoints = [int(v) for v in args.viewpoints.split(',')]
+    self.islands = min(args.islands, len(Island.info))
+    self.images = args.images
+    self.movies = args.movies
+    self.objects = args.objects
+    self.requests = args.requests
+    self.output = args.output
+    self.page_cache = args.page_cache
+
+class DatabaseBuilder(object):
+  """Builds a riven.sqlite of a given size through makedb's tables."""
+  viewpoints_per_position = 4
+
+  def __init__(self, options, viewpoints_per_island):
+    self.options = options
+    self.viewpoints_per_island = viewpoints_per_island
+    self.random = random.Random(viewpoints_per_island)
+    self.islands = []
+    self.viewpoints = []
+    self.positions = []
+    self.images = []
+    self.movies = []
+    self.objects = []
+
+  def AddIsland(self, island_symbol):
+    island = Island(island_symbol)
+    self.islands.append(island)
+    names = [str(n + 1) for n in range(self.viewpoints_per_island)]
+    position = None
+    previous = None
+    for n, name in enumerate(names):
+      if n % self.viewpoints_per_position == 0:
+        position = Position(str(len(island.positions) + 1), island)
+        island.positions[position.name] = position
+        self.positions.append(position)
+      viewpoint = island.GetViewpoint(name)
+      viewpoint.position = position
+      position.viewpoints[name] = viewpoint
+      viewpoint.thumbnail = ThumbnailPath
+      viewpoint.thumbnail2x = ThumbnailPath
+      if previous:
+        viewpoint.left_viewpoint = previous
+        previous.right_viewpoint = viewpoint
+      previous = viewpoint
+      self.viewpoints.append(viewpoint)
+      for i in range(self.options.images):
+        friendly = 'view.%d' % i
+        image = RivenImg(viewpoint, friendly, ImagePath,
+                         StandardImageSize[0], StandardImageSize[1])
+        image.store_path = ImagePath
+        self.images.append(image)
+      for i in range(self.options.movies):
+        friendly = 'movie.%d' % i
+        movie = RivenMovie(viewpoint, friendly, MoviePath, None, MoviePath,
+                           StandardImageSize[0], StandardImageSize[1])
+        movie.store_path = MoviePath
+        self.movies.append(movie)
+
+  def AddObjects(self):
+    for n in range(self.options.objects):
+      obj = Object('object-%d' % n, 'Object %d' % n)
+      obj.images = self.random.sample(self.images, min(5, len(self.images)))
+      obj.movies = self.random.sample(self.movies, min(1, len(self.movies)))
+      obj.thumbnail = ThumbnailPath
+      obj.thumbnail2x = ThumbnailPath
+      self.objects.append(obj)
+
+  def Build(self, db_path):
+    for island_symbol in sorted(Island.info)[:self.options.islands]:
+      self.AddIsland(island_symbol)
+    self.AddObjects()
+
+    loader = Loader(None)
+    conn = sqlite3.connect(db_path)
+    loader.CreateTables(conn)
+    loader.CreateUsers(conn)
+    c = conn.cursor()
+    Loader.InsertRows(c, 'islands', Island, self.islands)
+    Loader.InsertRows(c, 'viewpoints', Viewpoint, self.viewpoints)
+    Loader.InsertRows(c, 'positions', Position, self.positions)
+    Loader.InsertRows(c, 'rivenimgs', RivenImg, self.images)
+    Loader.InsertRows(c, 'rivenmovs', RivenMovie, self.movies)
+    Loader.InsertRows(c, 'objects', Object, self.objects)
+    ObjectImageAssocation.InsertAll(c, [ObjectImageAssocation(o, i)
+                                        for o in self.objects
+                                        for i in o.images])
+    ObjectMovieAssocation.InsertAll(c, [ObjectMovieAssocation(o, m)
+                                        for o in self.objects
+                                        for m in o.movies])
+    SearchIndex.InsertAll(c, self.viewpoints, self.images, self.movies,
+                          self.objects)
+    riven_map = Map()
+    riven_map.islands = dict((i.symbol, i) for i in self.islands)
+    RouteIndex.InsertAll(c, riven_map)
+    loader.CreateIndexes(conn)
+    conn.commit()
+    conn.close()
+
+def WriteProtectedFiles(protected_dir):
+  os.makedirs(os.path.join(protected_dir, BenchDir))
+  rand = random.Random(0)
+  for path, size in [(ThumbnailPath, 20000), (ImagePath, 300000),
+                     (MoviePath, 500000)]:
+    with open(os.path.join(protected_dir, path), 'wb') as f:
+      f.write(bytes(rand.getrandbits(8) for _ in range(size)))
+
+def Percentile(sorted_values, fraction):
+  index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+  return sorted_values[index]
+
+def AppConfig(db_path, **extra):
+  config = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path,
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'SECRET_KEY': 'bench',
+    'WTF_CSRF_ENABLED': False,
+    'TEST_PASSWORD': Password,
+    'PAGE_CACHE_BYTES': 0,
+  }
+  config.update(extra)
+  return config
+
+def LoggedInClient(app):
+  client = app.test_client()
+  response = client.post('/login', data={'username': 'admin',
+                                         'password': Password})
+  if response.status_code != 302:
+    raise Exception('Login failed (%d)' % response.status_code)
+  return client
+
+class PageBenchmark(object):
+  def __init__(self, db_path, protected_dir, page_cache_bytes=0):
+    self.app = create_app(AppConfig(db_path, PROTECTED_DIR=protected_dir,
+                                    PAGE_CACHE_BYTES=page_cache_bytes))
+    self.query_count = 0
+    from browser.models import db
+    with self.app.app_context():
+      event.listen(db.engine, 'before_cursor_execute', self.CountQuery)
+    self.client = LoggedInClient(self.app)
+
+  def CountQuery(self, *args):
+    self.query_count += 1
+
+  def Measure(self, url, num_requests):
+    latencies = []
+    queries = 0
+    size = 0
+    # Warm up the template and query caches.
+    self.client.get(url)
+    for n in range(num_requests):
+      self.query_count = 0
+      start = time.perf_counter()
+      response = self.client.get(url)
+      data = response.get_data()
+      latencies.append((time.perf_counter() - start) * 1000)
+      if response.status_code != 200:
+        raise Exception('%s returned %d' % (url, response.status_code))
+      queries += self.query_count
+      size = len(data)
+    latencies.sort()
+    return {
+      'p50_ms': Percentile(latencies, 0.5),
+      'p90_ms': Percentile(latencies, 0.9),
+      'p99_ms': Percentile(latencies, 0.99),
+      'mean_ms': sum(latencies) / len(latencies),
+      'queries': queries / num_requests,
+      'bytes': size,
+    }
+
+def RunSize(options, viewpoints_per_island, tmp_dir):
+  db_path = os.path.join(tmp_dir, 'riven-%d.sqlite' % viewpoints_per_island)
+  builder = DatabaseBuilder(options, viewpoints_per_island)
+  # Keep makedb's counts out of the JSON.
+  with contextlib.redirect_stdout(sys.stderr):
+    builder.Build(db_path)
+  bench = PageBenchmark(db_path, os.path.join(tmp_dir, 'protected'),
+                        64 << 20 if options.page_cache else 0)
+  island = builder.islands[0]
+  # A viewpoint from the middle of the island, with neighbours.
+  viewpoint = builder.viewpoints[len(island.viewpoints) // 2]
+  pages = {
+    'island': '/island/%s' % island.symbol,
+    'viewpoint': '/island/%s/viewpoint/%s' % (island.symbol, viewpoint.name),
+    'view': '/island/%s/viewpoint/%s/view/%s' % (island.symbol,
+                                                 viewpoint.name, 'view.0'),
+    'objects': '/objects',
+    'protected': '/protected/%s' % ImagePath,
+  }
+  results = dict()
+  for name in sorted(pages):
+    print('%d viewpoints/island: %s' % (viewpoints_per_island, pages[name]),
+          file=sys.stderr)
+    results[name] = bench.Measure(pages[name], options.requests)
+  return {'viewpoints_per_island': viewpoints_per_island, 'pages': results}
+
+if __name__ == '__main__':
+  options = Options()
+  options.Parse()
+  tmp_dir = tempfile.mkdtemp(prefix='bench_web')
+  results = []
+  try:
+    WriteProtectedFiles(os.path.join(tmp_dir, 'protected'))
+    for viewpoints_per_island in options.viewpoints:
+      results.append(RunSize(options, viewpoints_per_island, tmp_dir))
+  finally:
+    shutil.rmtree(tmp_dir)
+  if options.output:
+    with open(options.output, 'w') as f:
+      json.dump(results, f, indent=2)
+  else:
+    json.dump(results, sys.stdout, indent=2)
+    print()
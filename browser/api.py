@@ -0,0 +1,203 @@
+from flask import (
+  Blueprint,
+  abort,
+  jsonify,
+  request,
+  url_for
+)
+from flask_login import login_required
+from browser.models import (
+  Island,
+  Object,
+  RivenImage,
+  RivenMovie,
+  Viewpoint
+)
+from browser.navigation import FindRoute, FindViewpoint
+from browser.search import Search
+
+# Version 1 of the JSON API. Breaking changes go into a new blueprint with a
+# new prefix so that existing clients keep working.
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DefaultPageSize = 50
+MaxPageSize = 500
+
+def ProtectedUrl(path):
+  if not path:
+    return None
+  return url_for('browsing.protected', filename=path)
+
+# Resource name -> {field name -> function(row) returning the JSON value}.
+viewpoint_fields = {
+  'id': lambda v: v.id,
+  'name': lambda v: v.name,
+  'island': lambda v: chr(v.island),
+  'position': lambda v: v.position,
+  'thumbnail': lambda v: ProtectedUrl(v.thumbnail),
+  'thumbnail2x': lambda v: ProtectedUrl(v.thumbnail2x),
+  'url': lambda v: url_for('browsing.viewpoint', symbol=chr(v.island),
+                           vpt_name=v.name),
+}
+
+object_fields = {
+  'id': lambda o: o.id,
+  'name': lambda o: o.name,
+  'title': lambda o: o.title,
+  'thumbnail': lambda o: ProtectedUrl(o.thumbnail),
+  'thumbnail2x': lambda o: ProtectedUrl(o.thumbnail2x),
+  'url': lambda o: url_for('browsing.view_obj', obj_name=o.name),
+}
+
+image_fields = {
+  'id': lambda i: i.id,
+  'viewpoint': lambda i: i.viewpoint,
+  'filename': lambda i: i.filename,
+  'friendly': lambda i: i.friendly,
+  'url': lambda i: ProtectedUrl(i.store_path),
+  'width': lambda i: i.image_width,
+  'height': lambda i: i.image_height,
+}
+
+movie_fields = {
+  'id': lambda m: m.id,
+  'viewpoint': lambda m: m.viewpoint,
+  'filename': lambda m: m.filename,
+  'friendly': lambda m: m.friendly,
+  'url': lambda m: ProtectedUrl(m.h264_path),
+  'poster': lambda m: ProtectedUrl(m.poster_path),
+  'preview': lambda m: ProtectedUrl(m.preview_path),
+  'width': lambda m: m.movie_width,
+  'height': lambda m: m.movie_height,
+}
+
+def SelectFields(all_fields):
+  """Return the (name, getter) pairs requested by the "fields" argument.
+
+  All fields are returned when the argument is absent."""
+  names = request.args.get('fields')
+  if not names:
+    return sorted(all_fields.items())
+  selected = []
+  for name in names.split(','):
+    name = name.strip()
+    if name not in all_fields:
+      abort(400)
+    selected.append((name, all_fields[name]))
+  return selected
+
+def PageSize():
+  try:
+    limit = int(request.args.get('limit', DefaultPageSize))
+  except ValueError:
+    abort(400)
+  return max(1, min(limit, MaxPageSize))
+
+def KeysetPage(query, key_column, key, after, limit):
+  """Fetch one page of |query| ordered by |key_column|.
+
+  |after| is the key of the last row of the previous page (or None for the
+  first page). Returns a tuple of (rows, next_key) where next_key is None
+  when there are no more rows. Unlike OFFSET paging this never rescans the
+  rows of earlier pages."""
+  if after is not None:
+    query = query.filter(key_column > after)
+  rows = query.order_by(key_column).limit(limit + 1).all()
+  next_key = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_key = key(rows[-1])
+  return (rows, next_key)
+
+def IntArg(name):
+  value = request.args.get(name)
+  if value is None:
+    return None
+  try:
+    return int(value)
+  except ValueError:
+    abort(400)
+
+def PageResponse(rows, next_key, all_fields):
+  fields = SelectFields(all_fields)
+  items = [dict((name, getter(row)) for name, getter in fields)
+           for row in rows]
+  return jsonify(items=items, next=next_key)
+
+def FindIsland(symbol):
+  island = Island.query.filter(Island.symbol == symbol).first()
+  if not island:
+    abort(404)
+  return island
+
+@api.route('/islands/<symbol>/viewpoints')
+@login_required
+def viewpoints(symbol):
+  island = FindIsland(symbol)
+  query = Viewpoint.query.filter(Viewpoint.island == island.id)
+  rows, next_key = KeysetPage(query, Viewpoint.name, lambda v: v.name,
+                              request.args.get('after'), PageSize())
+  return PageResponse(rows, next_key, viewpoint_fields)
+
+@api.route('/objects')
+@login_required
+def objects():
+  rows, next_key = KeysetPage(Object.query, Object.id, lambda o: o.id,
+                              IntArg('after'), PageSize())
+  return PageResponse(rows, next_key, object_fields)
+
+@api.route('/images')
+@login_required
+def images():
+  query = RivenImage.query
+  viewpoint_id = IntArg('viewpoint')
+  if viewpoint_id is not None:
+    query = query.filter(RivenImage.viewpoint == viewpoint_id)
+  rows, next_key = KeysetPage(query, RivenImage.id, lambda i: i.id,
+                              IntArg('after'), PageSize())
+  return PageResponse(rows, next_key, image_fields)
+
+@api.route('/movies')
+@login_required
+def movies():
+  query = RivenMovie.query
+  viewpoint_id = IntArg('viewpoint')
+  if viewpoint_id is not None:
+    query = query.filter(RivenMovie.viewpoint == viewpoint_id)
+  rows, next_key = KeysetPage(query, RivenMovie.id, lambda m: m.id,
+                              IntArg('after'), PageSize())
+  return PageResponse(rows, next_key, movie_fields)
+
+@api.route('/search')
+@login_required
+def search():
+  return jsonify(items=Search(request.args.get('q', ''), PageSize()))
+
+@api.route('/route')
+@login_required
+def route():
+  """The moves leading from one viewpoint to another.
+
+  Viewpoints are given as <island_symbol>/<viewpoint_name>, for example
+  /api/v1/route?from=T/159&to=B/230."""
+  source = FindViewpoint(request.args.get('from', ''))
+  dest = FindViewpoint(request.args.get('to', ''))
+  if not source or not dest:
+    abort(404)
+  hops = FindRoute(source, dest)
+  if hops is None:
+    return jsonify(reachable=False, steps=[])
+  ids = set(hop.viewpoint_id for hop in hops)
+  viewpoints = dict()
+  if ids:
+    for v in Viewpoint.query.filter(Viewpoint.id.in_(ids)):
+      viewpoints[v.id] = v
+  steps = []
+  for hop in hops:
+    v = viewpoints[hop.viewpoint_id]
+    steps.append({
+      'direction': hop.direction,
+      'viewpoint': '%s/%s' % (chr(v.island), v.name),
+      'url': viewpoint_fields['url'](v),
+    })
+  return jsonify(reachable=True, steps=steps)
@@ -0,0 +1,100 @@
+"""Precompressed, fingerprinted bundles of the browsing pages' CSS and JS.
+
+bundle_static.py concatenates the static files each page uses into the
+bundles below, names each after a hash of its content, and stores it with
+its gzip (and, when the brotli module is installed, brotli) compressed
+versions in browser/dist, recording the names in manifest.json. The fonts
+the CSS refers to are fingerprinted too.
+
+The files are served with the best encoding the browser accepts and cached
+for a year, since a changed file gets a new name. Until bundle_static.py
+has been run, pages refer to the files in browser/static instead, and load
+jQuery, which isn't in the repository, from its CDN (falling back to the copy
+"make static" downloads).
+"""
+
+from flask import Blueprint, current_app, request, url_for, send_from_directory
+import hashlib
+import json
+import mimetypes
+import os
+
+# Bundle name -> the files in browser/static it is made of, in order.
+Bundles = {
+  'base.css': ['css/bootstrap.min.css',
+               'css/ie10-viewport-bug-workaround.css',
+               'css/main.css'],
+  'login.css': ['css/bootstrap.min.css'],
+  'base.js': ['js/jquery.min.js',
+              'js/bootstrap.min.js',
+              'js/ie10-viewport-bug-workaround.js',
+              'js/search.js'],
+  'unveil.js': ['js/jquery.unveil.js'],
+  'island.js': ['js/infinite_scroll.js'],
+  'objects.js': ['js/jquery.unveil.js', 'js/infinite_scroll.js'],
+  'viewpoint.js': ['js/jquery.unveil.js', 'js/viewpoint_nav.js',
+                   'js/movie_preview.js'],
+  'object.js': ['js/movie_preview.js'],
+}
+
+# Where the pages load jQuery from until the bundles are built.
+JQueryCdnUrl = 'https://ajax.googleapis.com/ajax/libs/jquery/1.12.4/jquery.min.js'
+JQueryPath = 'js/jquery.min.js'
+
+# Suffix of each precompressed file, by preference.
+Encodings = [('br', '.br'), ('gzip', '.gz')]
+
+CacheSeconds = 365 * 24 * 60 * 60
+
+assets = Blueprint('assets', __name__)
+
+class AssetManifest(object):
+  def __init__(self, dist_dir):
+    self.dist_dir = dist_dir
+    manifest_path = os.path.join(dist_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+      with open(manifest_path, 'rb') as f:
+        data = f.read()
+      self.files = json.loads(data.decode('utf-8'))
+      # Identifies the bundles the pages link to.
+      self.version = hashlib.sha1(data).hexdigest()[:12]
+    else:
+      self.files = None
+      self.version = 'static'
+
+  def Urls(self, bundle):
+    """The URLs to include for |bundle|."""
+    if self.files is None:
+      # base.html loads jQuery from its CDN.
+      return [url_for('browsing.static', filename=path)
+              for path in Bundles[bundle] if path != JQueryPath]
+    return [url_for('assets.dist', filename=self.files[bundle])]
+
+@assets.route('/browsing/dist/<filename>')
+def dist(filename):
+  dist_dir = current_app.extensions['asset_manifest'].dist_dir
+  mimetype = mimetypes.guess_type(filename)[0]
+  for encoding, suffix in Encodings:
+    if request.accept_encodings[encoding] and \
+       os.path.exists(os.path.join(dist_dir, filename + suffix)):
+      response = send_from_directory(dist_dir, filename + suffix,
+                                     mimetype=mimetype,
+                                     cache_timeout=CacheSeconds)
+      response.headers['Content-Encoding'] = encoding
+      break
+  else:
+    response = send_from_directory(dist_dir, filename, mimetype=mimetype,
+                                   cache_timeout=CacheSeconds)
+  response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % \
+                                      CacheSeconds
+  response.vary.add('Accept-Encoding')
+  return response
+
+def InitAssets(app, dist_dir):
+  manifest = AssetManifest(dist_dir)
+  app.extensions['asset_manifest'] = manifest
+  app.jinja_env.globals['bundle_urls'] = manifest.Urls
+  app.jinja_env.globals['bundles_built'] = manifest.files is not None
+  app.jinja_env.globals['jquery_cdn_url'] = JQueryCdnUrl
+  app.jinja_env.globals['jquery_path'] = JQueryPath
+  app.register_blueprint(assets)
@@ -0,0 +1,212 @@
+"""Derivatives (movie GIFs, H.264 transcodes, posters and previews) made on
+first request.
+
+When makedb is run with --lazy-derivatives it doesn't transcode the movies,
+and records in the derivatives table what each derivative would be made
+from. The first request for one runs the transcode and stores the result in
+a disk cache of bounded size, from which the least recently used files are
+evicted.
+
+The cache index is an SQLite database next to the cached files, made with
+the cache directory on the first derivative requested, so that the browser
+needs no writable directory when it has none. It also counts the requests
+per derivative, which the warm-up command uses to pre-generate the
+derivatives of the most visited islands. The requests are recorded in
+memory and written to the index at most every few seconds, rather than in a
+transaction per request.
+
+A derivative is opened before it is returned, so evicting it, in this
+process or another one, never pulls it from under a request serving it.
+
+The movie sources must be on the server (deploy.sh ships those of a lazy
+build), as must ffmpeg.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+class MissingSourceException(Exception):
+  pass
+
+def DerivativeCommand(kind, source, outfile):
+  """The command making the |kind| derivative of |source| into |outfile|."""
+  if kind == 'movie gif':
+    return ['ffmpeg', '-loglevel', 'error', '-y', '-i', source, outfile]
+  if kind == 'movie h264':
+    return ['ffmpeg', '-loglevel', 'error', '-y', '-i', source, '-b', '200k',
+            '-bt', '240k', '-vcodec', 'libx264', '-crf', '23', outfile]
+  if kind == 'movie poster':
+    # The frame the thumbnails are made from.
+    return ['ffmpeg', '-loglevel', 'error', '-y', '-i', source, '-ss',
+            '00:00:01.000', '-vframes', '1', '-q:v', '3', outfile]
+  if kind == 'movie preview':
+    # The first seconds, silent, at half size and a low bitrate, to loop.
+    return ['ffmpeg', '-loglevel', 'error', '-y', '-i', source, '-t', '3',
+            '-an', '-vf', 'scale=trunc(iw/4)*2:-2', '-vcodec', 'libx264',
+            '-crf', '30', '-maxrate', '100k', '-bufsize', '200k',
+            '-movflags', '+faststart', outfile]
+  raise ValueError('Unknown derivative kind: %s' % kind)
+
+class DerivativeCache(object):
+  # Seconds between the writes of the requests recorded to the index.
+  touch_interval = 5.0
+
+  def __init__(self, protected_dir, cache_dir, max_bytes):
+    self.protected_dir = protected_dir
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.index_path = os.path.join(cache_dir, 'index.sqlite')
+    self.lock = threading.Lock()
+    self.index_ready = False
+    self.touches = dict()  # path -> [island, hits, last_access], unwritten.
+    self.last_flush = time.time()
+
+  def OpenIndex(self):
+    """Make the cache directory and its index, once."""
+    with self.lock:
+      if self.index_ready:
+        return
+      if not os.path.exists(self.cache_dir):
+        try:
+          os.makedirs(self.cache_dir)
+        except OSError:
+          if not os.path.isdir(self.cache_dir):
+            raise
+      with self.Transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS entries
+                     (path TEXT PRIMARY KEY,
+                      island TEXT,
+                      hits INTEGER,
+                      size INTEGER,
+                      last_access REAL)''')
+      self.index_ready = True
+
+  @contextmanager
+  def Transaction(self):
+    conn = sqlite3.connect(self.index_path, timeout=30)
+    try:
+      with conn:
+        yield conn
+    finally:
+      conn.close()
+
+  def CachePath(self, path):
+    return os.path.join(self.cache_dir, path)
+
+  def Get(self, path, kind, source, island):
+    """The cached file of derivative |path|, opened, made from the |source|
+    file (both relative to the protected directory) if not already cached."""
+    cache_path = self.CachePath(path)
+    try:
+      f = open(cache_path, 'rb')
+    except FileNotFoundError:
+      self.Generate(path, kind, source, island)
+      f = open(cache_path, 'rb')
+    self.Touch(path, island)
+    return f
+
+  def Generate(self, path, kind, source, island):
+    """Make derivative |path| into the cache.
+
+    Raises MissingSourceException if |source| isn't there, or the error of
+    ffmpeg if it fails."""
+    source_path = os.path.join(self.protected_dir, source)
+    if not os.path.exists(source_path):
+      raise MissingSourceException(source)
+    cache_path = self.CachePath(path)
+    out_dir = os.path.dirname(cache_path)
+    if not os.path.exists(out_dir):
+      try:
+        os.makedirs(out_dir)
+      except OSError:
+        pass  # Made by a concurrent request.
+    # The lock file serializes the requests for one derivative, whether in
+    # this process or another one, so it is only made once.
+    with open(cache_path + '.lock', 'w') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      if os.path.exists(cache_path):
+        return
+      tmp_path = '%s.tmp%s' % (cache_path, os.path.splitext(cache_path)[1])
+      try:
+        subprocess.check_call(DerivativeCommand(kind, source_path, tmp_path))
+      except Exception:
+        if os.path.exists(tmp_path):
+          os.remove(tmp_path)
+        raise
+      os.rename(tmp_path, cache_path)
+    size = os.path.getsize(cache_path)
+    self.OpenIndex()
+    with self.Transaction() as conn:
+      conn.execute('INSERT OR IGNORE INTO entries VALUES (?, ?, 0, NULL, 0)',
+                   (path, island))
+      conn.execute('UPDATE entries SET size = ?, last_access = ? WHERE path = ?',
+                   (size, time.time(), path))
+    self.Evict(keep=path)
+
+  def Touch(self, path, island):
+    """Record a request for |path|, written to the index with the others
+    of the last touch_interval seconds."""
+    now = time.time()
+    with self.lock:
+      touch = self.touches.setdefault(path, [island, 0, now])
+      touch[1] += 1
+      touch[2] = now
+      due = now - self.last_flush >= self.touch_interval
+    if due:
+      self.Flush()
+
+  def Flush(self):
+    """Write the requests recorded by Touch() to the index."""
+    self.OpenIndex()
+    with self.lock:
+      touches = self.touches
+      self.touches = dict()
+      self.last_flush = time.time()
+    if not touches:
+      return
+    with self.Transaction() as conn:
+      conn.executemany(
+          'INSERT OR IGNORE INTO entries VALUES (?, ?, 0, NULL, 0)',
+          [(path, touch[0]) for path, touch in touches.items()])
+      conn.executemany('''UPDATE entries SET hits = hits + ?,
+                          last_access = MAX(last_access, ?) WHERE path = ?''',
+                       [(touch[1], touch[2], path)
+                        for path, touch in touches.items()])
+
+  def Evict(self, keep=None):
+    """Delete the least recently used files until the cache fits."""
+    # The order of the files is that of their last requests.
+    self.Flush()
+    with self.Transaction() as conn:
+      total = conn.execute('SELECT SUM(size) FROM entries').fetchone()[0] or 0
+      if total <= self.max_bytes:
+        return
+      rows = conn.execute('''SELECT path, size FROM entries
+                             WHERE size IS NOT NULL
+                             ORDER BY last_access''').fetchall()
+      for path, size in rows:
+        if total <= self.max_bytes:
+          break
+        if path == keep:
+          continue
+        try:
+          os.remove(self.CachePath(path))
+        except OSError:
+          pass
+        # The hits are kept for the warm-up.
+        conn.execute('UPDATE entries SET size = NULL WHERE path = ?', (path,))
+        total -= size
+
+  def MostVisitedIslands(self, count):
+    if not os.path.exists(self.index_path):
+      return []
+    self.Flush()
+    with self.Transaction() as conn:
+      return [row[0] for row in conn.execute(
+          '''SELECT island FROM entries GROUP BY island
+             ORDER BY SUM(hits) DESC LIMIT ?''', (count,))]
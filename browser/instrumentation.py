@@ -0,0 +1,110 @@
+"""Per-request SQL and template timing.
+
+When INSTRUMENT_REQUESTS is set, every SQL statement run while handling a
+request is counted and timed, and each response gets a Server-Timing header:
+
+  Server-Timing: db;dur=3.2;desc="12 queries", template;dur=1.4, total;dur=6.0
+
+which browsers show in their developer tools. The template time excludes the
+queries run from within the template (lazy relationships). Statements slower
+than SLOW_QUERY_MS are logged, with their parameters, to SLOW_QUERY_LOG (or
+to stderr when it isn't set).
+
+The cost is a couple of perf_counter() calls per statement, so it can be left
+on in production.
+"""
+
+from flask import g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logging
+import time
+
+slow_query_log = logging.getLogger('browser.slow_queries')
+
+class RequestStats(object):
+  def __init__(self, slow_query_ms):
+    self.start = time.perf_counter()
+    self.slow_query_ms = slow_query_ms
+    self.num_queries = 0
+    self.db_time = 0.0
+    self.template_time = 0.0
+    self.template_start = None
+
+  def ServerTiming(self):
+    total = time.perf_counter() - self.start
+    return 'db;dur=%.1f;desc="%d queries", template;dur=%.1f, ' \
+           'total;dur=%.1f' % (self.db_time * 1000, self.num_queries,
+                               self.template_time * 1000, total * 1000)
+
+def CurrentStats():
+  """The RequestStats of the request being handled, if it is instrumented."""
+  if not has_request_context():
+    return None
+  return g.get('request_stats')
+
+def BeforeCursorExecute(conn, cursor, statement, parameters, context,
+                        executemany):
+  # Kept on the statement's execution context rather than on the connection,
+  # which outlives the request, so a statement which fails leaves nothing
+  # behind.
+  if context is not None and CurrentStats():
+    context.request_query_start = time.perf_counter()
+
+def AfterCursorExecute(conn, cursor, statement, parameters, context,
+                       executemany):
+  stats = CurrentStats()
+  start = getattr(context, 'request_query_start', None)
+  if not stats or start is None:
+    return
+  elapsed = time.perf_counter() - start
+  stats.num_queries += 1
+  stats.db_time += elapsed
+  if elapsed * 1000 >= stats.slow_query_ms:
+    slow_query_log.warning('%.1f ms %s: %s %r', elapsed * 1000, request.path,
+                           ' '.join(statement.split()), parameters)
+
+def BeforeRenderTemplate(app, template, context):
+  stats = CurrentStats()
+  if stats:
+    stats.template_start = (time.perf_counter(), stats.db_time)
+
+def TemplateRendered(app, template, context):
+  stats = CurrentStats()
+  if stats and stats.template_start:
+    start, db_time = stats.template_start
+    stats.template_time += (time.perf_counter() - start) - \
+                           (stats.db_time - db_time)
+    stats.template_start = None
+
+def Instrument(app):
+  """Instrument |app| if INSTRUMENT_REQUESTS is set in its configuration."""
+  if not app.config.get('INSTRUMENT_REQUESTS'):
+    return
+  slow_query_ms = app.config.get('SLOW_QUERY_MS', 100)
+  if app.config.get('SLOW_QUERY_LOG'):
+    handler = logging.FileHandler(app.config['SLOW_QUERY_LOG'])
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    slow_query_log.addHandler(handler)
+    slow_query_log.propagate = False
+
+  # Listening on the Engine class catches the engines Flask-SQLAlchemy
+  # creates lazily. Statements run outside an instrumented request are
+  # ignored.
+  if not event.contains(Engine, 'before_cursor_execute', BeforeCursorExecute):
+    event.listen(Engine, 'before_cursor_execute', BeforeCursorExecute)
+    event.listen(Engine, 'after_cursor_execute', AfterCursorExecute)
+  before_render_template.connect(BeforeRenderTemplate, app)
+  template_rendered.connect(TemplateRendered, app)
+
+  @app.before_request
+  def StartRequest():
+    g.request_stats = RequestStats(slow_query_ms)
+
+  @app.after_request
+  def AddServerTiming(response):
+    stats = CurrentStats()
+    if stats:
+      response.headers['Server-Timing'] = stats.ServerTiming()
+    return response
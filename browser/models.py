@@ -15,6 +15,17 @@ class Globals(db.Model, UserMixin):
   thumbnail_height = db.Column('thumbnail_height', db.Integer)
   thumbnail2x_width = db.Column('thumbnail2x_width', db.Integer)
   thumbnail2x_height = db.Column('thumbnail2x_height', db.Integer)
+  build_id = db.Column('build_id', db.String)
+  build_profile = db.Column('build_profile', db.String)
+
+def BuildId():
+  """The build of the database the session reads, remembered on its
+  connection."""
+  info = db.session.connection().info
+  if 'build_id' not in info:
+    g = Globals.query.filter(Globals.global_id == 1).first()
+    info['build_id'] = g.build_id
+  return info['build_id']
 
 class User(db.Model, UserMixin):
   __tablename__ = 'users'
@@ -54,6 +65,7 @@ class Position(db.Model):
   id = db.Column('position_id', db.Integer, primary_key = True)
   name = db.Column('name', db.String(128))
   thumbnail = db.Column(db.String(256))
+  thumbnail_webp = db.Column(db.String(256))
   island = db.Column('island', db.ForeignKey('islands.island_id'),
                      nullable=False)
 
@@ -101,6 +113,8 @@ class RivenImage(db.Model):
   file_path = db.Column(db.String(256))
   image_width = db.Column(db.Integer)
   image_height = db.Column(db.Integer)
+  content_hash = db.Column(db.String(40))
+  store_path = db.Column(db.String(256))
 
 class RivenMovie(db.Model):
   __tablename__ = 'rivenmovs'
@@ -114,6 +128,10 @@ class RivenMovie(db.Model):
   h264_path = db.Column(db.String(256))
   movie_width = db.Column(db.Integer)
   movie_height = db.Column(db.Integer)
+  content_hash = db.Column(db.String(40))
+  poster_path = db.Column(db.String(256))
+  preview_path = db.Column(db.String(256))
+  store_path = db.Column(db.String(256))
 
 object_movies = db.Table('object_movies',
   db.Column('object', db.Integer, db.ForeignKey('objects.object_id')),
@@ -131,3 +149,17 @@ class Object(db.Model):
     backref=db.backref('objects', lazy='dynamic'))
   movies = db.relationship('RivenMovie', secondary=object_movies,
     backref=db.backref('objects', lazy='dynamic'))
+
+class Derivative(db.Model):
+  __tablename__ = 'derivatives'
+  path = db.Column(db.String(256), primary_key = True)
+  kind = db.Column(db.String(16))
+  source = db.Column(db.String(256))
+  island = db.Column(db.String(2))
+
+class PackEntry(db.Model):
+  __tablename__ = 'pack_index'
+  path = db.Column(db.String(256), primary_key = True)
+  pack = db.Column(db.String(64))
+  offset = db.Column(db.Integer)
+  size = db.Column(db.Integer)
@@ -0,0 +1,106 @@
+from browser.models import db, Island, Viewpoint
+import heapq
+
+# Guards against looping forever should the route tables be inconsistent.
+MaxRouteLength = 10000
+
+class Hop(object):
+  def __init__(self, viewpoint_id, island_id, direction):
+    self.viewpoint_id = viewpoint_id
+    self.island_id = island_id
+    self.direction = direction
+
+def FindViewpoint(ref):
+  """Return the Viewpoint for a "<island_symbol>/<viewpoint_name>" reference."""
+  items = ref.split('/')
+  if len(items) != 2:
+    return None
+  island = Island.query.filter(Island.symbol == items[0]).first()
+  if not island:
+    return None
+  return Viewpoint.query.filter(Viewpoint.island == island.id,
+                                Viewpoint.name == items[1]).first()
+
+def IslandHops(source_id, island_id, dest_id):
+  """Return the list of Hops from |source_id| to |dest_id| within island
+  |island_id|, or None."""
+  hops = []
+  current = source_id
+  while current != dest_id:
+    if len(hops) >= MaxRouteLength:
+      return None
+    row = db.session.execute(
+        db.text('SELECT next_hop, direction FROM routes '
+                'WHERE source = :source AND dest = :dest'),
+        {'source': current, 'dest': dest_id}).first()
+    if not row or row[0] is None:
+      return None
+    current = row[0]
+    hops.append(Hop(current, island_id, row[1]))
+  return hops
+
+def FindRoute(source, dest):
+  """Return the list of Hops leading from Viewpoint |source| to |dest|.
+
+  The route is the shortest path over the source, the destination and the
+  viewpoints at either end of a gateway, which are linked within an island
+  by the distances of the routes table, and between islands by the
+  gateways. Every gateway is so considered, not just those of the first
+  island on the way. Returns None if |dest| can't be reached."""
+  gateways = db.session.execute(
+      db.text('SELECT island, next_island, exit_viewpoint, entry_viewpoint, '
+              'direction FROM gateways')).fetchall()
+  island_of = {source.id: source.island, dest.id: dest.island}
+  starts = set([source.id])  # Where a walk within an island may start...
+  ends = set([dest.id])      # ...and end.
+  edges = dict()  # Viewpoint id -> [(distance, viewpoint id, gateway Hop)]
+  for island_id, next_island_id, exit_id, entry_id, direction in gateways:
+    island_of[exit_id] = island_id
+    island_of[entry_id] = next_island_id
+    starts.add(entry_id)
+    ends.add(exit_id)
+    edges.setdefault(exit_id, []).append(
+        (1, entry_id, Hop(entry_id, next_island_id, direction)))
+  query = db.text('SELECT source, dest, distance FROM routes '
+                  'WHERE source IN :starts AND dest IN :ends').bindparams(
+                      db.bindparam('starts', expanding=True),
+                      db.bindparam('ends', expanding=True))
+  for start, end, distance in db.session.execute(
+      query, {'starts': list(starts), 'ends': list(ends)}):
+    if start != end:
+      edges.setdefault(start, []).append((distance, end, None))
+
+  # Dijkstra's, remembering how each viewpoint was reached.
+  distances = {source.id: 0}
+  reached_by = dict()  # Viewpoint id -> (previous viewpoint id, gateway Hop)
+  queue = [(0, source.id)]
+  while queue:
+    distance, viewpoint_id = heapq.heappop(queue)
+    if viewpoint_id == dest.id:
+      break
+    if distance > distances[viewpoint_id]:
+      continue
+    for length, other_id, gateway in edges.get(viewpoint_id, []):
+      if distance + length < distances.get(other_id, MaxRouteLength):
+        distances[other_id] = distance + length
+        reached_by[other_id] = (viewpoint_id, gateway)
+        heapq.heappush(queue, (distance + length, other_id))
+  if dest.id not in distances:
+    return None
+
+  legs = []
+  viewpoint_id = dest.id
+  while viewpoint_id != source.id:
+    previous_id, gateway = reached_by[viewpoint_id]
+    legs.append((previous_id, viewpoint_id, gateway))
+    viewpoint_id = previous_id
+  hops = []
+  for start, end, gateway in reversed(legs):
+    if gateway:
+      hops.append(gateway)
+      continue
+    island_hops = IslandHops(start, island_of[start], end)
+    if island_hops is None:
+      return None
+    hops.extend(island_hops)
+  return hops
@@ -0,0 +1,124 @@
+"""Serving of the protected files from the packs makedb --pack writes.
+
+Each island's files (its images, thumbnails, position animations, movie
+transcodes and navigation bundle) are concatenated into one pack,
+browser/protected/packs/<island_symbol>.<hash>.pack, and the pack_index table
+of riven.sqlite records the pack, offset and size of each. Object thumbnails
+are in objects.<hash>.pack. A pack is named after a hash of its content, so
+it is never rewritten: a new build writes new packs, and the old ones are
+left to the old database until it is replaced.
+
+A pack is memory mapped once per process, and a file is served from the
+mapping, with ranges and conditional requests, without opening it. The
+mappings are kept by the build of the database being read, for the two
+newest builds seen, as the requests still on the old database finish while
+the new one is served. Those of older builds are dropped, each unmapped as
+soon as the last response reading it is done, so the packs no longer
+referred to can be removed from the disk.
+"""
+
+from browser.models import BuildId
+from collections import OrderedDict
+from flask import current_app, request
+from werkzeug.wsgi import wrap_file
+import io
+import mimetypes
+import mmap
+import os
+import threading
+
+class PackMember(io.RawIOBase):
+  """A read-only file over |size| bytes of |data| from |offset|."""
+  def __init__(self, data, offset, size):
+    self.data = data
+    self.offset = offset
+    self.size = size
+    self.pos = 0
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def seek(self, pos, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      pos += self.pos
+    elif whence == io.SEEK_END:
+      pos += self.size
+    self.pos = max(0, min(pos, self.size))
+    return self.pos
+
+  def tell(self):
+    return self.pos
+
+  def readinto(self, b):
+    count = min(len(b), self.size - self.pos)
+    start = self.offset + self.pos
+    b[:count] = self.data[start:start + count]
+    self.pos += count
+    return count
+
+def FileResponse(f, path, size, etag):
+  """The response serving the open file |f| of |size| bytes, named |path|,
+  as send_from_directory would."""
+  mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+  response = current_app.response_class(
+      wrap_file(request.environ, f), mimetype=mimetype,
+      direct_passthrough=True)
+  response.content_length = size
+  max_age = current_app.get_send_file_max_age(path)
+  response.cache_control.public = True
+  if max_age is not None:
+    response.cache_control.max_age = max_age
+  response.set_etag(etag)
+  return response.make_conditional(request, accept_ranges=True,
+                                   complete_length=size)
+
+class PackArchive(object):
+  # The builds whose mappings are kept.
+  max_builds = 2
+
+  def __init__(self, pack_dir):
+    self.pack_dir = pack_dir
+    self.lock = threading.Lock()
+    # Build ID -> {pack name -> mmap}, in the order the builds were seen.
+    self.builds = OrderedDict()
+    self.dropped = set()  # The builds whose mappings were dropped.
+
+  def Map(self, pack):
+    """The mapping of |pack|. Raises FileNotFoundError when it was removed."""
+    build_id = BuildId()
+    with self.lock:
+      if build_id in self.dropped:
+        # A late request on a database two builds old: mapped for it alone.
+        return self.Open(pack)
+      maps = self.builds.get(build_id)
+      if maps is None:
+        maps = self.builds[build_id] = dict()
+        while len(self.builds) > PackArchive.max_builds:
+          # The PackMembers still reading its maps keep them mapped.
+          old_build_id, _ = self.builds.popitem(last=False)
+          self.dropped.add(old_build_id)
+      if pack not in maps:
+        # The packs a build didn't change are shared with the previous one.
+        for other in self.builds.values():
+          if pack in other:
+            maps[pack] = other[pack]
+            break
+        else:
+          maps[pack] = self.Open(pack)
+      return maps[pack]
+
+  def Open(self, pack):
+    with open(os.path.join(self.pack_dir, pack), 'rb') as f:
+      return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def Response(self, entry):
+    """The response serving the file of the PackEntry |entry|, as
+    send_from_directory would."""
+    member = PackMember(self.Map(entry.pack), entry.offset, entry.size)
+    # Packs are never rewritten, so their name and the offset identify the
+    # content.
+    return FileResponse(member, entry.path, entry.size,
+                        '%s-%d' % (entry.pack, entry.offset))
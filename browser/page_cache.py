@@ -0,0 +1,149 @@
+"""Cache of the rendered browsing pages.
+
+riven.sqlite doesn't change between makedb runs, so a page is determined by
+its URL, the build of the database (the build_id makedb stores in globals)
+and the static bundles it links to. Pages are kept in memory, in a least
+recently used cache of PAGE_CACHE_BYTES, and when PAGE_CACHE_PATH is set,
+in an SQLite file shared by the app's processes, so a page rendered by one
+WSGI process is served by the others. A cached page is served without
+querying the database or rendering the template.
+
+The build ID is read once per database connection, and kept with it. With
+SERVE_IMMUTABLE, connections are replaced when the database is, and a
+request in flight keys its page with the build it is reading. The pages of
+previous builds are then never hit again and age out.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import current_app, request, Response
+from functools import wraps
+from browser.profiling import Profiling
+import sqlite3
+import threading
+import time
+
+class PageStore(object):
+  """Pages in an SQLite file, shared by processes."""
+  def __init__(self, path, max_bytes):
+    self.path = path
+    self.max_bytes = max_bytes
+    with self.Transaction() as conn:
+      conn.execute('PRAGMA journal_mode=WAL')
+      conn.execute('''CREATE TABLE IF NOT EXISTS pages
+                   (key TEXT PRIMARY KEY,
+                    build_id TEXT,
+                    mimetype TEXT,
+                    body BLOB,
+                    stored REAL)''')
+
+  @contextmanager
+  def Transaction(self):
+    conn = sqlite3.connect(self.path, timeout=30)
+    try:
+      with conn:
+        yield conn
+    finally:
+      conn.close()
+
+  def Get(self, key):
+    with self.Transaction() as conn:
+      return conn.execute('SELECT body, mimetype FROM pages WHERE key = ?',
+                          (key,)).fetchone()
+
+  def Put(self, key, build_id, body, mimetype):
+    with self.Transaction() as conn:
+      # Pages of other builds can't be hit anymore.
+      conn.execute('DELETE FROM pages WHERE build_id != ?', (build_id,))
+      conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+                   (key, build_id, mimetype, body, time.time()))
+      total = conn.execute('SELECT SUM(LENGTH(body)) FROM pages').fetchone()[0]
+      if total > self.max_bytes:
+        for old_key, size in conn.execute(
+            'SELECT key, LENGTH(body) FROM pages ORDER BY stored').fetchall():
+          if total <= self.max_bytes:
+            break
+          conn.execute('DELETE FROM pages WHERE key = ?', (old_key,))
+          total -= size
+
+class PageCache(object):
+  def __init__(self, render_version, max_bytes, store=None):
+    self.render_version = render_version
+    self.max_bytes = max_bytes
+    self.store = store
+    self.lock = threading.Lock()
+    self.pages = OrderedDict()  # Key -> (body, mimetype), oldest first.
+    self.size = 0
+
+  def BuildId(self):
+    """The build of the database the request reads."""
+    from browser.models import BuildId
+    return BuildId()
+
+  def Key(self):
+    args = '&'.join('%s=%s' % item
+                    for item in sorted(request.args.items(multi=True)))
+    return '%s %s %s?%s' % (self.BuildId(), self.render_version, request.path,
+                            args)
+
+  def Get(self, key):
+    with self.lock:
+      page = self.pages.pop(key, None)
+      if page:
+        # Now the most recently used.
+        self.pages[key] = page
+    if not page and self.store:
+      page = self.store.Get(key)
+      if page:
+        self.Remember(key, page)
+    return page
+
+  def Remember(self, key, page):
+    size = len(page[0])
+    if size > self.max_bytes:
+      return
+    with self.lock:
+      if key in self.pages:
+        return
+      self.pages[key] = page
+      self.size += size
+      while self.size > self.max_bytes:
+        old_key, old_page = self.pages.popitem(last=False)
+        self.size -= len(old_page[0])
+
+  def Put(self, key, body, mimetype):
+    self.Remember(key, (body, mimetype))
+    if self.store:
+      build_id = key.split(' ', 1)[0]
+      self.store.Put(key, build_id, body, mimetype)
+
+def CachedPage(view):
+  """Serve the page of |view| from the page cache, when enabled."""
+  @wraps(view)
+  def CachedView(*args, **kwargs):
+    cache = current_app.extensions.get('page_cache')
+    if cache is None or request.method != 'GET' or Profiling():
+      return view(*args, **kwargs)
+    key = cache.Key()
+    page = cache.Get(key)
+    if page:
+      response = Response(page[0], mimetype=page[1])
+      response.headers['X-Page-Cache'] = 'hit'
+      return response
+    response = current_app.make_response(view(*args, **kwargs))
+    if response.status_code == 200 and not response.direct_passthrough:
+      cache.Put(key, response.get_data(), response.mimetype)
+      response.headers['X-Page-Cache'] = 'miss'
+    return response
+  return CachedView
+
+def InitPageCache(app):
+  """Enable the page cache of |app| if PAGE_CACHE_BYTES is set."""
+  max_bytes = app.config.get('PAGE_CACHE_BYTES')
+  if not max_bytes:
+    return
+  store = None
+  if app.config.get('PAGE_CACHE_PATH'):
+    store = PageStore(app.config['PAGE_CACHE_PATH'], max_bytes)
+  app.extensions['page_cache'] = PageCache(
+      app.extensions['asset_manifest'].version, max_bytes, store)
@@ -0,0 +1,115 @@
+"""On-demand profiling of the browsing pages.
+
+When PROFILE_DIR is set, a browsing page request is profiled with cProfile,
+from the start of the view to the rendered template, when:
+
+  * the admin adds ?profile=1 to its URL. The page cache is then bypassed,
+    so the view and its template run.
+  * it is sampled: PROFILE_SAMPLE_RATE is the fraction of the requests
+    profiled (0.01 for 1%). Sampled requests are served as any other, from
+    the page cache when the page is in it.
+
+Each profile is written in pstats format (python3 -m pstats FILE, or
+snakeviz) to PROFILE_DIR/<time>-<pid>-<n>-<endpoint>-<ms>ms.pstats, where
+<n> counts the profiles of the process, so concurrent requests never write
+the same file, and the response names it in an X-Profile header.
+
+One request per process is profiled at a time: from Python 3.12 a second
+profiler can't be enabled while one is, and concurrent profiles would
+measure each other anyway. A request which would be profiled while another
+one is, or while another profiling tool is active, is served unprofiled,
+and if the admin asked for it, its X-Profile header says so.
+"""
+
+from datetime import datetime
+from flask import g, request
+from flask_login import current_user
+import cProfile
+import itertools
+import os
+import random
+import threading
+import time
+
+ProfileArg = 'profile'
+
+def Requested():
+  """Whether the admin asked for the request to be profiled."""
+  return request.args.get(ProfileArg) == '1' and \
+         current_user.is_authenticated and current_user.username == 'admin'
+
+def Profiling():
+  """Whether the request being handled was asked to be profiled."""
+  return g.get('profile_requested', False)
+
+def InitProfiling(app):
+  """Profile the pages of |app| on demand if PROFILE_DIR is set."""
+  profile_dir = app.config.get('PROFILE_DIR')
+  if not profile_dir:
+    return
+  sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+  try:
+    os.makedirs(profile_dir)
+  except OSError:
+    # Made by another process, or already there.
+    if not os.path.isdir(profile_dir):
+      raise
+  lock = threading.Lock()
+  profile_numbers = itertools.count(1)
+  # Held by the request being profiled.
+  profiling_lock = threading.Lock()
+
+  def StartProfiler():
+    """The profiler of the request, enabled, or None if another one is."""
+    if not profiling_lock.acquire(False):
+      return None
+    profiler = cProfile.Profile()
+    try:
+      profiler.enable()
+    except ValueError:
+      # Another profiling tool is active.
+      profiling_lock.release()
+      return None
+    return profiler
+
+  def StopProfiler(profiler):
+    profiler.disable()
+    profiling_lock.release()
+
+  @app.before_request
+  def StartProfile():
+    if request.blueprint != 'browsing' or request.endpoint == 'browsing.static':
+      return
+    g.profile_requested = Requested()
+    if g.profile_requested or random.random() < sample_rate:
+      g.profile_start = time.perf_counter()
+      profiler = StartProfiler()
+      if profiler:
+        g.profiler = profiler
+      elif g.profile_requested:
+        g.profile_busy = True
+
+  @app.after_request
+  def WriteProfile(response):
+    profiler = g.pop('profiler', None)
+    if not profiler:
+      if g.get('profile_busy'):
+        response.headers['X-Profile'] = 'busy'
+      return response
+    StopProfiler(profiler)
+    elapsed = time.perf_counter() - g.profile_start
+    with lock:
+      number = next(profile_numbers)
+    fname = '%s-%d-%d-%s-%dms.pstats' % (
+        datetime.now().strftime('%Y%m%dT%H%M%S'), os.getpid(), number,
+        request.endpoint, round(elapsed * 1000))
+    profiler.dump_stats(os.path.join(profile_dir, fname))
+    response.headers['X-Profile'] = fname
+    return response
+
+  @app.teardown_request
+  def StopProfile(exc):
+    # The request failed before after_request.
+    profiler = g.pop('profiler', None)
+    if profiler:
+      StopProfiler(profiler)
@@ -0,0 +1,55 @@
+from browser.models import db
+from flask import url_for
+import re
+
+# Matches the separators makedb's SearchIndex.Terms() splits names on.
+separators_re = re.compile(r'[^0-9A-Za-z]+')
+
+def MatchExpression(text):
+  """Convert user input into an FTS5 MATCH expression.
+
+  Every token must match, and the last one is matched as a prefix so that
+  results can be shown while the user is still typing.
+
+  >>> MatchExpression('ext.1550_s')
+  '"ext" "1550" "s"*'
+  """
+  tokens = [t.lower() for t in separators_re.split(text) if t]
+  if not tokens:
+    return None
+  terms = ['"%s"' % t for t in tokens]
+  terms[-1] += '*'
+  return ' '.join(terms)
+
+def ResultUrl(kind, island, viewpoint, name):
+  if kind == 'object':
+    return url_for('browsing.view_obj', obj_name=name)
+  if kind == 'viewpoint':
+    return url_for('browsing.viewpoint', symbol=island, vpt_name=viewpoint)
+  return url_for('browsing.view', symbol=island, vpt_name=viewpoint,
+                 view_name=name)
+
+def Search(text, limit):
+  """Return up to |limit| search results for |text|, best matches first."""
+  expression = MatchExpression(text)
+  if not expression:
+    return []
+  rows = db.session.execute(
+      db.text('SELECT kind, island, viewpoint, name, title FROM search '
+              'WHERE search MATCH :expression ORDER BY rank LIMIT :limit'),
+      {'expression': expression, 'limit': limit})
+  results = []
+  for kind, island, viewpoint, name, title in rows:
+    if kind == 'object':
+      label = name
+    elif kind == 'viewpoint':
+      label = '%s/%s' % (island, viewpoint)
+    else:
+      label = '%s/%s/%s' % (island, viewpoint, name)
+    results.append({
+      'kind': kind,
+      'label': label,
+      'title': title,
+      'url': ResultUrl(kind, island, viewpoint, name),
+    })
+  return results
@@ -0,0 +1,103 @@
+"""Read-only serving of riven.sqlite, switching to a new one when published.
+
+The web app never writes to the database, so when SERVE_IMMUTABLE is set it
+is opened with mode=ro&immutable=1: SQLite then takes no locks and doesn't
+look for a journal or check whether the file changed. Connections are kept
+open in a pool of SERVE_POOL_SIZE, or of the number of threads of the
+mod_wsgi process if greater. More are opened when more requests are served
+at once, and closed when they're done, but a connection is never closed
+while a request uses it.
+
+makedb (and rsync in deploy.sh) publish a new database by renaming it over
+the old one, so the old file is never modified: connections opened on it
+keep reading a consistent database until they are closed. The file is
+stat()ed at most every SERVE_CHECK_INTERVAL seconds, and when its inode,
+size or modification time changed, each connection is replaced on its next
+checkout, at the start of a request. A request in flight finishes
+on the database it started with.
+"""
+
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import QueuePool
+from urllib.request import pathname2url
+import os
+import sqlite3
+import time
+
+class ServingConnection(sqlite3.Connection):
+  """A connection recording the DatabaseFile, and its generation, it was
+  opened on."""
+  pass
+
+class DatabaseFile(object):
+  def __init__(self, path, check_interval):
+    self.path = os.path.abspath(path)
+    self.check_interval = check_interval
+    self.generation = None
+    self.checked = None
+
+  def Stat(self):
+    st = os.stat(self.path)
+    self.generation = (st.st_ino, st.st_size, st.st_mtime_ns)
+    self.checked = time.monotonic()
+    return self.generation
+
+  def Generation(self):
+    """The generation of the file, stat()ed at most every check_interval."""
+    if self.checked is None or \
+       time.monotonic() - self.checked >= self.check_interval:
+      return self.Stat()
+    return self.generation
+
+  def Connect(self):
+    # Stat before opening: if the file is replaced in between, the
+    # connection is to a newer file than recorded and is reopened once more.
+    generation = self.Stat()
+    conn = sqlite3.connect('file:%s?mode=ro&immutable=1' %
+                           pathname2url(self.path), uri=True,
+                           check_same_thread=False,
+                           factory=ServingConnection)
+    conn.database = self
+    conn.generation = generation
+    return conn
+
+class ServingPool(QueuePool):
+  """Connections reopened when the database is replaced."""
+  pass
+
+@event.listens_for(ServingPool, 'checkout')
+def CheckGeneration(dbapi_connection, connection_record, connection_proxy):
+  database = dbapi_connection.database
+  if dbapi_connection.generation != database.Generation():
+    # The pool invalidates the connection and checks out a new one.
+    raise DisconnectionError('%s was replaced' % database.path)
+
+def DatabasePath(app):
+  """The path of the database of |app|, relative to the app as
+  Flask-SQLAlchemy makes it."""
+  return os.path.join(app.root_path,
+                      make_url(app.config['SQLALCHEMY_DATABASE_URI']).database)
+
+def WsgiThreads():
+  """The number of threads of the mod_wsgi process, or 0 outside of
+  mod_wsgi."""
+  try:
+    import mod_wsgi
+  except ImportError:
+    return 0
+  return mod_wsgi.threads_per_process
+
+def ServingEngineOptions(app):
+  """The SQLALCHEMY_ENGINE_OPTIONS serving the database of |app|."""
+  config = app.config
+  database = DatabaseFile(DatabasePath(app),
+                          config.get('SERVE_CHECK_INTERVAL', 1.0))
+  return {
+    'creator': database.Connect,
+    'poolclass': ServingPool,
+    'pool_size': max(config.get('SERVE_POOL_SIZE', 32), WsgiThreads()),
+    # Never make a request wait for a connection.
+    'max_overflow': -1,
+  }
@@ -0,0 +1,58 @@
+/*
+ * Infinite scroll for the listing pages.
+ *
+ * The listing container carries the URL of the next page of the JSON API
+ * in its data-next-page attribute. When the page is scrolled close to the
+ * bottom the next page is fetched and appended, and the API response's
+ * "next" cursor becomes the following page.
+ */
+(function($) {
+  $.fn.infiniteScroll = function(options) {
+    var $listing = this;
+    var nextPage = $listing.data('next-page');
+    var loading = false;
+
+    function makeItem(item) {
+      var $a = $('<a class="btn btn-default position-btn"></a>');
+      $a.attr('href', item.url);
+      var $img = $('<img>');
+      $img.attr('src', options.placeholder);
+      $img.attr('data-src', item.thumbnail);
+      $img.attr('data-src-retina', item.thumbnail2x);
+      $img.attr('width', options.width);
+      $img.attr('height', options.height);
+      $a.append($img, $('<br>'), document.createTextNode(item.name));
+      return $a;
+    }
+
+    function nextUrl(cursor) {
+      var url = nextPage.replace(/([?&])after=[^&]*/, '$1after=' +
+                                 encodeURIComponent(cursor));
+      return url;
+    }
+
+    function loadMore() {
+      if (loading || !nextPage)
+        return;
+      if ($(window).scrollTop() + $(window).height() <
+          $(document).height() - options.threshold)
+        return;
+      loading = true;
+      $.getJSON(nextPage, function(page) {
+        var $items = $.map(page.items, makeItem);
+        $listing.append($items);
+        $($.map($items, function($a) { return $a.find('img')[0]; })).unveil();
+        nextPage = page.next === null ? null : nextUrl(page.next);
+        loading = false;
+        // The new items may not fill the window yet.
+        loadMore();
+      }).fail(function() {
+        loading = false;
+      });
+    }
+
+    $(window).on('scroll resize', loadMore);
+    loadMore();
+    return this;
+  };
+})(jQuery);
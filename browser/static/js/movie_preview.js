@@ -0,0 +1,52 @@
+/*
+ * Movie previews.
+ *
+ * Movies are rendered with their poster and preload="none", so nothing is
+ * downloaded until one is played. For those with a data-preview-src, the
+ * controls are hidden: hovering loops the short, silent preview, and a
+ * click switches to the full movie, with its controls.
+ */
+(function($) {
+  $.fn.moviePreview = function() {
+    return this.each(function() {
+      var video = this;
+      var preview = video.getAttribute('data-preview-src');
+      if (!preview) {
+        return;
+      }
+      var full = video.getAttribute('src');
+      var state = 'poster';
+      video.removeAttribute('src');
+      video.controls = false;
+      video.title = 'Click to play';
+      video.style.cursor = 'pointer';
+      video.load();
+
+      $(video).on('mouseenter', function() {
+        if (state === 'poster') {
+          state = 'preview';
+          video.muted = true;
+          video.src = preview;
+        }
+        if (state === 'preview') {
+          video.play();
+        }
+      }).on('mouseleave', function() {
+        if (state === 'preview') {
+          video.pause();
+        }
+      }).on('click', function() {
+        if (state === 'full') {
+          return;
+        }
+        state = 'full';
+        video.muted = false;
+        video.controls = true;
+        video.removeAttribute('title');
+        video.style.cursor = '';
+        video.src = full;
+        video.play();
+      });
+    });
+  };
+})(jQuery);
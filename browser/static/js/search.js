@@ -0,0 +1,43 @@
+/*
+ * Search box autocomplete.
+ *
+ * Suggestions are fetched from the JSON search API as the user types and
+ * are offered through the input's datalist. Picking a suggestion navigates
+ * straight to it.
+ */
+(function($) {
+  $.fn.searchAutocomplete = function(apiUrl) {
+    var $input = this;
+    var $list = $('#' + $input.attr('list'));
+    var urls = {};  // Suggestion label -> URL.
+    var pending = null;
+    var timer = null;
+
+    function update() {
+      var q = $input.val();
+      if (pending)
+        pending.abort();
+      if (!q)
+        return;
+      pending = $.getJSON(apiUrl, {q: q, limit: 10}, function(page) {
+        $list.empty();
+        urls = {};
+        $.each(page.items, function(i, item) {
+          urls[item.label] = item.url;
+          $list.append($('<option></option>').attr('value', item.label));
+        });
+      });
+    }
+
+    $input.on('input', function() {
+      var url = urls[$input.val()];
+      if (url) {
+        window.location = url;
+        return;
+      }
+      clearTimeout(timer);
+      timer = setTimeout(update, 100);
+    });
+    return this;
+  };
+})(jQuery);
@@ -0,0 +1,271 @@
+/*
+ * Client-side viewpoint navigation.
+ *
+ * makedb writes one JSON bundle per island (see Loader.IslandBundle) holding
+ * the viewpoint graph along with each viewpoint's images, movies and objects.
+ * When instant navigation is on, moving to another viewpoint of the same
+ * island is done by rendering it from the bundle instead of loading a new
+ * page, so only the new media is fetched. Rendered viewpoints are kept in
+ * memory so that going back to one is immediate.
+ */
+var ViewpointNav = (function($) {
+  var storageKey = 'instantViewpointNav';
+  var config = null;
+  var bundle = null;
+  var names = [];
+  var rendered = {};  // Viewpoint name -> rendered content element.
+  var current = null;
+
+  function compareNames(a, b) {
+    var na = parseInt(a, 10), nb = parseInt(b, 10);
+    if (!isNaN(na) && !isNaN(nb) && na != nb)
+      return na - nb;
+    return a < b ? -1 : (a > b ? 1 : 0);
+  }
+
+  function protectedUrl(path) {
+    // Derivatives the build didn't make are null.
+    return path ? config.protectedRoot + path : null;
+  }
+
+  function viewpointUrl(name) {
+    return config.viewpointRoot + encodeURIComponent(name);
+  }
+
+  function isLocal(name) {
+    return name.indexOf('/') < 0 && bundle.viewpoints.hasOwnProperty(name);
+  }
+
+  function thumbnailImg(thumbnail, thumbnail2x) {
+    var $img = $('<img>');
+    $img.attr({
+      'src': config.placeholder,
+      'data-src': protectedUrl(thumbnail),
+      'data-src-retina': protectedUrl(thumbnail2x),
+      'width': config.thumbnailWidth,
+      'height': config.thumbnailHeight
+    });
+    return $img;
+  }
+
+  function viewpointLink(name) {
+    var $a = $('<a></a>');
+    if (isLocal(name)) {
+      $a.attr('href', viewpointUrl(name));
+      $a.attr('data-viewpoint', name);
+    } else {
+      var parts = name.split('/');
+      $a.attr('href', config.islandsRoot + parts[0] + '/viewpoint/' +
+              encodeURIComponent(parts[1]));
+    }
+    return $a;
+  }
+
+  // Mirrors CreateViewpointMatrix() in views.py.
+  function createMatrix(name) {
+    var m = [[null, null, null, null], [null, null, null, null],
+             [null, null, null, null]];
+    function fillColumn(vpt, col) {
+      if (!isLocal(vpt))
+        return;
+      var n = bundle.viewpoints[vpt].n;
+      if (n.u)
+        m[0][col] = n.u;
+      m[1][col] = vpt;
+      if (n.d)
+        m[2][col] = n.d;
+    }
+    var n = bundle.viewpoints[name].n;
+    fillColumn(name, 1);
+    if (n.l)
+      fillColumn(n.l, 0);
+    if (n.r) {
+      fillColumn(n.r, 2);
+      if (isLocal(n.r) && bundle.viewpoints[n.r].n.r)
+        fillColumn(bundle.viewpoints[n.r].n.r, 3);
+    }
+    return m;
+  }
+
+  function renderMatrix(name) {
+    var m = createMatrix(name);
+    var count = 0;
+    var $table = $('<table class="connections"></table>');
+    for (var r = 0; r < m.length; r++) {
+      var $tr = $('<tr></tr>');
+      for (var c = 0; c < m[r].length; c++) {
+        var $td = $('<td></td>');
+        var cell = m[r][c];
+        if (cell) {
+          count++;
+          var vpt = bundle.viewpoints[cell];
+          var $a = viewpointLink(cell);
+          $a.append(thumbnailImg(vpt.t, vpt.t2).addClass('img-responsive'));
+          $td.append($a);
+        }
+        $tr.append($td);
+      }
+      $table.append($tr);
+    }
+    if (count <= 1)
+      return null;
+    return $('<div></div>').append('<h2>Adjacent Viewpoints</h2>', $table);
+  }
+
+  function renderNavButtons(name) {
+    var index = $.inArray(name, names);
+    var $p = $('<p></p>');
+    var islandUrl = config.islandsRoot + bundle.island;
+    $.each([[names[index - 1], 'left'], [names[index + 1], 'right']],
+           function(i, item) {
+      var $a = item[0] ? viewpointLink(item[0]) : $('<a></a>').attr('href', islandUrl);
+      $a.addClass('btn btn-default');
+      $a.append('<span class="glyphicon glyphicon-arrow-' + item[1] +
+                '" aria-hidden="true"></span>');
+      $p.append($a, ' ');
+    });
+    return $p;
+  }
+
+  function filePathInput(value, id) {
+    var $group = $('<div class="input-group"></div>');
+    var $input = $('<input type="text" readonly class="form-control filepath">');
+    $input.attr({'value': value, 'id': id});
+    var $button = $('<button class="btn btn-default glyphicon glyphicon-copy" type="button"></button>');
+    $button.on('click', function() { copyToClipboard(id); });
+    $group.append($input,
+                  $('<span class="input-group-btn"></span>').append($button));
+    return $group;
+  }
+
+  function renderRows(items, renderItem) {
+    var $rows = $('<div></div>');
+    for (var i = 0; i < items.length; i += 2) {
+      var $row = $('<div class="row"></div>');
+      for (var j = i; j < Math.min(i + 2, items.length); j++)
+        $row.append($('<div class="col-sm-6"></div>').append(renderItem(items[j])));
+      $rows.append($row);
+    }
+    return $rows;
+  }
+
+  function renderViewpoint(name) {
+    var vpt = bundle.viewpoints[name];
+    var $content = $('<div class="viewpoint-content"></div>');
+    $content.append($('<h1></h1>').text(config.islandName + ' Viewpoint ' + name));
+    $content.append(renderNavButtons(name));
+    $content.append(renderMatrix(name));
+
+    if (vpt.o.length) {
+      var $ol = $('<ol></ol>');
+      $.each(vpt.o, function(i, obj) {
+        var $a = $('<a class="btn btn-default"></a>');
+        $a.attr('href', config.objectsRoot + encodeURIComponent(obj[0]));
+        $a.append(thumbnailImg(obj[1], obj[2]), '<br>', document.createTextNode(obj[0]));
+        $ol.append($('<li></li>').append($a));
+      });
+      $content.append('<h2>Objects</h2>', $ol);
+    }
+
+    if (vpt.m.length) {
+      $content.append($('<h2></h2>').text('Movies (' + vpt.m.length + ')'));
+      $content.append(renderRows(vpt.m, function(movie) {
+        var path = '$RIVENREF/' + movie[1].replace('DVD', 'DVD/Videos');
+        if (!movie[2]) {
+          return [filePathInput(path, movie[0]),
+                  $('<p></p>').text(movie[0] + ' (not transcoded in this build)')];
+        }
+        var $video = $('<video class="img img-responsive movie-preview" ' +
+                       'preload="none" loop controls></video>');
+        $video.attr({'width': movie[3], 'height': movie[4],
+                     'src': protectedUrl(movie[2])});
+        if (movie[5]) {
+          $video.attr('poster', protectedUrl(movie[5]));
+        }
+        if (movie[6]) {
+          $video.attr('data-preview-src', protectedUrl(movie[6]));
+        }
+        $video.moviePreview();
+        return [filePathInput(path, movie[0]), $video, $('<br>')];
+      }));
+    }
+
+    if (vpt.i.length) {
+      $content.append($('<h2></h2>').text('Images (' + vpt.i.length + ')'));
+      $content.append(renderRows(vpt.i, function(image) {
+        var path = '$RIVENREF/' + image[1].replace('DVD', 'DVD/Images');
+        var $a = $('<a></a>');
+        $a.attr('href', viewpointUrl(name) + '/view/' + encodeURIComponent(image[0]));
+        var $img = $('<img class="img-responsive">');
+        $img.attr({'width': image[2], 'height': image[3],
+                   'src': protectedUrl(image[4])});
+        return [filePathInput(path, image[0]), $a.append($img), $('<br>')];
+      }));
+    }
+    return $content;
+  }
+
+  function show(name, push) {
+    if (!rendered.hasOwnProperty(name)) {
+      rendered[name] = renderViewpoint(name);
+    }
+    var $container = $(config.container);
+    $container.children().detach();
+    $container.append(rendered[name]);
+    rendered[name].find('img[data-src]').unveil();
+    current = name;
+    document.title = 'Reference Browser: ' + config.islandName +
+                     ' Viewpoint ' + name;
+    if (push)
+      history.pushState({viewpoint: name}, document.title, viewpointUrl(name));
+    $(window).trigger('lookup');
+  }
+
+  function enabled() {
+    return window.localStorage && localStorage.getItem(storageKey) == '1';
+  }
+
+  function start() {
+    $(document).on('click', 'a[data-viewpoint]', function(e) {
+      if (!bundle || e.ctrlKey || e.metaKey || e.shiftKey)
+        return;
+      e.preventDefault();
+      show($(this).attr('data-viewpoint'), true);
+    });
+    $(window).on('popstate', function(e) {
+      var state = e.originalEvent.state;
+      var name = state ? state.viewpoint : config.viewpoint;
+      if (bundle && name != current && isLocal(name))
+        show(name, false);
+    });
+    history.replaceState({viewpoint: config.viewpoint}, document.title);
+    $.getJSON(config.bundleUrl, function(data) {
+      bundle = data;
+      names = $.map(bundle.viewpoints, function(v, name) { return name; });
+      names.sort(compareNames);
+      if (isLocal(config.viewpoint)) {
+        // Re-render the current viewpoint from the bundle so that its
+        // adjacent viewpoint links are handled client-side too.
+        show(config.viewpoint, false);
+      }
+    });
+  }
+
+  return {
+    init: function(options) {
+      config = options;
+      var $toggle = $(config.toggle);
+      $toggle.prop('checked', enabled());
+      $toggle.on('change', function() {
+        if (window.localStorage)
+          localStorage.setItem(storageKey, this.checked ? '1' : '0');
+        if (this.checked && !bundle)
+          start();
+        else if (!this.checked)
+          window.location = viewpointUrl(current || config.viewpoint);
+      });
+      if (enabled() && window.history && history.pushState)
+        start();
+    }
+  };
+})(jQuery);
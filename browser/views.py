@@ -1,5 +1,7 @@
 from flask import (
+  abort,
   Blueprint,
+  current_app,
   flash,
   redirect,
   render_template,
@@ -17,18 +19,30 @@ from flask_login import (
 )
 from flask_wtf import FlaskForm
 from browser.models import (
+  Derivative,
   Globals,
   Island,
   Object,
+  PackEntry,
   Position,
   RivenImage,
   RivenMovie,
   User,
   Viewpoint
 )
-from urlparse import urlparse, urljoin
+try:
+  from urlparse import urlparse, urljoin
+except ImportError:
+  from urllib.parse import urlparse, urljoin
+from browser.api import KeysetPage
+from browser.derivatives import MissingSourceException
+from browser.packs import FileResponse
+from browser.page_cache import CachedPage
+from browser.search import Search
 from wtforms import StringField, PasswordField, validators
 import json
+import os
+import subprocess
 
 browsing = Blueprint('browsing', __name__,
                       template_folder='templates',
@@ -39,6 +53,10 @@ login_manager = LoginManager()
 login_manager.session_protection = 'strong'
 login_manager.login_view = 'browsing.login'
 
+# Number of items rendered into a listing page. Further items are fetched
+# through the JSON API as the page is scrolled.
+ListingPageSize = 60
+
 @login_manager.user_loader
 def load_user(user_id):
   return User.query.get(user_id)
@@ -110,32 +128,63 @@ def logout():
   logout_user()
   return redirect(url_for('browsing.islands'))
 
+def NextPageUrl(endpoint, next_key, **kwargs):
+  """The API URL an infinite scroll listing fetches its next page from."""
+  if next_key is None:
+    return None
+  return url_for(endpoint, after=next_key, limit=ListingPageSize,
+                 fields='name,thumbnail,thumbnail2x,url', **kwargs)
+
 @browsing.route('/island/<symbol>', strict_slashes=False)
 @login_required
+@CachedPage
 def island(symbol):
   g = Globals.query.filter(Globals.global_id == 1).first()
   island = Island.query.filter(Island.symbol == symbol).first()
   if not island:
-    return 'There is no "%s" island.' % symbol
+    return 'There is no "%s" island.' % symbol, 404
 
-  vpt_query=Viewpoint.query.filter(
-      Viewpoint.island == island.id).order_by(Viewpoint.name)
+  vpt_query=Viewpoint.query.filter(Viewpoint.island == island.id)
   pos_query=Position.query.filter(
       Position.island == island.id).order_by(Position.id)
+  viewpoints, next_vpt = KeysetPage(vpt_query, Viewpoint.name,
+                                    lambda v: v.name, None, ListingPageSize)
   return render_template('island.html',
-      viewpoints=vpt_query,
+      viewpoints=viewpoints,
       positions=pos_query,
       island_name=island.title(),
       island_symbol=island.symbol,
       use_unveil=True,
       position_count=pos_query.count(),
       viewpoint_count=vpt_query.count(),
+      next_page=NextPageUrl('api.viewpoints', next_vpt, symbol=island.symbol),
+      has_map=os.path.exists(safe_join(current_app.config['PROTECTED_DIR'],
+                                       IslandMapPath(island.symbol))),
       title=island.title(),
       thumbnail_width=g.thumbnail_width,
       thumbnail_height=g.thumbnail_height,
       thumbnail2x_width=g.thumbnail2x_width,
       thumbnail2x_height=g.thumbnail2x_height)
 
+def IslandMapPath(symbol):
+  """The island map SVG relative to the protected directory."""
+  return 'maps/%s.svg' % symbol
+
+@browsing.route('/island/<symbol>/map', strict_slashes=False)
+@login_required
+def island_map(symbol):
+  island = Island.query.filter(Island.symbol == symbol).first()
+  if not island:
+    return 'There is no "%s" island.' % symbol, 404
+  svg_path = safe_join(current_app.config['PROTECTED_DIR'],
+                       IslandMapPath(symbol))
+  if not os.path.exists(svg_path):
+    return 'There is no map for the "%s" island.' % symbol, 404
+  return render_template('island_map.html',
+      map_path=IslandMapPath(symbol),
+      island_symbol=island.symbol,
+      title='%s Map' % island.title())
+
 def GetViewpointMatrix(viewpoint):
   return {
     'island_symbol': chr(viewpoint.island),
@@ -172,16 +221,17 @@ def CreateViewpointMatrix(viewpoint):
 
 @browsing.route('/island/<symbol>/viewpoint/<vpt_name>', strict_slashes=False)
 @login_required
+@CachedPage
 def viewpoint(symbol, vpt_name):
   g = Globals.query.filter(Globals.global_id == 1).first()
   island = Island.query.filter(Island.symbol == symbol).first()
   if not island:
-    return 'There is no "%s" island.' % symbol
+    return 'There is no "%s" island.' % symbol, 404
 
   viewpoint = Viewpoint.query.filter(Viewpoint.island == island.id,
                                      Viewpoint.name == vpt_name).first()
   if not viewpoint:
-    return 'There is no "%s" viewpoint.' % vpt_name
+    return 'There is no "%s" viewpoint.' % vpt_name, 404
   title = '%s Viewpoint %s' % (island.title(), viewpoint.name)
   img_query=RivenImage.query.filter(
       RivenImage.viewpoint == viewpoint.id).order_by(RivenImage.image_height)
@@ -228,34 +278,40 @@ def viewpoint(symbol, vpt_name):
 
 @browsing.route('/objects', strict_slashes=False)
 @login_required
+@CachedPage
 def objects():
   g = Globals.query.filter(Globals.global_id == 1).first()
+  objects, next_obj = KeysetPage(Object.query, Object.id, lambda o: o.id,
+                                 None, ListingPageSize)
   return render_template('objects.html',
     thumbnail_width=g.thumbnail_width,
     thumbnail_height=g.thumbnail_height,
-    objects=Object.query.all())
+    next_page=NextPageUrl('api.objects', next_obj),
+    objects=objects)
 
 @browsing.route('/objects/<obj_name>')
 @login_required
+@CachedPage
 def view_obj(obj_name):
   obj = Object.query.filter(Object.name == obj_name).first()
   if not obj:
-    return 'There is no "%s" object.' % obj_name
+    return 'There is no "%s" object.' % obj_name, 404
   return render_template('object.html',
     object=obj)
 
 @browsing.route('/island/<symbol>/viewpoint/<vpt_name>/view/<view_name>',
                 strict_slashes=False)
 @login_required
+@CachedPage
 def view(symbol, vpt_name, view_name):
   island = Island.query.filter(Island.symbol == symbol).first()
   if not island:
-    return 'There is no "%s" island.' % symbol
+    return 'There is no "%s" island.' % symbol, 404
 
   viewpoint = Viewpoint.query.filter(Viewpoint.island == island.id,
                                      Viewpoint.name == vpt_name).first()
   if not viewpoint:
-    return 'There is no "%s" viewpoint.' % vpt_name
+    return 'There is no "%s" viewpoint.' % vpt_name, 404
   image = None
   movie = None
   query=RivenImage.query.filter(RivenImage.viewpoint==viewpoint.id,
@@ -278,8 +334,44 @@ def view(symbol, vpt_name, view_name):
       vpt_title='%s/%s' % (island.symbol, viewpoint.name),
       island_symbol=island.symbol)
 
+@browsing.route('/search', strict_slashes=False)
+@login_required
+def search():
+  query = request.args.get('q', '')
+  return render_template('search.html',
+      query=query,
+      results=Search(query, 200),
+      title='Search')
+
 @browsing.route('/protected/<path:filename>')
 @login_required
 def protected(filename):
-  d = safe_join(browsing.root_path, 'protected')
+  entry = PackEntry.query.get(filename)
+  if entry:
+    try:
+      return current_app.extensions['packs'].Response(entry)
+    except FileNotFoundError:
+      # Pruned by a newer build.
+      current_app.logger.error('Missing pack %s of %s', entry.pack, filename)
+      abort(404)
+  d = current_app.config['PROTECTED_DIR']
+  if not os.path.exists(safe_join(d, filename)):
+    # Possibly a derivative left by makedb to be made on first request.
+    derivative = Derivative.query.get(filename)
+    if derivative:
+      cache = current_app.extensions['derivative_cache']
+      try:
+        f = cache.Get(derivative.path, derivative.kind, derivative.source,
+                      derivative.island)
+      except MissingSourceException:
+        current_app.logger.error('Missing source of %s: %s', derivative.path,
+                                 derivative.source)
+        abort(404)
+      except (OSError, subprocess.CalledProcessError):
+        # Most likely ffmpeg, missing or failing.
+        current_app.logger.exception('Failed to make %s', derivative.path)
+        abort(503)
+      st = os.fstat(f.fileno())
+      return FileResponse(f, derivative.path, st.st_size,
+                          '%d-%d' % (st.st_mtime_ns, st.st_size))
   return send_from_directory(d, filename)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import pstats
+import re
+import resource
+import subprocess
+import threading
+import time
+
+class Tracer(object):
+  """Records the jobs run by makedb.
+
+  Every job (a subprocess, some in-process Pillow work, a database insert, a
+  whole build stage, ...) becomes one event with its wall time, CPU time,
+  input and output bytes and peak RSS. Events are written as a Chrome trace
+  (viewable in chrome://tracing or https://ui.perfetto.dev), with one lane per
+  worker thread, so the critical path of a build can be seen. Lanes are
+  identified by the thread's ID, and labelled with its name by the
+  thread_name metadata events WriteChromeTrace() adds.
+
+  For subprocesses the CPU time and peak RSS are those of the child. For
+  in-process jobs the CPU time is that of the calling thread, and the peak
+  RSS is that of the whole makedb process at the end of the job.
+
+  Recording is off until Enable() is called. Commands are run either way.
+
+  EnableProfiling() independently profiles, with cProfile, the Python code
+  run by the stages and the SQL inserts of the main thread, one profile per
+  stage. Profiles are timed in thread CPU time, so the time a stage spends
+  waiting for subprocesses and worker threads isn't in its profile, and a
+  stage nested in another is only in its own profile.
+  """
+
+  # The categories of the spans which are profiled.
+  profiled_cats = ('stage', 'sql insert')
+
+  def __init__(self):
+    self.enabled = False
+    self.lock = threading.Lock()
+    self.events = []
+    self.start = time.perf_counter()
+    self.profile_dir = None
+    self.profile_prefix = ''
+    self.profiles = dict()  # Span name -> [cProfile.Profile, wall time]
+    self.profile_stack = []  # [name, start, wall time of nested spans]
+
+  def Enable(self):
+    self.enabled = True
+
+  def EnableProfiling(self, out_dir, prefix=''):
+    """Profile the stages, to be written to |out_dir| by WriteProfiles(),
+    in files named after |prefix| and the stage."""
+    self.profile_dir = out_dir
+    self.profile_prefix = prefix
+
+  def Reset(self):
+    """Drop all the recorded events and restart the clock."""
+    with self.lock:
+      self.events = []
+      self.start = time.perf_counter()
+
+  @staticmethod
+  def FileBytes(paths):
+    total = 0
+    for path in paths:
+      try:
+        total += os.path.getsize(path)
+      except OSError:
+        pass
+    return total
+
+  def Timestamp(self):
+    """Microseconds since the tracer was created."""
+    return (time.perf_counter() - self.start) * 1e6
+
+  def AddEvent(self, event):
+    with self.lock:
+      self.events.append(event)
+
+  def MakeEvent(self, name, cat, ts, dur, cpu, inputs, outputs, peak_rss_kb):
+    return {
+      'name': name,
+      'cat': cat,
+      'ph': 'X',
+      'ts': ts,
+      'dur': dur,
+      'pid': os.getpid(),
+      'tid': threading.get_ident(),
+      'args': {
+        'thread': threading.current_thread().name,
+        'cpu_ms': round(cpu * 1000, 3),
+        'input_bytes': Tracer.FileBytes(inputs),
+        'output_bytes': Tracer.FileBytes(outputs),
+        'peak_rss_kb': peak_rss_kb,
+      },
+    }
+
+  @contextmanager
+  def Profiled(self, name, cat):
+    """Profile the body of the with statement, if it is a span to profile."""
+    if not self.profile_dir or cat not in Tracer.profiled_cats or \
+       threading.current_thread() is not threading.main_thread():
+      yield
+      return
+    if cat != 'stage':
+      name = '%s %s' % (cat, name)
+    if name not in self.profiles:
+      self.profiles[name] = [cProfile.Profile(time.thread_time), 0.0]
+    if self.profile_stack:
+      self.profiles[self.profile_stack[-1][0]][0].disable()
+    self.profile_stack.append([name, time.perf_counter(), 0.0])
+    self.profiles[name][0].enable()
+    try:
+      yield
+    finally:
+      self.profiles[name][0].disable()
+      _, start, nested = self.profile_stack.pop()
+      wall = time.perf_counter() - start
+      self.profiles[name][1] += wall - nested
+      if self.profile_stack:
+        self.profile_stack[-1][2] += wall
+        self.profiles[self.profile_stack[-1][0]][0].enable()
+
+  @contextmanager
+  def Span(self, name, cat, inputs=(), outputs=()):
+    """Trace the in-process work done in the body of the with statement."""
+    with self.Profiled(name, cat):
+      if not self.enabled:
+        yield
+        return
+      ts = self.Timestamp()
+      cpu = time.thread_time()
+      try:
+        yield
+      finally:
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.AddEvent(self.MakeEvent(name, cat, ts, self.Timestamp() - ts,
+                                     time.thread_time() - cpu, inputs,
+                                     outputs, peak_rss_kb))
+
+  def Run(self, cmd, cat, inputs=(), outputs=(), capture=False, cwd=None):
+    """Run |cmd| like subprocess.check_call, or check_output if |capture|.
+
+    The event is named after the first input file. Returns the command's
+    stdout when |capture| is set."""
+    if not self.enabled:
+      if capture:
+        return subprocess.check_output(cmd, cwd=cwd)
+      subprocess.check_call(cmd, cwd=cwd)
+      return None
+    name = os.path.basename(inputs[0] if inputs else cmd[0])
+    ts = self.Timestamp()
+    p = subprocess.Popen(cmd, cwd=cwd,
+                         stdout=subprocess.PIPE if capture else None)
+    output = p.stdout.read() if capture else None
+    if capture:
+      p.stdout.close()
+    # wait4() gives the resource usage of this child alone, unlike
+    # getrusage(RUSAGE_CHILDREN) which sums every child waited for so far.
+    _, status, usage = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status)
+    self.AddEvent(self.MakeEvent(name, cat, ts,
+                                 self.Timestamp() - ts,
+                                 usage.ru_utime + usage.ru_stime, inputs,
+                                 outputs, usage.ru_maxrss))
+    if p.returncode:
+      raise subprocess.CalledProcessError(p.returncode, cmd, output)
+    return output
+
+  def Fork(self):
+    """Return a tracer for use in a worker process.
+
+    Its events are meant to be passed back to this tracer with AddEvent(),
+    and its timestamps line up with this tracer's."""
+    child = Tracer()
+    child.enabled = self.enabled
+    child.start = self.start
+    return child
+
+  def __getstate__(self):
+    # Forked tracers are sent to worker processes, without their lock.
+    state = self.__dict__.copy()
+    del state['lock']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.lock = threading.Lock()
+
+  def WriteChromeTrace(self, fname):
+    with self.lock:
+      events = list(self.events)
+    threads = dict(((e['pid'], e['tid']), e['args']['thread'])
+                   for e in events)
+    events.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': name}}
+                  for (pid, tid), name in sorted(threads.items()))
+    with open(fname, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+  def JobTotals(self):
+    """Return {cat: {'count', 'wall_ms', 'cpu_ms', 'input_bytes',
+    'output_bytes', 'peak_rss_kb'}} over all the jobs which aren't stages."""
+    totals = dict()
+    with self.lock:
+      events = [e for e in self.events if e['cat'] != 'stage']
+    for event in events:
+      t = totals.setdefault(event['cat'], {'count': 0, 'wall_ms': 0.0,
+                                           'cpu_ms': 0.0, 'input_bytes': 0,
+                                           'output_bytes': 0,
+                                           'peak_rss_kb': 0})
+      args = event['args']
+      t['count'] += 1
+      t['wall_ms'] += event['dur'] / 1000
+      t['cpu_ms'] += args['cpu_ms']
+      t['input_bytes'] += args['input_bytes']
+      t['output_bytes'] += args['output_bytes']
+      t['peak_rss_kb'] = max(t['peak_rss_kb'], args['peak_rss_kb'])
+    return totals
+
+  def PrintSummary(self, num_slowest=10):
+    with self.lock:
+      stages = [e for e in self.events if e['cat'] == 'stage']
+      jobs = [e for e in self.events if e['cat'] != 'stage']
+    print('%-24s %12s %12s' % ('Stage', 'Wall (s)', 'CPU (s)'))
+    for event in sorted(stages, key=lambda e: e['ts']):
+      print('%-24s %12.2f %12.2f' % (event['name'], event['dur'] / 1e6,
+                                     event['args']['cpu_ms'] / 1000))
+    print()
+    totals = self.JobTotals()
+    print('%-24s %7s %12s %12s %10s %10s %10s' %
+          ('Job', 'Count', 'Wall (s)', 'CPU (s)', 'In (MB)', 'Out (MB)',
+           'RSS (MB)'))
+    for cat in sorted(totals, key=lambda c: -totals[c]['wall_ms']):
+      t = totals[cat]
+      print('%-24s %7d %12.2f %12.2f %10.1f %10.1f %10.1f' %
+            (cat, t['count'], t['wall_ms'] / 1000, t['cpu_ms'] / 1000,
+             t['input_bytes'] / 1e6, t['output_bytes'] / 1e6,
+             t['peak_rss_kb'] / 1024))
+    jobs.sort(key=lambda e: -e['dur'])
+    print()
+    print('Slowest jobs')
+    for event in jobs[:num_slowest]:
+      print('%10.2f s  %-16s %s' % (event['dur'] / 1e6, event['cat'],
+                                    event['name']))
+
+  def WriteProfiles(self, summary=True):
+    """Write the profile of each stage, as pstats (python3 -m pstats FILE),
+    and if |summary|, print the time each spent running Python and
+    waiting."""
+    os.makedirs(self.profile_dir, exist_ok=True)
+    if summary:
+      print('%-32s %12s %12s %12s' % ('Profiled stage', 'Wall (s)',
+                                      'Python (s)', 'Waiting (s)'))
+    for name, (profile, wall) in sorted(self.profiles.items(),
+                                        key=lambda item: -item[1][1]):
+      stats = pstats.Stats(profile)
+      fname = self.profile_prefix + re.sub(r'[^\w.-]', '_', name) + '.pstats'
+      stats.dump_stats(os.path.join(self.profile_dir, fname))
+      if not summary:
+        continue
+      # Waiting includes the time the GIL was held by the worker threads.
+      print('%-32s %12.2f %12.2f %12.2f' % (self.profile_prefix + name, wall,
+                                            stats.total_tt,
+                                            max(0.0, wall - stats.total_tt)))
+
+tracer = Tracer()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""Build the static bundles of the browser (see browser/assets.py)."""
+
+from browser.assets import Bundles
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+# URLs of the static files and bundles, relative to the app, to rewrite the
+# url()s of the CSS.
+StaticUrl = '/browsing/static'
+DistUrl = '/browsing/dist'
+# Formats which are already compressed.
+Compressed = frozenset(['.woff', '.woff2', '.png', '.gif', '.jpg'])
+
+class Bundler(object):
+  url_re = re.compile(r'''url\((['"]?)([^'")]+)\1\)''')
+
+  def __init__(self, static_dir, dist_dir):
+    self.static_dir = static_dir
+    self.dist_dir = dist_dir
+    self.manifest = dict()  # Name -> fingerprinted filename.
+
+  @staticmethod
+  def Fingerprint(name, data):
+    root, ext = os.path.splitext(os.path.basename(name))
+    return '%s.%s%s' % (root, hashlib.sha1(data).hexdigest()[:12], ext)
+
+  def Write(self, name, data):
+    """Store |data| (and its compressed versions) under its fingerprinted
+    filename."""
+    filename = Bundler.Fingerprint(name, data)
+    path = os.path.join(self.dist_dir, filename)
+    if not os.path.exists(path):
+      with open(path, 'wb') as f:
+        f.write(data)
+      if os.path.splitext(name)[1] not in Compressed:
+        versions = [('.gz', gzip.compress(data, 9, mtime=0))]
+        if brotli:
+          versions.append(('.br', brotli.compress(data)))
+        for suffix, compressed in versions:
+          if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+              f.write(compressed)
+    self.manifest[name] = filename
+    return filename
+
+  def RewriteUrls(self, css_path, css):
+    """Make the relative url()s of |css_path| relative to the bundle, and
+    point those of other static files to their fingerprinted copies."""
+    base = posixpath.dirname(posixpath.join(StaticUrl, css_path))
+    def Rewrite(match):
+      url = match.group(2)
+      if url.startswith('data:') or url.startswith('/') or '://' in url:
+        return match.group(0)
+      m = re.match(r'([^?#]*)(.*)', url)
+      target = posixpath.normpath(posixpath.join(base, m.group(1)))
+      static_path = posixpath.relpath(target, StaticUrl)
+      if not static_path.startswith('..') and \
+         os.path.exists(os.path.join(self.static_dir, static_path)):
+        with open(os.path.join(self.static_dir, static_path), 'rb') as f:
+          new_url = self.Write(static_path, f.read())
+      else:
+        new_url = posixpath.relpath(target, DistUrl)
+      return "url('%s%s')" % (new_url, m.group(2))
+    return Bundler.url_re.sub(Rewrite, css)
+
+  def Bundle(self, name, paths):
+    parts = []
+    for path in paths:
+      full_path = os.path.join(self.static_dir, path)
+      if not os.path.exists(full_path):
+        raise Exception('%s is missing (see "make static")' % full_path)
+      with open(full_path, 'rb') as f:
+        data = f.read()
+      if name.endswith('.css'):
+        data = self.RewriteUrls(path, data.decode('utf-8')).encode('utf-8')
+      parts.append(data)
+    # The newline ends a trailing // comment; the semicolon an unterminated
+    # statement.
+    separator = b'\n' if name.endswith('.css') else b';\n'
+    return self.Write(name, separator.join(parts))
+
+  def Run(self):
+    if not os.path.exists(self.dist_dir):
+      os.makedirs(self.dist_dir)
+    for name in sorted(Bundles):
+      filename = self.Bundle(name, Bundles[name])
+      path = os.path.join(self.dist_dir, filename)
+      sizes = ['%s %d' % (suffix, os.path.getsize(path + suffix))
+               for suffix in ['', '.gz', '.br']
+               if os.path.exists(path + suffix)]
+      print('%-14s %s (%s)' % (name, filename, ', '.join(sizes)))
+    # Written last, and atomically, so the app never sees a manifest naming
+    # missing files.
+    tmp_path = os.path.join(self.dist_dir, 'manifest.json.tmp')
+    with open(tmp_path, 'w') as f:
+      json.dump(self.manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(self.dist_dir, 'manifest.json'))
+    if not brotli:
+      print('brotli is not installed: only gzip versions were made.')
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Build the static bundles.')
+  parser.add_argument('--static-dir', default=os.path.join('browser', 'static'))
+  parser.add_argument('--dist-dir', default=os.path.join('browser', 'dist'))
+  args = parser.parse_args()
+  Bundler(args.static_dir, args.dist_dir).Run()
@@ -1 +1,39 @@
 DEBUG=False
+# Count and time the SQL statements of each request, and report them in a
+# Server-Timing header. See browser/instrumentation.py.
+INSTRUMENT_REQUESTS=False
+# Statements taking at least this long are logged with their parameters.
+SLOW_QUERY_MS=100
+# File the slow statements are logged to (default: stderr).
+SLOW_QUERY_LOG=None
+# The directory of the game files and of what makedb made from them
+# (default: browser/protected).
+PROTECTED_DIR=None
+# Where the derivatives left by makedb --lazy-derivatives are made on first
+# request (default: browser/protected/cache), and the size the cache is kept
+# to by evicting the least recently used ones.
+DERIVATIVE_CACHE_DIR=None
+DERIVATIVE_CACHE_BYTES=2 * 1024 * 1024 * 1024
+# Open the database read-only and immutable, one connection per thread, and
+# switch to a new one when it is replaced. See browser/serving.py.
+SERVE_IMMUTABLE=False
+# Seconds between checks for a new database.
+SERVE_CHECK_INTERVAL=1.0
+# Connections kept open (at least the number of threads of the mod_wsgi
+# process): others are opened and closed for each request.
+SERVE_POOL_SIZE=32
+# Memory each process keeps rendered pages in, for the database build they
+# were rendered from (0 disables the cache). See browser/page_cache.py.
+PAGE_CACHE_BYTES=64 * 1024 * 1024
+# SQLite file sharing the rendered pages between processes (default: none).
+PAGE_CACHE_PATH=None
+# Cache the compiled templates in TEMPLATE_BYTECODE_CACHE_DIR (default: a
+# directory in the system's temporary directory).
+TEMPLATE_BYTECODE_CACHE=True
+TEMPLATE_BYTECODE_CACHE_DIR=None
+# Where the profiles of the pages are written (default: none, profiling is
+# off). See browser/profiling.py.
+PROFILE_DIR=None
+# Fraction of the page requests profiled, besides those the admin asks for
+# with ?profile=1.
+PROFILE_SAMPLE_RATE=0.0
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+class ContentStore(object):
+  """Files named after the hash of their content.
+
+  Sources are hardlinked into the store under their hash, and their
+  derivatives are named after it, so identical sources (the same frame in
+  several viewpoints or data directories) share one set of derivatives and
+  one URL, which browsers cache once:
+
+    <root>/<first two hex digits>/<sha1><suffix>
+
+  Make() runs the function making a file only for the first request of its
+  path. Later requests, from any thread, wait for it and are counted as
+  reuses in the report. makedb processes sharing the store (building the
+  shards of different islands) take turns through a lock file, <path>.making,
+  which exists while the file is being made.
+  """
+
+  def __init__(self, root):
+    self.root = root
+    self.lock = threading.Lock()
+    self.futures = dict()  # Path -> Future, set once the path is made.
+    self.claimed = set()
+    self.seconds = dict()  # Path -> seconds taken to make it.
+    # Kind -> {'made', 'existing', 'reused', 'bytes_saved', 'seconds_saved'}
+    self.stats = dict()
+
+  @staticmethod
+  def HashFile(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        h.update(block)
+    return h.hexdigest()
+
+  def Path(self, content_hash, suffix):
+    return os.path.join(self.root, content_hash[:2], content_hash + suffix)
+
+  def Claim(self, path):
+    """True the first time |path| is claimed."""
+    with self.lock:
+      if path in self.claimed:
+        return False
+      self.claimed.add(path)
+      return True
+
+  def Count(self, kind, key, amount=1):
+    with self.lock:
+      stats = self.stats.setdefault(kind, {'made': 0, 'existing': 0,
+                                           'reused': 0, 'bytes_saved': 0,
+                                           'seconds_saved': 0.0})
+      stats[key] += amount
+
+  def Make(self, kind, path, fn, *args):
+    """Run fn(*args) to make |path|, unless it exists or was already made
+    (or is being made) by an earlier call. Returns fn's result, or None when
+    it wasn't run."""
+    with self.lock:
+      future = self.futures.get(path)
+      first = future is None
+      if first:
+        future = self.futures[path] = Future()
+    if not first:
+      future.result()
+      self.Count(kind, 'reused')
+      self.Count(kind, 'bytes_saved', os.path.getsize(path))
+      self.Count(kind, 'seconds_saved', self.seconds.get(path, 0.0))
+      return None
+    if ContentStore.Exists(path):
+      self.Count(kind, 'existing')
+      future.set_result(None)
+      return None
+    out_dir = os.path.dirname(path)
+    if not os.path.exists(out_dir):
+      os.makedirs(out_dir, exist_ok=True)
+    try:
+      with ContentStore.MakeLock(path) as interrupted:
+        if interrupted and os.path.exists(path):
+          os.remove(path)
+        if os.path.exists(path):
+          # Made by another process meanwhile.
+          self.Count(kind, 'existing')
+          future.set_result(None)
+          return None
+        start = time.perf_counter()
+        result = fn(*args)
+    except BaseException as e:
+      if not future.done():
+        future.set_exception(e)
+      raise
+    self.seconds[path] = time.perf_counter() - start
+    self.Count(kind, 'made')
+    future.set_result(None)
+    return result
+
+  @staticmethod
+  def Exists(path):
+    """True if |path| is complete: a process making it creates the lock file
+    first and removes it once done."""
+    return os.path.exists(path) and not os.path.exists(path + '.making')
+
+  @staticmethod
+  @contextmanager
+  def MakeLock(path):
+    """Hold the lock on making |path| against other processes. Yields True
+    when a process died making it, leaving what it made of it."""
+    lock_path = path + '.making'
+    while True:
+      try:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+        created = True
+      except FileExistsError:
+        try:
+          fd = os.open(lock_path, os.O_RDWR)
+        except FileNotFoundError:
+          continue
+        created = False
+      # The lock is released when its holder dies.
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      try:
+        current = os.fstat(fd).st_ino == os.stat(lock_path).st_ino
+      except FileNotFoundError:
+        current = False
+      if current:
+        break
+      # The holder before us was done, and removed it.
+      os.close(fd)
+    try:
+      # A lock file left in place by its holder is that of a dead process.
+      yield not created
+    finally:
+      os.remove(lock_path)
+      os.close(fd)
+
+  @staticmethod
+  def Link(source, path):
+    try:
+      os.link(source, path)
+    except OSError:
+      # Not on the same filesystem.
+      shutil.copyfile(source, path)
+
+  def AddSource(self, path, content_hash):
+    """Hardlink the source |path| into the store. Returns its path there."""
+    stored = self.Path(content_hash, os.path.splitext(path)[1])
+    self.Make('source', stored, ContentStore.Link, path, stored)
+    return stored
+
+  def PrintReport(self):
+    print('%-12s %8s %8s %8s %12s %12s' % ('Content', 'Made', 'Existing',
+                                           'Reused', 'Saved (MB)',
+                                           'Saved (s)'))
+    total_bytes = 0
+    total_seconds = 0.0
+    for kind in sorted(self.stats):
+      s = self.stats[kind]
+      print('%-12s %8d %8d %8d %12.1f %12.1f' % (kind, s['made'],
+            s['existing'], s['reused'], s['bytes_saved'] / 1e6,
+            s['seconds_saved']))
+      # Duplicate sources were never copied, so save nothing on disk.
+      if kind != 'source':
+        total_bytes += s['bytes_saved']
+        total_seconds += s['seconds_saved']
+    print('Deduplication saved %.1f MB of derivatives and %.1f s of encoding' %
+          (total_bytes / 1e6, total_seconds))
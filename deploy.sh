@@ -2,8 +2,29 @@
 
 source deploy_config.sh
 
+# With --packs, the files makedb --pack packed are left out: the server
+# reads them from browser/protected/packs.
+exclude_packed=()
+if [ "$1" == "--packs" ]; then
+  exclude_packed=(--exclude="/browser/protected/cas" \
+                  --exclude="/browser/protected/DVD" \
+                  --exclude="/browser/protected/positions" \
+                  --exclude="/browser/protected/bundles")
+fi
+
 src="app.py web.py browser config.py riven.sqlite"
 rsync --archive --recursive --exclude="CD" --exclude="*.gif" \
   --exclude="*.mov" --exclude="*~" --exclude="*.pyc" --exclude="*.swp" \
-  --exclude="*.sav" --exclude="*.orig" \
+  --exclude="*.sav" --exclude="*.orig" "${exclude_packed[@]}" \
   --progress $src ${dest_user}@${dest_host}:${dest_root}/browser
+
+# The derivatives a --lazy-derivatives build left are made on the server,
+# from the movies they're derived from, which are shipped along (.mov files
+# are otherwise left out).
+sources=$(mktemp)
+trap 'rm -f "$sources"' EXIT
+sqlite3 riven.sqlite 'SELECT DISTINCT source FROM derivatives' > "$sources"
+if [ -s "$sources" ]; then
+  rsync --archive --files-from="$sources" --progress browser/protected \
+    ${dest_user}@${dest_host}:${dest_root}/browser/browser/protected
+fi
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-import glob
+from array import array
+import json
 import os
 import re
 import sys
@@ -9,24 +10,74 @@ class InvalidFilenameException(Exception):
   pass
 
 class FileInfo(object):
-  def __init__(self):
-    self.viewpoint = None
-    self.island = None
-    self.parts = None
-    self.extension = None
-
-  # Riven filenames are of the form *_*.ext where the first glob is the
-  # viewpoint, and the second glob are the "parts". Parts are first '.'
-  # delimited, and then '_' delimited. So the filename:
-  #   508_text_foo.4500_s1_odo_lu.png
-  # will be parsed to:
-  #   {viewpoint:'508'
-  #    island:'T'
-  #    parts:[['ext', 'foo'], ['4500', 's1', 'odo', 'lu']]
-  #    extension: 'png'}
-  #  Note: the 't' prefix is removed when parsing as this is the island.
+  """One file of an AssetCatalog.
+
+  Riven filenames are of the form *_*.ext where the first glob is the
+  viewpoint, and the second glob are the "parts". Parts are first '.'
+  delimited, and then '_' delimited. So the filename:
+    508_text_foo.4500_s1_odo_lu.png
+  will be parsed to:
+    {viewpoint:'508'
+     island:'T'
+     parts:[['ext', 'foo'], ['4500', 's1', 'odo', 'lu']]
+     extension: 'png'}
+   Note: the 't' prefix is removed when parsing as this is the island.
+
+  A FileInfo only refers to its row of the catalog, so creating one is cheap
+  and holding many costs two slots each."""
+  __slots__ = ('catalog', 'index')
+
+  def __init__(self, catalog, index):
+    self.catalog = catalog
+    self.index = index
+
+  def Column(self, column):
+    return self.catalog.strings[getattr(self.catalog, column)[self.index]]
+
+  @property
+  def viewpoint(self):
+    return self.Column('viewpoints')
+
+  @property
+  def island(self):
+    return self.Column('islands')
+
+  @property
+  def parts(self):
+    return FileInfo.SplitParts(self.friendly_name())
+
+  @property
+  def extension(self):
+    return self.Column('extensions')
+
+  @property
+  def file_path(self):
+    return os.path.join(self.Column('directories'), '%s_%s%s.%s' % (
+                        self.viewpoint, self.Column('letters'),
+                        self.friendly_name(), self.extension))
+
+  @property
+  def file_size(self):
+    return self.catalog.sizes[self.index]
+
+  @property
+  def mtime(self):
+    return self.catalog.mtimes[self.index]
+
+  @property
+  def size(self):
+    """(width, height), or None if not yet known."""
+    width = self.catalog.widths[self.index]
+    if not width:
+      return None
+    return (width, self.catalog.heights[self.index])
+
+  @size.setter
+  def size(self, size):
+    self.catalog.widths[self.index], self.catalog.heights[self.index] = size
+
   def JoinParts(self):
-    return '.'.join(['_'.join(part) for part in self.parts])
+    return self.Column('friendlies')
 
   def friendly_name(self):
     return self.JoinParts()
@@ -45,7 +96,130 @@ class FileInfo(object):
   def __lt__(self, other):
     return int(self.viewpoint) < int(other.viewpoint)
 
+  def __eq__(self, other):
+    if not isinstance(other, FileInfo):
+      return NotImplemented
+    return self.catalog is other.catalog and self.index == other.index
+
+  def __hash__(self):
+    return hash((id(self.catalog), self.index))
+
+  @staticmethod
+  def SplitParts(name):
+    """Split the parts of a (friendly) name.
+
+    >>> FileInfo.SplitParts('ext.1550_s2')
+    [['ext'], ['1550', 's2']]
+    """
+    return [part.split('_') for part in name.split('.')]
+
+class AssetCatalog(object):
+  """The game files, stored by column.
+
+  Every string (island, viewpoint, friendly name, extension, directory) is
+  stored once and referred to by index, and the numbers are kept in arrays,
+  so a file costs a few dozen bytes however many there are. Paths aren't
+  stored: they are rebuilt from the directory and the parsed name.
+
+  >>> catalog = AssetCatalog()
+  >>> catalog.Add('DVD/t_Data1-MHK', '508', 'T', 't', 'ext.4500_s1', 'png',
+  ...             1234, 0.0)
+  0
+  >>> info = catalog.Select('png')[0]
+  >>> info.file_path, info.filename(), info.parts
+  ('DVD/t_Data1-MHK/508_text.4500_s1.png', '508_text.4500_s1.png', [['ext'], ['4500', 's1']])
+  >>> catalog.Add('DVD/b_Data1-MHK', '12', 'B', 'b', 'lever', 'png', 99, 0.0)
+  1
+  >>> [info.file_path for info in catalog.Slice('B').Select('png')]
+  ['DVD/b_Data1-MHK/12_blever.png']
+  """
+
+  def __init__(self):
+    self.strings = []
+    self.string_ids = dict()
+    self.islands = array('I')
+    self.viewpoints = array('I')
+    self.letters = array('I')
+    self.friendlies = array('I')
+    self.extensions = array('I')
+    self.directories = array('I')
+    self.sizes = array('q')
+    self.mtimes = array('d')
+    self.widths = array('I')
+    self.heights = array('I')
+
+  def __len__(self):
+    return len(self.islands)
+
+  def StringId(self, string):
+    string_id = self.string_ids.get(string)
+    if string_id is None:
+      string_id = len(self.strings)
+      self.strings.append(sys.intern(string))
+      self.string_ids[string] = string_id
+    return string_id
+
+  def Add(self, directory, viewpoint, island, letter, friendly, extension,
+          file_size, mtime):
+    """Add a file. Returns its index."""
+    self.directories.append(self.StringId(directory))
+    self.viewpoints.append(self.StringId(viewpoint))
+    self.islands.append(self.StringId(island))
+    self.letters.append(self.StringId(letter))
+    self.friendlies.append(self.StringId(friendly))
+    self.extensions.append(self.StringId(extension))
+    self.sizes.append(file_size)
+    self.mtimes.append(mtime)
+    self.widths.append(0)
+    self.heights.append(0)
+    return len(self.islands) - 1
+
+  def Row(self, index):
+    """The arguments Add() was given for the file at |index|."""
+    return [self.strings[self.directories[index]],
+            self.strings[self.viewpoints[index]],
+            self.strings[self.islands[index]],
+            self.strings[self.letters[index]],
+            self.strings[self.friendlies[index]],
+            self.strings[self.extensions[index]],
+            self.sizes[index], self.mtimes[index]]
+
+  def Slice(self, island):
+    """A catalog of the files on |island| alone, in scan order."""
+    catalog = AssetCatalog()
+    island_id = self.string_ids.get(island)
+    for i in range(len(self)):
+      if self.islands[i] == island_id:
+        catalog.Add(*self.Row(i))
+    return catalog
+
+  def Save(self, path):
+    """Write the files to |path|, for Load() to read in another process."""
+    with open(path, 'w') as f:
+      json.dump([self.Row(i) for i in range(len(self))], f)
+
+  @staticmethod
+  def Load(path):
+    catalog = AssetCatalog()
+    with open(path) as f:
+      for row in json.load(f):
+        catalog.Add(*row)
+    return catalog
+
+  def Select(self, extension, island=None):
+    """The files with |extension| (and on |island|), in scan order."""
+    extension_id = self.string_ids.get(extension)
+    island_id = self.string_ids.get(island) if island else None
+    if extension_id is None or (island and island_id is None):
+      return []
+    return [FileInfo(self, i) for i in range(len(self.extensions))
+            if self.extensions[i] == extension_id and
+               (island_id is None or self.islands[i] == island_id)]
+
 class FileFinder(object):
+  # Directories holding files which aren't part of the game's islands.
+  excluded_dirs = frozenset(['b2_data-MHK', 'Extras-MHK'])
+
   def __init__(self):
     self.file_re = re.compile(r'^([^_]+)_(.+)\.([^\.]+)$')
     self.kveer_files = set()
@@ -53,25 +227,47 @@ class FileFinder(object):
       for line in f.readlines():
         self.kveer_files.add(line.strip())
 
-  # Returns an iterator
-  def GetFiles(self, top_dir, extension):
-    g = '%s/**/*.%s' % (top_dir, extension)
-    return glob.iglob(g, recursive=True)
+  def Scan(self, top_dir, extensions):
+    """Catalog the game files in |top_dir| with any of the |extensions|.
+
+    The tree is walked once, without descending into the excluded
+    directories or the thumbnails created by makedb (anything named
+    "*thumbnail*"). Hidden files are skipped, as glob does.
+
+    Returns an AssetCatalog with the size and modification time of every
+    file."""
+    catalog = AssetCatalog()
+    extensions = frozenset(extensions)
+    dirs = [top_dir]
+    while dirs:
+      dir_path = dirs.pop()
+      with os.scandir(dir_path) as entries:
+        for entry in entries:
+          if entry.name.startswith('.') or 'thumbnail' in entry.name:
+            continue
+          if entry.is_dir():
+            if entry.name not in FileFinder.excluded_dirs:
+              dirs.append(entry.path)
+            continue
+          if entry.name.rpartition('.')[2] not in extensions:
+            continue
+          st = entry.stat()
+          catalog.Add(dir_path, *self.ParseFilename(entry.name),
+                      file_size=st.st_size, mtime=st.st_mtime)
+    return catalog
 
   def ParseFilename(self, fname):
+    """Returns (viewpoint, island, island letter, friendly name, extension).
+
+    The letter is the one in the filename, which isn't the island for
+    K'veer's files."""
     m = self.file_re.match(os.path.basename(fname))
     if m:
-      info = FileInfo()
-      info.viewpoint = m.group(1)
+      letter = m.group(2)[0]
       if fname in self.kveer_files:
-        info.island = 'K'
+        island = 'K'
       else:
-        info.island = m.group(2)[0].upper()
-      parts = m.group(2)[1:].split('.')
-      info.parts = []
-      for part in parts:
-        info.parts.append(part.split('_'))
-      info.extension = m.group(3)
-      return info
+        island = letter.upper()
+      return (m.group(1), island, letter, m.group(2)[1:], m.group(3))
     else:
       raise InvalidFilenameException(fname)
@@ -2,7 +2,7 @@
 
 from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from file_finder import FileFinder, FileInfo
+from file_finder import FileFinder
 import argparse
 import multiprocessing
 import os
@@ -81,29 +81,16 @@ class ImageMatcher(object):
       scaledimg.save(outname)
 
   def FilterImage(self, info):
-    if self.island_symbol and self.island_symbol != info.island:
-      return True
     if info.friendly_name() == 'black':
       return True
     with Image.open(info.file_path) as im:
-      return im.size != StandardImageSize
+      info.size = im.size
+    return info.size != StandardImageSize
 
   def LoadFiles(self, suffix):
-    images = []
-    finder = FileFinder()
-    for filename in finder.GetFiles(self.top_dir, suffix):
-      # Thumbnails are created by this program.
-      if 'thumbnail' in filename:
-        continue
-      dir_name = os.path.basename(os.path.dirname(filename))
-      if dir_name == 'b2_data-MHK' or dir_name == 'Extras-MHK':
-        continue
-      info = finder.ParseFilename(os.path.basename(filename))
-      info.file_path = filename
-      if self.FilterImage(info):
-        continue
-      images.append(info)
-    return images
+    catalog = FileFinder().Scan(self.top_dir, [suffix])
+    return [info for info in catalog.Select(suffix, self.island_symbol)
+            if not self.FilterImage(info)]
 
   def FindMatches(self, fname):
     executor = ThreadPoolExecutor(max_workers=num_cpus)
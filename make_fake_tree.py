@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""Generate a fake Riven asset tree for benchmarking makedb.
+
+The tree follows the naming rules parsed by FileFinder, so that makedb can be
+run on it without a licensed copy of the game:
+
+  <out>/browser/protected/DVD/<dir>_Data-MHK/<viewpoint>_<island><parts>.<ext>
+
+along with a map.json, objects.json5 and kveer-files.txt describing it. The
+image contents are noise and the movies are ffmpeg test patterns."""
+
+from PIL import Image
+import argparse
+import json
+import os
+import random
+import subprocess
+
+StandardImageSize = (608, 392)
+# Other image sizes found in the game (overlays, sprites, ...).
+OtherImageSizes = [(128, 80), (304, 196), (64, 64)]
+MovieSizes = [(608, 392), (144, 112), (80, 64)]
+
+# The game's data directories, by island symbol.
+DataDirs = {
+  'B': 'b_Data-MHK',
+  'G': 'g_Data-MHK',
+  'J': 'j_Data1-MHK',
+  'O': 'o_Data-MHK',
+  'P': 'p_Data-MHK',
+  'R': 'r_Data-MHK',
+  'T': 't_Data1-MHK',
+}
+# Directories makedb skips. Some files are put there so that the scan still
+# has to deal with them.
+ExcludedDirs = ['b2_data-MHK', 'Extras-MHK']
+# K'veer's files are stored with the Temple island ones and only recognized
+# through kveer-files.txt.
+KveerDir = 't_Data1-MHK'
+
+PartWords = ['ext', 'int', 'door', 'bridge', 'dome', 'lever', 'tlscp',
+             'ookdepot', 'craterridge', 'islandexterior', 'bg']
+States = ['s1', 's2', 'odo', 'lu', 'hi', 'up', 'dn']
+
+class Options(object):
+  def __init__(self):
+    self.out = None
+    self.scale = 1
+    self.seed = 0
+
+  def Parse(self):
+    desc = "Generate a fake Riven asset tree for benchmarking makedb."
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('-s', '--scale', type=int, default=1,
+                        help='Size multiplier of the tree (default 1).')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default 0).')
+    parser.add_argument('out', metavar='DIR',
+                        help='The directory to create the tree in.')
+    args = parser.parse_args()
+    self.out = args.out
+    self.scale = args.scale
+    self.seed = args.seed
+
+class TreeGenerator(object):
+  # Per island, at a scale of 1.
+  viewpoints_per_island = 12
+  viewpoints_per_position = 4
+  images_per_viewpoint = 3
+  # One viewpoint in this many also has a movie.
+  movie_every = 4
+
+  def __init__(self, out_dir, scale, seed):
+    self.out_dir = out_dir
+    self.scale = scale
+    self.random = random.Random(seed)
+    self.dvd_dir = os.path.join(out_dir, 'browser', 'protected', 'DVD')
+    self.num_images = 0
+    self.num_movies = 0
+
+  def Parts(self):
+    """Random filename parts, like "ext.1550_s2"."""
+    word = self.random.choice(PartWords)
+    if self.random.random() < 0.5:
+      word += '_' + self.random.choice(PartWords)
+    number = '%d' % (self.random.randrange(1, 200) * 25)
+    if self.random.random() < 0.5:
+      number += '_' + self.random.choice(States)
+    return '%s.%s' % (word, number)
+
+  def WriteImage(self, path, size):
+    self.num_images += 1
+    if os.path.exists(path):
+      return
+    noise = Image.effect_noise(size, self.random.randrange(10, 100))
+    noise.convert('RGB').save(path)
+
+  def WriteMovie(self, path, size):
+    self.num_movies += 1
+    if os.path.exists(path):
+      return
+    cmd = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i',
+           'testsrc=size=%dx%d:rate=15:duration=1' % size, '-c:v', 'mjpeg',
+           path]
+    subprocess.check_call(cmd)
+
+  def MakeDir(self, dir_name):
+    path = os.path.join(self.dvd_dir, dir_name)
+    if not os.path.exists(path):
+      os.makedirs(path)
+    return path
+
+  def WriteViewpoint(self, dir_path, island_symbol, viewpoint_name,
+                     with_movie):
+    """Write a viewpoint's files. Returns the friendly name of one image."""
+    prefix = '%s_%s' % (viewpoint_name, island_symbol.lower())
+    friendly = self.Parts()
+    self.WriteImage(os.path.join(dir_path, '%s%s.png' % (prefix, friendly)),
+                    StandardImageSize)
+    for i in range(self.images_per_viewpoint - 1):
+      size = self.random.choice([StandardImageSize] + OtherImageSizes)
+      self.WriteImage(os.path.join(dir_path, '%s%s.png' % (prefix,
+                                                           self.Parts())),
+                      size)
+    if with_movie:
+      size = self.random.choice(MovieSizes)
+      self.WriteMovie(os.path.join(dir_path, '%s%s.mov' % (prefix,
+                                                           self.Parts())),
+                      size)
+    return friendly
+
+  def WriteIsland(self, island_symbol):
+    """Write an island's files. Returns its map.json entry and object refs."""
+    dir_path = self.MakeDir(DataDirs[island_symbol])
+    num_viewpoints = self.viewpoints_per_island * self.scale
+    names = [str(n + 1) for n in range(num_viewpoints)]
+    refs = []
+    positions = []
+    for start in range(0, num_viewpoints, self.viewpoints_per_position):
+      group = names[start:start + self.viewpoints_per_position]
+      viewpoints = []
+      for i, name in enumerate(group):
+        friendly = self.WriteViewpoint(dir_path, island_symbol, name,
+                                       int(name) % self.movie_every == 0)
+        refs.append('%s/%s/%s' % (island_symbol, name, friendly))
+        viewpoint = {
+          'name': name,
+          'left': group[i - 1],
+          'right': group[(i + 1) % len(group)],
+        }
+        next_start = start + self.viewpoints_per_position
+        if i == 0 and next_start < num_viewpoints:
+          viewpoint['forward'] = names[next_start]
+        viewpoints.append(viewpoint)
+      positions.append({'name': str(len(positions) + 1),
+                        'viewpoints': viewpoints})
+    return ({'symbol': island_symbol, 'positions': positions}, refs)
+
+  def WriteExcluded(self):
+    for dir_name in ExcludedDirs:
+      dir_path = self.MakeDir(dir_name)
+      for n in range(self.scale):
+        self.WriteImage(os.path.join(dir_path, '%d_bexcluded.1.png' % n),
+                        StandardImageSize)
+
+  def WriteKveer(self):
+    """Write K'veer files, which are only known by name."""
+    dir_path = self.MakeDir(KveerDir)
+    names = []
+    for n in range(self.scale):
+      name = '%d_tkveer.%d.png' % (n + 1, n)
+      self.WriteImage(os.path.join(dir_path, name), StandardImageSize)
+      names.append(name)
+    return names
+
+  def Generate(self):
+    islands = []
+    all_refs = []
+    for island_symbol in sorted(DataDirs):
+      island, refs = self.WriteIsland(island_symbol)
+      islands.append(island)
+      all_refs.extend(refs)
+    self.WriteExcluded()
+    kveer_files = self.WriteKveer()
+
+    with open(os.path.join(self.out_dir, 'map.json'), 'w') as f:
+      json.dump(islands, f, indent=2)
+    objects = []
+    for n in range(max(1, len(all_refs) // 10)):
+      refs = self.random.sample(all_refs, min(5, len(all_refs)))
+      # Whole viewpoint references as well as single views.
+      refs.append('/'.join(refs[0].split('/')[:2]))
+      objects.append({'name': 'object-%d' % n, 'title': 'Object %d' % n,
+                      'refs': refs})
+    with open(os.path.join(self.out_dir, 'objects.json5'), 'w') as f:
+      json.dump(objects, f, indent=2)
+    with open(os.path.join(self.out_dir, 'kveer-files.txt'), 'w') as f:
+      for name in kveer_files:
+        f.write(name + '\n')
+
+if __name__ == '__main__':
+  options = Options()
+  options.Parse()
+  generator = TreeGenerator(options.out, options.scale, options.seed)
+  generator.Generate()
+  print('Wrote %d images and %d movies to %s' % (generator.num_images,
+                                                generator.num_movies,
+                                                generator.dvd_dir))
@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 
-from file_finder import FileFinder, FileInfo
-from concurrent.futures import ThreadPoolExecutor
+from file_finder import AssetCatalog, FileFinder, FileInfo
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from graphviz import Digraph
-from PIL import Image
+from PIL import Image, features
+from browser.derivatives import DerivativeCommand
+from build_trace import tracer
+from content_store import ContentStore
+from task_graph import TaskGraph
+import argparse
+import collections
+import hashlib
+import json
 import json5
 import multiprocessing
 import os
@@ -11,6 +19,7 @@ import shutil
 import sqlite3
 import subprocess
 import sys
+import uuid
 
 num_cpus = multiprocessing.cpu_count()
 NumImagePixels = 238336
@@ -22,9 +31,41 @@ class InvalidPathException(Exception):
 class InvalidReferenceException(Exception):
   pass
 
+class BuildProfile(object):
+  """The derivatives a build makes.
+
+  The paths of those it doesn't make are NULL in the database, so the
+  browser never links to them."""
+  kinds = ['thumbnail', 'position gif', 'position webp', 'island map',
+           'movie gif', 'movie h264', 'movie poster', 'movie preview']
+  profiles = {
+    # Everything, to browse locally.
+    'dev': kinds,
+    # What deploy.sh ships: it excludes the GIFs, which no page shows but
+    # as a fallback for the position animations in WebP.
+    'prod': [k for k in kinds if k not in ('movie gif', 'position gif')],
+    # The database and the source files alone, as findimg needs.
+    'findimg-only': [],
+  }
+
+  def __init__(self, name):
+    if name not in BuildProfile.profiles:
+      raise ValueError('Unknown build profile: %s' % name)
+    self.name = name
+    self.made = frozenset(BuildProfile.profiles[name])
+
+  def Makes(self, kind):
+    return kind in self.made
+
 class Globals(object):
-  def __init__(self):
+  def __init__(self, profile, shard_fingerprint=None):
     self.global_id = 1
+    self.build_profile = profile.name
+    # What a shard was built from (see Loader.ShardFingerprint()).
+    self.shard_fingerprint = shard_fingerprint
+    # Identifies the build, so the browser's cached pages of an earlier one
+    # are never served.
+    self.build_id = uuid.uuid4().hex
     self.thumbnail_size = [int(v * Loader.thumbnail_sf) for v in
                            StandardImageSize]
     self.thumbnail2x_size = [int(v * Loader.thumbnail2x_sf) for v in
@@ -34,11 +75,14 @@ class Globals(object):
     row = [self.global_id]
     row.extend(self.thumbnail_size)
     row.extend(self.thumbnail2x_size)
+    row.append(self.build_id)
+    row.append(self.build_profile)
+    row.append(self.shard_fingerprint)
     return row
 
   @staticmethod
   def insert():
-    return '(?,?,?,?,?)'
+    return '(?,?,?,?,?,?,?,?)'
 
   @staticmethod
   def CreateTable(conn):
@@ -48,23 +92,72 @@ class Globals(object):
               thumbnail_width INTEGER,
               thumbnail_height INTEGER,
               thumbnail2x_width INTEGER,
-              thumbnail2x_height INTEGER)''')
-    conn.commit()
+              thumbnail2x_height INTEGER,
+              build_id TEXT,
+              build_profile TEXT,
+              shard_fingerprint TEXT)''')
 
 class Map(object):
   def __init__(self):
     self.islands = dict()
 
-  def WriteGraphViz(self, fname):
-    with open(fname, 'w') as f:
-      dot = Digraph(comment='Riven', node_attr={'margin': '0.0'})
-      dot.engine = 'fdp'
-      for island_symbol in self.islands:
-        self.islands[island_symbol].AddGraphVizData(dot)
-      f.write(dot.source)
-      dot.render(fname)
+  def WriteGraphViz(self, out_dir, executor, island_symbols=None):
+    """Write a Graphviz graph per island (of |island_symbols|, or all) and
+    render the changed ones to SVG.
+
+    Islands are laid out in separate processes on |executor|. An island is
+    skipped when its SVG exists and was rendered from the same dot source.
+    Returns the rendering futures."""
+    if not os.path.exists(out_dir):
+      os.makedirs(out_dir, exist_ok=True)
+    futures = []
+    for island_symbol in sorted(island_symbols or self.islands):
+      dot = Digraph(comment='Riven %s' % island_symbol,
+                    node_attr={'margin': '0.0'})
+      self.islands[island_symbol].AddGraphVizData(dot)
+      source = dot.source
+      digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+      dot_path = os.path.join(out_dir, '%s.dot' % island_symbol)
+      svg_path = os.path.join(out_dir, '%s.svg' % island_symbol)
+      if os.path.exists(svg_path) and \
+         Map.ReadDigest(dot_path + '.sha1') == digest:
+        continue
+      with open(dot_path, 'w') as f:
+        f.write(source)
+      futures.append(executor.submit(Map.RenderSvg, tracer.Fork(), out_dir,
+                                     island_symbol, digest))
+    return futures
+
+  @staticmethod
+  def ReadDigest(fname):
+    try:
+      with open(fname) as f:
+        return f.read().strip()
+    except FileNotFoundError:
+      return None
+
+  @staticmethod
+  def RenderSvg(island_tracer, out_dir, island_symbol, digest):
+    """Render an island's SVG. Returns the trace events of the render."""
+    # Run from |out_dir| so that the node images, which are relative to it,
+    # are found by fdp and written to the SVG as relative URLs.
+    dot_name = '%s.dot' % island_symbol
+    svg_name = '%s.svg' % island_symbol
+    cmd = ['fdp', '-Tsvg', '-o', svg_name, dot_name]
+    print(' '.join(cmd))
+    island_tracer.Run(cmd, 'graphviz',
+                      inputs=[os.path.join(out_dir, dot_name)],
+                      outputs=[os.path.join(out_dir, svg_name)], cwd=out_dir)
+    with open(os.path.join(out_dir, '%s.dot.sha1' % island_symbol), 'w') as f:
+      f.write(digest)
+    return island_tracer.events
 
 class Island(object):
+  # The positions, viewpoints, images and movies of an island are numbered
+  # from one per island, under the island's ID: their IDs are the same
+  # whichever islands a build makes, so an island is built alone (see
+  # Loader.BuildShard) and refers to the viewpoints of the others.
+  id_bits = 32
   # name, AKA, Suffix, icon
   info = {
     'A': ['Always Loaded', '', '', 'all_icon.png'],
@@ -90,6 +183,13 @@ class Island(object):
       self.icon = ''
     self.positions = dict()  # Position.name -> Position
     self.viewpoints = dict() # Viewpoint.name -> Viewpoint
+    self.id_counts = dict()  # Kind of row -> IDs given
+
+  def NewId(self, kind):
+    """The next ID of a |kind| of row on this island."""
+    count = self.id_counts.get(kind, 0) + 1
+    self.id_counts[kind] = count
+    return (self.id << Island.id_bits) | count
 
   def GetViewpoint(self, viewpoint_name):
     """Get (or create) a Viewpoint"""
@@ -101,7 +201,7 @@ class Island(object):
 
   def FindPosition(self, viewpoint_name):
     if viewpoint_name in self.viewpoints:
-      return self.viewpoints[viewpoint_name]
+      return self.viewpoints[viewpoint_name].position
     else:
       return None
 
@@ -118,7 +218,6 @@ class Island(object):
     c.execute('''CREATE TABLE islands
              (island_id INTEGER PRIMARY KEY AUTOINCREMENT,
               symbol TEXT, name TEXT, aka TEXT, suffix TEXT, icon TEXT)''')
-    conn.commit()
 
   @property
   def graphviz_name(self):
@@ -135,22 +234,21 @@ class Island(object):
     map_graph.subgraph(island_graph)
 
 class Position(object):
-  next_id = 1
-
   def __init__(self, name, island):
-    self.id = Position.next_id
-    Position.next_id += 1
+    self.id = island.NewId('position')
     self.name = name
     self.thumbnail = None
+    self.thumbnail_webp = None
     self.island = island
     self.viewpoints = dict() # Viewpoint.name => viewpoint
 
   def sqlrow(self):
-    return [self.id, self.name, self.island.id, self.thumbnail]
+    return [self.id, self.name, self.island.id, self.thumbnail,
+            self.thumbnail_webp]
 
   @staticmethod
   def insert():
-    return '(?,?,?,?)'
+    return '(?,?,?,?,?)'
 
   @staticmethod
   def CreateTable(conn):
@@ -160,8 +258,8 @@ class Position(object):
               name TEXT,
               island INTEGER,
               thumbnail TEXT,
+              thumbnail_webp TEXT,
               FOREIGN KEY(island) REFERENCES islands(island_id))''')
-    conn.commit()
 
   @property
   def graphviz_name(self):
@@ -206,7 +304,6 @@ class Object(object):
               title TEXT,
               thumbnail TEXT,
               thumbnail2x TEXT)''')
-    conn.commit()
 
 class ObjectImageAssocation(object):
   def __init__(self, obj, img):
@@ -228,7 +325,6 @@ class ObjectImageAssocation(object):
               image INTEGER,
               FOREIGN KEY(object) REFERENCES objects(object_id),
               FOREIGN KEY(image) REFERENCES rivenimgs(image_id))''')
-    conn.commit()
 
   @staticmethod
   def InsertAll(cursor, items):
@@ -256,7 +352,6 @@ class ObjectMovieAssocation(object):
               movie INTEGER,
               FOREIGN KEY(object) REFERENCES objects(object_id),
               FOREIGN KEY(movie) REFERENCES rivenmovs(movie_id))''')
-    conn.commit()
 
   @staticmethod
   def InsertAll(cursor, items):
@@ -265,11 +360,8 @@ class ObjectMovieAssocation(object):
         [i.sqlrow() for i in items])
 
 class Viewpoint(object):
-  next_id = 1
-
   def __init__(self, name, island):
-    self.id = Viewpoint.next_id
-    Viewpoint.next_id += 1
+    self.id = island.NewId('viewpoint')
     self.name = name
     self.island = island
     self.position = None
@@ -281,6 +373,9 @@ class Viewpoint(object):
     self.backward_viewpoint = None
     self.thumbnail = None
     self.thumbnail2x = None
+    # The decoded thumbnail, when made in this run, until the position
+    # animation is made from it.
+    self.thumbnail_frame = None
 
   def sqlrow(self):
     pos_id = self.position.id if self.position else None
@@ -323,8 +418,6 @@ class Viewpoint(object):
               FOREIGN KEY(backward_viewpoint) REFERENCES viewpoints(viewpoint_id),
               FOREIGN KEY(position) REFERENCES positions(position_id))''')
 
-    conn.commit()
-
   @property
   def graphviz_name(self):
     return 'V%d' % self.id
@@ -333,10 +426,22 @@ class Viewpoint(object):
   def graphviz_title(self):
     return 'V%s' % self.name
 
+  @property
+  def graphviz_url(self):
+    # Relative to the island SVG at /protected/maps/<island_symbol>.svg.
+    return '../../island/%s/viewpoint/%s' % (self.island.symbol, self.name)
+
   def AddGraphVizData(self, position_graph):
+    attrs = {'URL': self.graphviz_url, 'target': '_top',
+             'tooltip': '%s/%s' % (self.island.symbol, self.name)}
+    if self.thumbnail2x:
+      # Relative to the maps directory (see Map.RenderSvg).
+      attrs['image'] = os.path.join('..', self.thumbnail2x)
+      attrs['label'] = ''
+    else:
+      attrs['label'] = self.name
     position_graph.node(name=self.graphviz_name, title=self.graphviz_title,
-                        shape='rect',
-                        image=Loader.ProtectPath(self.thumbnail2x))
+                        shape='rect', **attrs)
     if self.left_viewpoint:
       position_graph.edge(self.graphviz_name, self.left_viewpoint.graphviz_name, 'L')
     if self.right_viewpoint:
@@ -351,18 +456,28 @@ class Viewpoint(object):
       position_graph.edge(self.graphviz_name, self.backward_viewpoint.graphviz_name, 'B')
 
 class RivenImg(object):
-  next_id = 1
+  """A game image. |file_path| is where it is in the game's files, and
+  |store_path| where it is served from in the content store, both relative
+  to the protected directory."""
+  __slots__ = ('id', 'viewpoint', 'friendly', 'file_path', 'image_width',
+               'image_height', 'content_hash', 'store_path')
 
-  def __init__(self, viewpoint, filename, friendly, file_path, image_width,
+  def __init__(self, viewpoint, friendly, file_path, image_width,
                image_height):
-    self.id = RivenImg.next_id
-    RivenImg.next_id += 1
+    self.id = viewpoint.island.NewId('image')
     self.viewpoint = viewpoint
-    self.filename = filename
     self.friendly = friendly
     self.file_path = file_path
     self.image_width = image_width
     self.image_height = image_height
+    self.content_hash = None
+    self.store_path = None
+
+  @property
+  def filename(self):
+    return '%s_%s%s.png' % (self.viewpoint.name,
+                            self.viewpoint.island.symbol.lower(),
+                            self.friendly)
 
   def IsFullSize(self):
     return self.image_width == StandardImageSize[0] and \
@@ -370,11 +485,12 @@ class RivenImg(object):
 
   def sqlrow(self):
     return [self.id, self.viewpoint.id, self.filename, self.friendly,
-            self.file_path, self.image_width, self.image_height]
+            self.file_path, self.image_width, self.image_height,
+            self.content_hash, self.store_path]
 
   @staticmethod
   def insert():
-    return '(?,?,?,?,?,?,?)'
+    return '(?,?,?,?,?,?,?,?,?)'
 
   @staticmethod
   def CreateTable(conn):
@@ -387,33 +503,47 @@ class RivenImg(object):
               file_path TEXT,
               image_width INTEGER,
               image_height INTEGER,
+              content_hash TEXT,
+              store_path TEXT,
               FOREIGN KEY(viewpoint) REFERENCES viewpoints(viewpoint_id))''')
-    conn.commit()
 
 class RivenMovie(object):
-  next_id = 1
-
-  def __init__(self, viewpoint, filename, friendly, file_path, gif_path,
-               h264_path, movie_width, movie_height):
-    self.id = RivenMovie.next_id
-    RivenMovie.next_id += 1
+  """A game movie. Its paths are relative to the protected directory, as
+  those of a RivenImg."""
+  __slots__ = ('id', 'viewpoint', 'friendly', 'file_path', 'anim_gif_path',
+               'h264_path', 'movie_width', 'movie_height', 'content_hash',
+               'poster_path', 'preview_path', 'store_path')
+
+  def __init__(self, viewpoint, friendly, file_path, gif_path, h264_path,
+               movie_width, movie_height):
+    self.id = viewpoint.island.NewId('movie')
     self.viewpoint = viewpoint
-    self.filename = filename
     self.friendly = friendly
     self.file_path = file_path
     self.anim_gif_path = gif_path
     self.h264_path = h264_path
     self.movie_width = movie_width
     self.movie_height = movie_height
+    self.content_hash = None
+    self.poster_path = None
+    self.preview_path = None
+    self.store_path = None
+
+  @property
+  def filename(self):
+    return '%s_%s%s.mov' % (self.viewpoint.name,
+                            self.viewpoint.island.symbol.lower(),
+                            self.friendly)
 
   def sqlrow(self):
     return [self.id, self.viewpoint.id, self.filename, self.friendly,
             self.file_path, self.anim_gif_path, self.h264_path,
-            self.movie_width, self.movie_height]
+            self.movie_width, self.movie_height, self.content_hash,
+            self.poster_path, self.preview_path, self.store_path]
 
   @staticmethod
   def insert():
-    return '(?,?,?,?,?,?,?,?,?)'
+    return '(?,?,?,?,?,?,?,?,?,?,?,?,?)'
 
   @staticmethod
   def CreateTable(conn):
@@ -428,17 +558,321 @@ class RivenMovie(object):
               h264_path TEXT,
               movie_width INTEGER,
               movie_height INTEGER,
+              content_hash TEXT,
+              poster_path TEXT,
+              preview_path TEXT,
+              store_path TEXT,
               FOREIGN KEY(viewpoint) REFERENCES viewpoints(viewpoint_id))''')
-    conn.commit()
+
+class Derivative(object):
+  """A derivative left to be made on first request (see
+  browser/derivatives.py). Paths are relative to the protected directory."""
+  def __init__(self, path, kind, source, island):
+    self.path = path
+    self.kind = kind
+    self.source = source
+    self.island = island
+
+  def sqlrow(self):
+    return [self.path, self.kind, self.source, self.island.symbol]
+
+  @staticmethod
+  def insert():
+    return '(?,?,?,?)'
+
+  @staticmethod
+  def CreateTable(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE derivatives
+             (path TEXT PRIMARY KEY,
+              kind TEXT,
+              source TEXT,
+              island TEXT)
+             WITHOUT ROWID''')
+
+class PackEntry(object):
+  """A file packed into browser/protected/packs/<pack> (see browser/packs.py).
+  Paths are relative to the protected directory."""
+  def __init__(self, path, offset, size):
+    self.path = path
+    self.pack = None
+    self.offset = offset
+    self.size = size
+
+  def sqlrow(self):
+    return [self.path, self.pack, self.offset, self.size]
+
+  @staticmethod
+  def insert():
+    return '(?,?,?,?)'
+
+  @staticmethod
+  def CreateTable(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE pack_index
+             (path TEXT PRIMARY KEY,
+              pack TEXT,
+              offset INTEGER,
+              size INTEGER)
+             WITHOUT ROWID''')
+
+class AssetIndex(object):
+  """Lookup of images and movies by viewpoint, built once all sizes are known.
+
+  Replaces linear scans over every asset when resolving object references."""
+
+  def __init__(self, images, movies):
+    self.images = dict()   # (island_symbol, viewpoint_name, friendly) -> RivenImg
+    self.movies = dict()   # (island_symbol, viewpoint_name, friendly) -> RivenMovie
+    self.full_size = dict() # (island_symbol, viewpoint_name) -> [RivenImg]
+    for image in images:
+      key = AssetIndex.ViewpointKey(image.viewpoint)
+      # Keep the first one, as the linear scan did.
+      self.images.setdefault(key + (image.friendly,), image)
+      if image.IsFullSize():
+        self.full_size.setdefault(key, []).append(image)
+    for movie in movies:
+      key = AssetIndex.ViewpointKey(movie.viewpoint)
+      self.movies.setdefault(key + (movie.friendly,), movie)
+
+  @staticmethod
+  def ViewpointKey(viewpoint):
+    return (viewpoint.island.symbol, viewpoint.name)
+
+  def FindImage(self, viewpoint, friendly):
+    return self.images.get(AssetIndex.ViewpointKey(viewpoint) + (friendly,))
+
+  def FindMovie(self, viewpoint, friendly):
+    return self.movies.get(AssetIndex.ViewpointKey(viewpoint) + (friendly,))
+
+  def FullSizeImages(self, viewpoint):
+    return self.full_size.get(AssetIndex.ViewpointKey(viewpoint), [])
+
+class RouteIndex(object):
+  """Shortest routes between viewpoints.
+
+  Within an island the routes table holds, for every (source, dest) pair, the
+  first move to make from source and the number of moves left. The gateways
+  table holds the links between islands, so a route between islands is the
+  shortest over the gateways and the distances to them."""
+
+  directions = [('left', 'left_viewpoint'), ('right', 'right_viewpoint'),
+                ('up', 'up_viewpoint'), ('down', 'down_viewpoint'),
+                ('forward', 'forward_viewpoint'),
+                ('backward', 'backward_viewpoint')]
+
+  @staticmethod
+  def Edges(viewpoint):
+    """Return the (direction, viewpoint) links out of |viewpoint|."""
+    edges = []
+    for direction, attr in RouteIndex.directions:
+      other = getattr(viewpoint, attr)
+      if other:
+        edges.append((direction, other))
+    return edges
+
+  @staticmethod
+  def IslandRoutes(island):
+    """Return [source_id, dest_id, next_hop_id, direction, distance] rows.
+
+    Runs a BFS backwards from each destination, so that the first time a
+    source is reached its next hop lies on a shortest path."""
+    incoming = dict()  # viewpoint id -> [(direction, source viewpoint)]
+    for viewpoint in island.viewpoints.values():
+      for direction, other in RouteIndex.Edges(viewpoint):
+        if other.island is island:
+          incoming.setdefault(other.id, []).append((direction, viewpoint))
+    rows = []
+    for dest in island.viewpoints.values():
+      rows.append([dest.id, dest.id, None, None, 0])
+      distance = {dest.id: 0}
+      queue = collections.deque([dest])
+      while queue:
+        hop = queue.popleft()
+        for direction, source in incoming.get(hop.id, []):
+          if source.id in distance:
+            continue
+          distance[source.id] = distance[hop.id] + 1
+          rows.append([source.id, dest.id, hop.id, direction,
+                       distance[source.id]])
+          queue.append(source)
+    return rows
+
+  @staticmethod
+  def Gateways(riven_map):
+    """Return [island_id, next_island_id, exit_id, entry_id, direction] rows
+    for every link which crosses to another island."""
+    rows = []
+    for island in riven_map.islands.values():
+      for viewpoint in island.viewpoints.values():
+        for direction, other in RouteIndex.Edges(viewpoint):
+          if other.island is not island:
+            rows.append([island.id, other.island.id, viewpoint.id, other.id,
+                         direction])
+    return rows
+
+  @staticmethod
+  def CreateTable(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE routes
+              (source INTEGER,
+              dest INTEGER,
+              next_hop INTEGER,
+              direction TEXT,
+              distance INTEGER,
+              PRIMARY KEY(source, dest),
+              FOREIGN KEY(source) REFERENCES viewpoints(viewpoint_id),
+              FOREIGN KEY(dest) REFERENCES viewpoints(viewpoint_id),
+              FOREIGN KEY(next_hop) REFERENCES viewpoints(viewpoint_id))
+              WITHOUT ROWID''')
+    c.execute('''CREATE TABLE gateways
+              (island INTEGER,
+              next_island INTEGER,
+              exit_viewpoint INTEGER,
+              entry_viewpoint INTEGER,
+              direction TEXT,
+              PRIMARY KEY(island, next_island, exit_viewpoint, direction),
+              FOREIGN KEY(island) REFERENCES islands(island_id),
+              FOREIGN KEY(next_island) REFERENCES islands(island_id),
+              FOREIGN KEY(exit_viewpoint) REFERENCES viewpoints(viewpoint_id),
+              FOREIGN KEY(entry_viewpoint) REFERENCES viewpoints(viewpoint_id))
+              WITHOUT ROWID''')
+
+  @staticmethod
+  def InsertIslandRoutes(cursor, island):
+    """Insert the routes within |island|. Returns their number."""
+    rows = RouteIndex.IslandRoutes(island)
+    cursor.executemany('INSERT INTO routes VALUES (?,?,?,?,?)', rows)
+    return len(rows)
+
+  @staticmethod
+  def InsertGateways(cursor, riven_map):
+    """Insert the links between islands. Returns their number."""
+    gateways = RouteIndex.Gateways(riven_map)
+    cursor.executemany('INSERT INTO gateways VALUES (?,?,?,?,?)', gateways)
+    return len(gateways)
+
+  @staticmethod
+  def InsertAll(cursor, riven_map):
+    route_count = 0
+    for island in riven_map.islands.values():
+      route_count += RouteIndex.InsertIslandRoutes(cursor, island)
+    gateway_count = RouteIndex.InsertGateways(cursor, riven_map)
+    print('# Routes:%d, # Gateways:%d' % (route_count, gateway_count))
+
+class SearchIndex(object):
+  """Full text index over viewpoints, images, movies and objects.
+
+  Names are indexed by their parts (see FileInfo.SplitParts) so that
+  "ext.1550_s2" is found by "ext", "1550" or "s2", and each part can be
+  matched by prefix for autocomplete."""
+
+  @staticmethod
+  def Terms(*names):
+    """Return the space separated search terms for |names|.
+
+    >>> SearchIndex.Terms('T', '75', 'ext.1550_s2')
+    't 75 ext 1550 s2'
+    """
+    terms = []
+    for name in names:
+      for part in FileInfo.SplitParts(str(name)):
+        terms.extend(p.lower() for p in part if p)
+    return ' '.join(terms)
+
+  @staticmethod
+  def CreateTable(conn):
+    c = conn.cursor()
+    c.execute('''CREATE VIRTUAL TABLE search USING fts5
+              (terms,
+              title,
+              kind UNINDEXED,
+              island UNINDEXED,
+              viewpoint UNINDEXED,
+              name UNINDEXED,
+              prefix='1 2 3 4')''')
+
+  @staticmethod
+  def InsertAll(cursor, viewpoints, images, movies, objects):
+    rows = []
+    for v in viewpoints:
+      rows.append([SearchIndex.Terms(v.island.symbol, v.name),
+                   v.island.name, 'viewpoint', v.island.symbol, v.name,
+                   v.name])
+    for i in images:
+      v = i.viewpoint
+      rows.append([SearchIndex.Terms(v.island.symbol, v.name, i.friendly),
+                   i.filename, 'image', v.island.symbol, v.name, i.friendly])
+    for m in movies:
+      v = m.viewpoint
+      rows.append([SearchIndex.Terms(v.island.symbol, v.name, m.friendly),
+                   m.filename, 'movie', v.island.symbol, v.name, m.friendly])
+    for o in objects:
+      rows.append([SearchIndex.Terms(o.name.replace('-', '_')), o.title,
+                   'object', None, None, o.name])
+    cursor.executemany('''INSERT INTO search
+                       (terms, title, kind, island, viewpoint, name)
+                       VALUES (?,?,?,?,?,?)''', rows)
+    cursor.execute("INSERT INTO search(search) VALUES ('optimize')")
 
 class Loader(object):
   protected_dir = os.path.join('browser', 'protected')
   thumbnail_sf = 0.18
   thumbnail2x_sf = thumbnail_sf * 2
+  # Position animations: frame duration, and WebP encoding when available.
+  position_frame_ms = 800
+  webp_quality = 80
+  has_webp = features.check('webp')
+  # The database is built into a temporary file, which is thrown away if the
+  # build fails, so nothing needs journaling or syncing.
+  bulk_load_pragmas = ['journal_mode = OFF', 'synchronous = OFF',
+                       'cache_size = -262144',  # 256 MiB
+                       'locking_mode = EXCLUSIVE', 'temp_store = MEMORY']
+  # (kind, RivenMovie attribute, suffix) of the derivatives of a movie.
+  movie_derivatives = [('movie gif', 'anim_gif_path', '.gif'),
+                       ('movie h264', 'h264_path', '.m4v'),
+                       ('movie poster', 'poster_path', '.poster.jpg'),
+                       ('movie preview', 'preview_path', '.preview.m4v')]
+  # The version of what a shard holds: bumped whenever its tables, or what
+  # makedb puts in them, change, so that the older shards are rebuilt.
+  shard_format = 1
+  # The tables of a shard which are copied as they are by the merge.
+  shard_tables = ['islands', 'positions', 'viewpoints', 'rivenimgs',
+                  'rivenmovs', 'routes']
+  # Files left out of the packs, as deploy.sh doesn't ship them.
+  unpacked_extensions = frozenset(['.gif', '.mov'])
+  # (name, table(columns)) of the indexes made by CreateIndexes().
+  indexes = [
+    ('viewpoints_island_name', 'viewpoints(island, name)'),
+    ('viewpoints_position', 'viewpoints(position)'),
+    ('positions_island', 'positions(island)'),
+    ('rivenimgs_viewpoint', 'rivenimgs(viewpoint)'),
+    ('rivenmovs_viewpoint', 'rivenmovs(viewpoint)'),
+    ('objects_name', 'objects(name)'),
+    ('object_images_object', 'object_images(object)'),
+    ('object_images_image', 'object_images(image)'),
+    ('object_movies_object', 'object_movies(object)'),
+    ('object_movies_movie', 'object_movies(movie)'),
+    ('derivatives_island', 'derivatives(island)'),
+  ]
 
   def __init__(self, top_dir):
     self.top_dir = top_dir
     self.db_path = 'riven.sqlite'
+    # Record the movie transcodes in the derivatives table rather than
+    # running them.
+    self.lazy_derivatives = False
+    self.derivatives = []
+    self.profile = BuildProfile('dev')
+    # Pack each island's files into one file (see browser/packs.py).
+    self.pack = False
+    # Where the database of each island is built before they are merged.
+    self.shard_dir = 'shards'
+    # Threads running jobs, and processes rendering.
+    self.workers = num_cpus
+    self.store = ContentStore(Loader.ProtectPath('cas'))
+    # The game files, scanned once (see Catalog()).
+    self.catalog = None
 
   @staticmethod
   def ProtectPath(path):
@@ -462,13 +896,12 @@ class Loader(object):
       raise InvalidPathException()
     return path.replace(Loader.protected_dir + '/', '')
 
-  def CreateTables(self, conn):
+  def CreateTables(self, conn, shard_fingerprint=None):
 
     c = conn.cursor()
     c.execute('''CREATE TABLE users
               (user_id INTEGER PRIMARY KEY AUTOINCREMENT,
               username TEXT, name TEXT)''')
-    conn.commit()
 
     Globals.CreateTable(conn)
     Island.CreateTable(conn)
@@ -479,12 +912,20 @@ class Loader(object):
     Object.CreateTable(conn)
     ObjectImageAssocation.CreateTable(conn)
     ObjectMovieAssocation.CreateTable(conn)
+    SearchIndex.CreateTable(conn)
+    RouteIndex.CreateTable(conn)
+    Derivative.CreateTable(conn)
+    PackEntry.CreateTable(conn)
 
-    g = Globals()
+    g = Globals(self.profile, shard_fingerprint)
     c.executemany('INSERT INTO globals VALUES %s' % Globals.insert(),
                   [g.sqlrow()])
 
-    conn.commit()
+  def CreateIndexes(self, conn):
+    """Index the tables, once they are filled."""
+    c = conn.cursor()
+    for name, columns in Loader.indexes:
+      c.execute('CREATE INDEX %s ON %s' % (name, columns))
 
   @staticmethod
   def ParseIslandViewpoint(current_island, viewpoint_name):
@@ -556,24 +997,29 @@ class Loader(object):
     return '%s.%s' % (bname, newextn)
 
   @staticmethod
-  def TranscodeMovie(mov, outpath):
-    cmd = ['ffmpeg', '-loglevel', 'error', '-y', '-i', mov, outpath]
+  def MakeDerivative(kind, mov, outpath):
+    cmd = DerivativeCommand(kind, mov, outpath)
     print(' '.join(cmd))
-    subprocess.check_call(cmd)
-
-  @staticmethod
-  def MakeH264(mov, outpath):
-    cmd = ['ffmpeg', '-loglevel', 'error', '-y', '-i', mov, '-b', '200k',
-            '-bt', '240k', '-vcodec', 'libx264', '-crf', '23', outpath]
-    print(' '.join(cmd))
-    subprocess.check_call(cmd)
+    tracer.Run(cmd, kind, inputs=[mov], outputs=[outpath])
+
+  def MakeMovieDerivative(self, kind, movie, extension):
+    """Make the |kind| derivative of the probed |movie|, unless it exists,
+    or record it to be made on first request."""
+    outpath = self.store.Path(movie.content_hash, extension)
+    if self.lazy_derivatives:
+      if not os.path.exists(outpath) and self.store.Claim(outpath):
+        self.derivatives.append(Derivative(Loader.UnprotectPath(outpath), kind,
+                                           movie.store_path,
+                                           movie.viewpoint.island))
+      return
+    self.store.Make(kind, outpath, Loader.MakeDerivative, kind,
+                    Loader.ProtectPath(movie.store_path), outpath)
 
   def CreateUsers(self, conn):
     c = conn.cursor()
     users = []
     users = [[1, 'admin', 'Administrator']]
     c.executemany('INSERT INTO users VALUES (?,?,?)', users)
-    conn.commit()
 
   @staticmethod
   def GetMovieSize(movie):
@@ -581,7 +1027,7 @@ class Loader(object):
            '-of', 'default=noprint_wrappers=1', movie]
     width = None
     height = None
-    output = subprocess.check_output(cmd)
+    output = tracer.Run(cmd, 'movie probe', inputs=[movie], capture=True)
     for line in output.splitlines():
       items = line.decode("utf-8").split('=')
       if items[0] == 'width':
@@ -592,200 +1038,209 @@ class Loader(object):
 
   @staticmethod
   def GetMovieThumbnailSource(movies):
+    """The largest of the (already probed) |movies|."""
     biggest_movie = None
     biggest_movie_size = 0
     for movie in movies:
-      (width, height) = Loader.GetMovieSize(movie.file_path)
-      num_pixels = width * height
+      num_pixels = movie.movie_width * movie.movie_height
       if num_pixels > biggest_movie_size:
         biggest_movie_size = num_pixels
         biggest_movie = movie
-    return biggest_movie.file_path
+    if not biggest_movie:
+      return None
+    return Loader.ProtectPath(biggest_movie.store_path)
 
   @staticmethod
   def ExtractMovieImage(moviefile, outfile):
     cmd = ['ffmpeg', '-loglevel', 'error', '-y', '-i', moviefile, '-ss',
            '00:00:01.000', '-vframes', '1', outfile]
-    subprocess.check_call(cmd)
+    tracer.Run(cmd, 'movie frame', inputs=[moviefile], outputs=[outfile])
 
   @staticmethod
   def GetImageThumbnailSource(images):
+    """The first full size image of the (already probed) |images|."""
     for image in images:
-      filename = Loader.ProtectPath(image.file_path)
-      with Image.open(filename) as im:
-        width, height = im.size
-        num_pixels = width * height
-        if num_pixels == NumImagePixels:
-          return filename
+      if image.image_width * image.image_height == NumImagePixels:
+        return Loader.ProtectPath(image.store_path)
     return None
 
   @staticmethod
   def ScaleImage(infile, outfile, scale_factor):
     print('%s -> %s' % (infile, outfile))
-    with Image.open(infile) as im:
-      width, height = im.size
-      thumb = im.resize((int(width*scale_factor), int(height*scale_factor)),
-                        Image.BICUBIC)
-      thumb.save(outfile)
+    with tracer.Span(os.path.basename(infile), 'thumbnail', inputs=[infile],
+                     outputs=[outfile]):
+      with Image.open(infile) as im:
+        width, height = im.size
+        thumb = im.resize((int(width*scale_factor), int(height*scale_factor)),
+                          Image.BICUBIC)
+        thumb.save(outfile)
+    return thumb
 
   @staticmethod
   def CreateMovieThumbnail(moviefile, outfile, scale_factor):
+    """Returns the thumbnail, or None if it already existed."""
     if os.path.exists(outfile):
-      return
+      return None
     large_size = outfile + 'thumbnail-large.png'
     Loader.ExtractMovieImage(moviefile, large_size)
-    Loader.ScaleImage(large_size, outfile, scale_factor)
+    thumb = Loader.ScaleImage(large_size, outfile, scale_factor)
     os.remove(large_size)
+    return thumb
 
   @staticmethod
-  def CreateAnimatedGif(image_list, outfile):
-    if os.path.exists(outfile):
-      return
-    cmd = ['convert', '-delay', '80', '-loop', '0']
-    cmd.extend(image_list)
-    cmd.append(outfile)
-    print(' '.join(cmd))
-    subprocess.check_call(cmd)
+  def LoadFrames(frames):
+    """Decode the |frames| given as paths, and bring them all to the size of
+    the first one."""
+    frames = [f if isinstance(f, Image.Image) else Image.open(f)
+              for f in frames]
+    frames = [f.convert('RGB') for f in frames]
+    size = frames[0].size
+    return [f if f.size == size else f.resize(size, Image.BICUBIC)
+            for f in frames]
 
   @staticmethod
-  def CreatePositionImageThumbnail(position, viewpoints, executor):
-    futures = []
+  def CreatePositionAnimations(task_tracer, frames, gif_path, webp_path):
+    """Animate |frames| (thumbnail images, or their paths when they weren't
+    made in this run) into |gif_path| and |webp_path|, skipping those which
+    exist or are None (|webp_path| is without WebP support).
+
+    The GIF frames share one palette, computed over all of them. Runs in a
+    worker process. Returns the trace events."""
+    outputs = [p for p in (gif_path, webp_path)
+               if p and not os.path.exists(p)]
+    with task_tracer.Span(os.path.basename(gif_path or webp_path),
+                          'position animation', outputs=outputs):
+      frames = Loader.LoadFrames(frames)
+      if gif_path in outputs:
+        width, height = frames[0].size
+        strip = Image.new('RGB', (width, height * len(frames)))
+        for i, frame in enumerate(frames):
+          strip.paste(frame, (0, height * i))
+        palette = strip.quantize(colors=256)
+        gif_frames = [f.quantize(palette=palette) for f in frames]
+        gif_frames[0].save(gif_path, save_all=True,
+                           append_images=gif_frames[1:],
+                           duration=Loader.position_frame_ms, loop=0)
+      if webp_path in outputs:
+        frames[0].save(webp_path, save_all=True, append_images=frames[1:],
+                       duration=Loader.position_frame_ms, loop=0,
+                       quality=Loader.webp_quality, method=6)
+    return task_tracer.events
 
+  @staticmethod
+  def CreatePositionImageThumbnail(position, profile, executor):
+    """Animate the thumbnails of the viewpoints at |position|, in the
+    formats |profile| makes.
+
+    Runs once the position's viewpoint thumbnails have been made. Returns
+    the Future of the encoding, submitted to the process pool |executor|,
+    or None if there is nothing to encode."""
+    frames = []
     anim_images = []
-    for viewpoint in viewpoints:
-      if position.island.id == viewpoint.island.id and \
-         viewpoint.name in position.viewpoints:
+    for viewpoint in position.viewpoints.values():
+      if viewpoint.thumbnail:
         anim_images.append(Loader.ProtectPath(viewpoint.thumbnail))
+        frames.append(viewpoint.thumbnail_frame or anim_images[-1])
+        viewpoint.thumbnail_frame = None
 
     if not len(anim_images):
-      return futures
+      return
 
     if len(anim_images) == 1:
-      outfile = anim_images[0]
-    else:
-      outfile = os.path.join(os.path.dirname(anim_images[0]),
-          'position_%d_thumbnail.gif' % position.id)
-      futures.append(executor.submit(Loader.CreateAnimatedGif,
-                                     anim_images, outfile))
-    position.thumbnail = Loader.UnprotectPath(outfile)
-    return futures
-
-  @staticmethod
-  def CreateAllPositionImageThumbnails(positions, viewpoints, executor):
-    futures = []
-    for position in positions:
-      futures.append(executor.submit(Loader.CreatePositionImageThumbnail,
-                                     position,
-                                     viewpoints,
-                                     executor))
-    return futures
+      position.thumbnail = Loader.UnprotectPath(anim_images[0])
+      return
+    # Named after the position rather than their content, so kept out of the
+    # content store.
+    out_dir = Loader.ProtectPath('positions')
+    os.makedirs(out_dir, exist_ok=True)
+    gif_path = None
+    if profile.Makes('position gif'):
+      gif_path = os.path.join(out_dir,
+                              'position_%d_thumbnail.gif' % position.id)
+    webp_path = None
+    if Loader.has_webp and profile.Makes('position webp'):
+      webp_path = os.path.join(out_dir,
+                               'position_%d_thumbnail.webp' % position.id)
+    if not gif_path and not webp_path:
+      return
+    if gif_path:
+      position.thumbnail = Loader.UnprotectPath(gif_path)
+    if webp_path:
+      position.thumbnail_webp = Loader.UnprotectPath(webp_path)
+    if all(os.path.exists(p) for p in (gif_path, webp_path) if p):
+      return None
+    print('Animating %s' % (gif_path or webp_path))
+    future = executor.submit(Loader.CreatePositionAnimations, tracer.Fork(),
+                             frames, gif_path, webp_path)
+    def AddEvents(f):
+      if not f.exception():
+        for event in f.result():
+          tracer.AddEvent(event)
+    future.add_done_callback(AddEvents)
+    return future
 
   @staticmethod
-  def CreateViewpointImageThumbnails(viewpoint, thumbnail_src, executor):
-    futures = []
+  def CreateViewpointThumbnailFiles(store, viewpoint, thumbnail_src, make):
+    """Make the thumbnails of |viewpoint| from |thumbnail_src| with
+    make(infile, outfile, scale_factor).
 
+    The thumbnails are named after the (stored) source, so they are made
+    once for all the viewpoints sharing it."""
     # Standard resolution
-    fname = '%s_thumbnail.png' % viewpoint.name
-    outfile = os.path.join(os.path.dirname(thumbnail_src), fname)
-    if not os.path.exists(outfile):
-      futures.append(executor.submit(Loader.ScaleImage,
-                                     thumbnail_src, outfile, Loader.thumbnail_sf))
+    outfile = Loader.SwapExtension(thumbnail_src, 'thumbnail.png')
+    thumb = store.Make('thumbnail', outfile, make, thumbnail_src, outfile,
+                       Loader.thumbnail_sf)
+    if viewpoint.position:
+      viewpoint.thumbnail_frame = thumb
     viewpoint.thumbnail = Loader.UnprotectPath(outfile)
     # Retina resolution
-    fname = '%s_thumbnail2x.png' % viewpoint.name
-    outfile = os.path.join(os.path.dirname(thumbnail_src), fname)
-    if not os.path.exists(outfile):
-      futures.append(executor.submit(Loader.ScaleImage,
-                                     thumbnail_src, outfile, Loader.thumbnail2x_sf))
+    outfile = Loader.SwapExtension(thumbnail_src, 'thumbnail2x.png')
+    store.Make('thumbnail', outfile, make, thumbnail_src, outfile,
+               Loader.thumbnail2x_sf)
     viewpoint.thumbnail2x = Loader.UnprotectPath(outfile)
 
-    return futures
-
   @staticmethod
-  def CreateViewpointMovieThumbnails(viewpoint, thumbnail_src, executor):
-    futures = []
-
-    # Standard resolution
-    fname = '%s_thumbnail.png' % viewpoint.name
-    outfile = os.path.join(os.path.dirname(thumbnail_src), fname)
-    futures.append(executor.submit(Loader.CreateMovieThumbnail,
-                                   thumbnail_src, outfile, Loader.thumbnail_sf))
-    viewpoint.thumbnail = Loader.UnprotectPath(outfile)
-    # Retina resolution
-    fname = '%s_thumbnail2x.png' % viewpoint.name
-    outfile = os.path.join(os.path.dirname(thumbnail_src), fname)
-    futures.append(executor.submit(Loader.CreateMovieThumbnail,
-                                   thumbnail_src, outfile, Loader.thumbnail2x_sf))
-    viewpoint.thumbnail2x = Loader.UnprotectPath(outfile)
-
-    return futures
+  def ProbeImage(store, info, image):
+    """Get the size and content hash of |image|, and add it to |store|."""
+    with tracer.Span(os.path.basename(info.file_path), 'image probe'):
+      with Image.open(info.file_path) as im:
+        image.image_width, image.image_height = im.size
+      image.content_hash = ContentStore.HashFile(info.file_path)
+    stored = store.AddSource(info.file_path, image.content_hash)
+    image.store_path = Loader.UnprotectPath(stored)
 
   @staticmethod
-  def SetImageSize(info, image):
-    with Image.open(info.file_path) as im:
-      image.image_width, image.image_height = im.size
-
-  @staticmethod
-  def SetMovieSize(info, movie):
+  def ProbeMovie(store, profile, info, movie):
+    """Get the size and content hash of |movie|, add it to |store| and name
+    the derivatives |profile| makes after it."""
     movie.movie_width, movie.movie_height = Loader.GetMovieSize(info.file_path)
+    with tracer.Span(os.path.basename(info.file_path), 'movie hash'):
+      movie.content_hash = ContentStore.HashFile(info.file_path)
+    stored = store.AddSource(info.file_path, movie.content_hash)
+    movie.store_path = Loader.UnprotectPath(stored)
+    for kind, attr, suffix in Loader.movie_derivatives:
+      if profile.Makes(kind):
+        setattr(movie, attr, Loader.UnprotectPath(
+            store.Path(movie.content_hash, suffix)))
 
   @staticmethod
-  def CreateViewpointThumbnails(viewpoints, images, movies):
-    view2img = dict()
-    for image in images:
-      if image.viewpoint.id not in view2img:
-        view2img[image.viewpoint.id] = []
-      view2img[image.viewpoint.id].append(image)
-
-    view2mov = dict()
-    for movie in movies:
-      if movie.viewpoint.id not in view2mov:
-        view2mov[movie.viewpoint.id] = []
-      view2mov[movie.viewpoint.id].append(movie)
-
-    executor = ThreadPoolExecutor(max_workers=num_cpus)
-    futures = []
-    for viewpoint in viewpoints:
-      if viewpoint.id in view2img:
-        thumbnail_src = Loader.GetImageThumbnailSource(view2img[viewpoint.id])
-        if not thumbnail_src:
-          continue
-        futures.extend(Loader.CreateViewpointImageThumbnails(viewpoint,
-                                                             thumbnail_src,
-                                                             executor))
-      elif viewpoint.id in view2mov:
-        thumbnail_src = Loader.GetMovieThumbnailSource(view2mov[viewpoint.id])
-        if not thumbnail_src:
-          continue
-
-        futures.extend(Loader.CreateViewpointMovieThumbnails(viewpoint,
-                                                             thumbnail_src,
-                                                             executor))
-    if (len(futures)):
-      print('Waiting for file viewpoint thumbnail generation to finish...')
-      for f in futures:
-        f.result()
+  def CreateViewpointThumbnails(store, viewpoint, images, movies):
+    """Create the thumbnails of |viewpoint| once its assets are probed.
+
+    Images are preferred over movies."""
+    if images:
+      thumbnail_src = Loader.GetImageThumbnailSource(images)
+      if thumbnail_src:
+        Loader.CreateViewpointThumbnailFiles(store, viewpoint, thumbnail_src,
+                                             Loader.ScaleImage)
+    elif movies:
+      thumbnail_src = Loader.GetMovieThumbnailSource(movies)
+      if thumbnail_src:
+        Loader.CreateViewpointThumbnailFiles(store, viewpoint, thumbnail_src,
+                                             Loader.CreateMovieThumbnail)
 
   @staticmethod
-  def FindViewpointImage(viewpoint, all_images, image_name):
-    for image in all_images:
-      if image.viewpoint != viewpoint:
-        continue
-      if image.friendly == image_name:
-        return image
-    return None
-
-  @staticmethod
-  def FindViewpointMovie(viewpoint, all_movies, movie_name):
-    for movie in all_movies:
-      if movie.viewpoint != viewpoint:
-        continue
-      if movie.friendly == movie_name:
-        return movie
-    return None
-
-  @staticmethod
-  def FindAssets(ref, riven_map, all_images, all_movies):
+  def FindAssets(ref, riven_map, asset_index):
     """Parse an image reference to a list of images.
 
     A reference in the form of <island_symbol>/<viewpoint_name>, find all full
@@ -807,26 +1262,25 @@ class Loader(object):
 
     if len(items) == 3:
       # Only add the specified image
-      image = Loader.FindViewpointImage(viewpoint, all_images, items[2])
+      image = asset_index.FindImage(viewpoint, items[2])
       if image:
         images.append(image)
       else:
-        movie = Loader.FindViewpointMovie(viewpoint, all_movies, items[2])
+        movie = asset_index.FindMovie(viewpoint, items[2])
         if not movie:
           raise InvalidReferenceException(ref)
         movies.append(movie)
     else:
       # Add all full sized images in the given viewpoint.
-      for image in all_images:
-        if image.viewpoint == viewpoint and image.IsFullSize():
-          images.append(image)
+      images.extend(asset_index.FullSizeImages(viewpoint))
       # Don't load all viewpoint movies. There are too many small movies that
       # clutter the object page.
     return (images, movies)
 
-  def LoadObjects(self, riven_map, all_images, all_movies):
+  def LoadObjects(self, riven_map, asset_index):
     obj_names = set()
     objects = []
+    unresolved = 0
     with open(os.path.join('objects.json5')) as f:
       json_objects = json5.load(f)
       for json_object in json_objects:
@@ -837,8 +1291,14 @@ class Loader(object):
         obj_names.add(name)
         obj = Object(name, json_object['title'])
         for json_ref in json_object['refs']:
-          obj_images, obj_movies = Loader.FindAssets(json_ref, riven_map,
-                                                     all_images, all_movies)
+          try:
+            obj_images, obj_movies = Loader.FindAssets(json_ref, riven_map,
+                                                       asset_index)
+          except InvalidReferenceException:
+            print('WARN: Object "%s" has an unresolved reference "%s"' %
+                  (name, json_ref))
+            unresolved += 1
+            continue
           obj.images.extend(obj_images)
           obj.movies.extend(obj_movies)
         if len(obj.images):
@@ -846,100 +1306,383 @@ class Loader(object):
           obj.thumbnail = viewpoint.thumbnail
           obj.thumbnail2x = viewpoint.thumbnail2x
         objects.append(obj)
+    print('# Objects:%d, # Unresolved references:%d' % (len(objects),
+                                                       unresolved))
     return objects
 
-  def LoadData(self, conn):
-    """Create the rest of the Riven map based on the image/movie data."""
-    island_to_imgvpt = self.LoadFiles('png')
-    island_to_movvpt = self.LoadFiles('mov')
-    c = conn.cursor()
+  @staticmethod
+  def IslandBundle(island, view2img, view2mov, view2obj):
+    """Return the client-side navigation bundle for |island|.
+
+    Keys are kept short as the whole island is downloaded at once:
+      t/t2: thumbnail/thumbnail2x
+      n:    neighbours, direction (l,r,u,d,f,b) -> viewpoint name. Viewpoints
+            on other islands are written as <island_symbol>/<name>.
+      i:    images as [friendly, file_path, width, height, store_path]
+      m:    movies as [friendly, file_path, h264_path, width, height,
+             poster_path, preview_path]
+      o:    objects as [name, thumbnail, thumbnail2x]"""
+    directions = [('l', 'left_viewpoint'), ('r', 'right_viewpoint'),
+                  ('u', 'up_viewpoint'), ('d', 'down_viewpoint'),
+                  ('f', 'forward_viewpoint'), ('b', 'backward_viewpoint')]
+    viewpoints = dict()
+    for viewpoint in island.viewpoints.values():
+      neighbours = dict()
+      for key, attr in directions:
+        other = getattr(viewpoint, attr)
+        if not other:
+          continue
+        if other.island is island:
+          neighbours[key] = other.name
+        else:
+          neighbours[key] = '%s/%s' % (other.island.symbol, other.name)
+      images = sorted(view2img.get(viewpoint.id, []),
+                      key=lambda i: i.image_height)
+      movies = sorted(view2mov.get(viewpoint.id, []),
+                      key=lambda m: m.movie_height)
+      objects = sorted(view2obj.get(viewpoint.id, []), key=lambda o: o.id)
+      viewpoints[viewpoint.name] = {
+        't': viewpoint.thumbnail,
+        't2': viewpoint.thumbnail2x,
+        'n': neighbours,
+        'i': [[i.friendly, i.file_path, i.image_width, i.image_height,
+               i.store_path] for i in images],
+        'm': [[m.friendly, m.file_path, m.h264_path, m.movie_width,
+               m.movie_height, m.poster_path, m.preview_path]
+              for m in movies],
+        'o': [[o.name, o.thumbnail, o.thumbnail2x] for o in objects],
+      }
+    return {'island': island.symbol, 'viewpoints': viewpoints}
 
-    riven = Loader.LoadMap('map.json')
+  @staticmethod
+  def WriteIslandBundles(riven_map, images, movies, objects):
+    """Write browser/protected/bundles/<island_symbol>.json for each island."""
+    view2img = dict()
+    for image in images:
+      view2img.setdefault(image.viewpoint.id, []).append(image)
+    view2mov = dict()
+    for movie in movies:
+      view2mov.setdefault(movie.viewpoint.id, []).append(movie)
+    view2obj = dict()
+    for obj in objects:
+      for viewpoint_id in set(image.viewpoint.id for image in obj.images):
+        view2obj.setdefault(viewpoint_id, []).append(obj)
+
+    bundle_dir = Loader.ProtectPath('bundles')
+    if not os.path.exists(bundle_dir):
+      os.mkdir(bundle_dir)
+    for island_symbol in riven_map.islands:
+      bundle = Loader.IslandBundle(riven_map.islands[island_symbol], view2img,
+                                   view2mov, view2obj)
+      fname = os.path.join(bundle_dir, '%s.json' % island_symbol)
+      # The bundles are served while they are rewritten: replace each one
+      # whole.
+      tmp_fname = fname + '.tmp'
+      with open(tmp_fname, 'w') as f:
+        json.dump(bundle, f, separators=(',', ':'), sort_keys=True)
+      os.replace(tmp_fname, fname)
 
-    executor = ThreadPoolExecutor(max_workers=num_cpus)
-    futures = []
+  @staticmethod
+  def PackContents(riven_map, images, movies, objects):
+    """Returns [(pack name, set of paths)] of the files to pack: one pack per
+    island, and one of the object thumbnails."""
+    island_paths = dict()
+    for island_symbol, island in riven_map.islands.items():
+      paths = island_paths.setdefault(island_symbol, set())
+      paths.add('bundles/%s.json' % island_symbol)
+      for viewpoint in island.viewpoints.values():
+        paths.update([viewpoint.thumbnail, viewpoint.thumbnail2x])
+      for position in island.positions.values():
+        paths.update([position.thumbnail, position.thumbnail_webp])
+    for image in images:
+      island_paths[image.viewpoint.island.symbol].add(image.store_path)
+    for movie in movies:
+      island_paths[movie.viewpoint.island.symbol].update(
+          getattr(movie, attr) for kind, attr, suffix in
+          Loader.movie_derivatives)
+    contents = [(island_symbol, island_paths[island_symbol])
+                for island_symbol in sorted(island_paths)]
+    contents.append(('objects', set(path for obj in objects
+                                    for path in (obj.thumbnail,
+                                                 obj.thumbnail2x))))
+    return contents
 
-    images = []
-    for island_symbol in island_to_imgvpt:
-      if island_symbol in riven.islands:
-        island = riven.islands[island_symbol]
-      else:
-        island = Island(island_symbol)
-        riven.islands[island_symbol] = island
-      for viewpoint_name in island_to_imgvpt[island_symbol]:
+  @staticmethod
+  def WritePack(pack_dir, name, paths):
+    """Concatenate the files at |paths| into a pack named after |name| and
+    a hash of its content. Returns their PackEntry list."""
+    tmp_path = os.path.join(pack_dir, name + '.pack.tmp')
+    digest = hashlib.sha1()
+    entries = []
+    offset = 0
+    with tracer.Span(name, 'pack'):
+      with open(tmp_path, 'wb') as out:
+        for path in paths:
+          size = 0
+          with open(Loader.ProtectPath(path), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+              out.write(block)
+              digest.update(block)
+              size += len(block)
+          entries.append(PackEntry(path, offset, size))
+          offset += size
+    pack = '%s.%s.pack' % (name, digest.hexdigest()[:12])
+    pack_path = os.path.join(pack_dir, pack)
+    if os.path.exists(pack_path):
+      # Unchanged: keep the file, which may be mapped, and its mtime, which
+      # rsync compares.
+      os.remove(tmp_path)
+    else:
+      os.replace(tmp_path, pack_path)
+    for entry in entries:
+      entry.pack = pack
+    return entries
+
+  @staticmethod
+  def WritePacks(riven_map, images, movies, objects):
+    """Write the packs of browser/protected/packs. Returns the PackEntry
+    list of the files packed.
+
+    Files which don't exist (derivatives left to the browser, or skipped by
+    the build profile) stay out, and a file shared by islands is packed
+    once."""
+    pack_dir = Loader.ProtectPath('packs')
+    if not os.path.exists(pack_dir):
+      os.mkdir(pack_dir)
+    entries = []
+    packed = set()
+    for name, paths in Loader.PackContents(riven_map, images, movies,
+                                           objects):
+      paths = sorted(path for path in paths
+                     if path and path not in packed and
+                     os.path.splitext(path)[1] not in
+                     Loader.unpacked_extensions and
+                     os.path.exists(Loader.ProtectPath(path)))
+      if paths:
+        packed.update(paths)
+        entries.extend(Loader.WritePack(pack_dir, name, paths))
+    return entries
+
+  @staticmethod
+  def PackNames(db_path):
+    """The packs the database at |db_path| refers to."""
+    if not os.path.exists(db_path):
+      return set()
+    conn = sqlite3.connect(db_path)
+    try:
+      return set(row[0] for row in
+                 conn.execute('SELECT DISTINCT pack FROM pack_index'))
+    except sqlite3.OperationalError:
+      return set()  # Built before packs.
+    finally:
+      conn.close()
+
+  @staticmethod
+  def PrunePacks(keep):
+    """Remove the packs other than |keep|."""
+    pack_dir = Loader.ProtectPath('packs')
+    if not os.path.exists(pack_dir):
+      return
+    for fname in os.listdir(pack_dir):
+      if fname not in keep:
+        os.remove(os.path.join(pack_dir, fname))
+
+  @staticmethod
+  def InsertRows(cursor, table, cls, items):
+    with tracer.Span(table, 'sql insert'):
+      cursor.executemany('INSERT INTO %s VALUES %s' % (table, cls.insert()),
+                         [i.sqlrow() for i in items])
+
+  def AddMovieTasks(self, graph, info, viewpoint):
+    """Add the probe and derivative tasks of a movie. Returns the RivenMovie
+    and its probe task."""
+    movie = RivenMovie(viewpoint, info.friendly_name(),
+                       Loader.UnprotectPath(info.file_path), None, None, 0, 0)
+    probe_task = graph.Add(Loader.ProbeMovie, self.store, self.profile, info,
+                           movie)
+    for kind, attr, suffix in Loader.movie_derivatives:
+      if self.profile.Makes(kind):
+        graph.Add(self.MakeMovieDerivative, kind, movie, suffix,
+                  deps=[probe_task])
+    return (movie, probe_task)
+
+  def LoadIsland(self, conn, island_symbol):
+    """Make the files of |island_symbol| and insert its rows into |conn|.
+
+    The whole map is loaded, so the IDs of the viewpoints of other islands,
+    which this island's link to, are known without building them.
+
+    The per-file work runs as a task graph: each viewpoint's thumbnails are
+    made as soon as its own files are probed, and each position's animation
+    as soon as its viewpoints' thumbnails are done, while the movie
+    transcodes run alongside. Only the database insert waits for all the
+    probes and thumbnails, and the transcodes are waited on last."""
+    with tracer.Span('LoadFiles', 'stage'):
+      island_to_imgvpt, island_to_movvpt = self.LoadFiles(island_symbol)
+    c = conn.cursor()
+
+    with tracer.Span('LoadMap', 'stage'):
+      riven = Loader.LoadMap('map.json')
+    if island_symbol not in riven.islands:
+      riven.islands[island_symbol] = Island(island_symbol)
+    island = riven.islands[island_symbol]
+
+    # The render executor makes the position animations and island maps.
+    with ThreadPoolExecutor(max_workers=self.workers) as executor, \
+         ProcessPoolExecutor(max_workers=self.workers) as render_executor:
+      graph = TaskGraph(executor, self.workers * 4)
+      metadata_tasks = []  # Probes, thumbnails and position animations.
+
+      images = []
+      movies = []
+      viewpoint_to_img = island_to_imgvpt.get(island_symbol, dict())
+      viewpoint_to_mov = island_to_movvpt.get(island_symbol, dict())
+      thumbnail_tasks = dict()  # Viewpoint.name -> Future
+      for viewpoint_name in sorted(set(viewpoint_to_img) |
+                                   set(viewpoint_to_mov)):
         viewpoint = island.GetViewpoint(viewpoint_name)
-        viewpoint.position = island.FindPosition(viewpoint_name)
-        viewpoint_to_info = island_to_imgvpt[island_symbol]
-        for info in viewpoint_to_info[viewpoint_name]:
+        if viewpoint_name in viewpoint_to_img:
+          viewpoint.position = island.FindPosition(viewpoint_name)
+        probe_tasks = []
+        vpt_images = []
+        for info in viewpoint_to_img.get(viewpoint_name, []):
           file_path = Loader.UnprotectPath(info.file_path)
-          image = RivenImg(viewpoint, info.filename(), info.friendly_name(),
-                           file_path, 0, 0)
-          images.append(image)
-          futures.append(executor.submit(Loader.SetImageSize, info, image))
+          image = RivenImg(viewpoint, info.friendly_name(), file_path, 0, 0)
+          vpt_images.append(image)
+          probe_tasks.append(graph.Add(Loader.ProbeImage, self.store, info,
+                                       image))
+        vpt_movies = []
+        for info in viewpoint_to_mov.get(viewpoint_name, []):
+          movie, probe_task = self.AddMovieTasks(graph, info, viewpoint)
+          vpt_movies.append(movie)
+          probe_tasks.append(probe_task)
+        images.extend(vpt_images)
+        movies.extend(vpt_movies)
+        metadata_tasks.extend(probe_tasks)
+        if self.profile.Makes('thumbnail'):
+          thumbnail_tasks[viewpoint_name] = graph.Add(
+              Loader.CreateViewpointThumbnails, self.store, viewpoint,
+              vpt_images, vpt_movies, deps=probe_tasks)
+          metadata_tasks.append(thumbnail_tasks[viewpoint_name])
+      for position in island.positions.values():
+        deps = [thumbnail_tasks[name] for name in position.viewpoints
+                if name in thumbnail_tasks]
+        metadata_tasks.append(graph.Add(Loader.CreatePositionImageThumbnail,
+                                        position, self.profile,
+                                        render_executor, deps=deps,
+                                        chained=True))
+
+      print('Waiting for file probing and thumbnail generation to finish...')
+      with tracer.Span('Wait for thumbnails', 'stage'):
+        graph.Wait(metadata_tasks)
+      # Only the thumbnails of viewpoints in a position were animated.
+      for viewpoint in island.viewpoints.values():
+        viewpoint.thumbnail_frame = None
+
+      map_futures = []
+      if self.profile.Makes('island map'):
+        map_futures = riven.WriteGraphViz(Loader.ProtectPath('maps'),
+                                          render_executor, [island_symbol])
+
+      Loader.InsertRows(c, 'islands', Island, [island])
+      Loader.InsertRows(c, 'viewpoints', Viewpoint,
+                        list(island.viewpoints.values()))
+      Loader.InsertRows(c, 'positions', Position,
+                        list(island.positions.values()))
+      Loader.InsertRows(c, 'rivenimgs', RivenImg, images)
+      Loader.InsertRows(c, 'rivenmovs', RivenMovie, movies)
+      with tracer.Span('routes', 'sql insert'):
+        print('# Routes:%d' % RouteIndex.InsertIslandRoutes(c, island))
+      Loader.InsertRows(c, 'derivatives', Derivative, self.derivatives)
 
-    movies = []
-    for island_symbol in island_to_movvpt:
-      if island_symbol in riven.islands:
-        island = riven.islands[island_symbol]
-      else:
-        island = Island(island_symbol)
-        riven[island_symbol] = island
-      for viewpoint_name in island_to_movvpt[island_symbol]:
-        viewpoint_to_info = island_to_movvpt[island_symbol]
-        for info in viewpoint_to_info[viewpoint_name]:
-          gif_path = Loader.SwapExtension(info.file_path, 'gif')
-          if not os.path.exists(gif_path):
-            futures.append(executor.submit(Loader.TranscodeMovie,
-                                           info.file_path, gif_path))
-          h264_path = Loader.SwapExtension(info.file_path, 'm4v')
-          if not os.path.exists(h264_path):
-            futures.append(executor.submit(Loader.MakeH264,
-                                           info.file_path, h264_path))
-          viewpoint = island.GetViewpoint(viewpoint_name)
-          gif_path = Loader.UnprotectPath(gif_path);
-          h264_path = Loader.UnprotectPath(h264_path);
-          movie = RivenMovie(viewpoint, info.filename(), info.friendly_name(),
-                             info.file_path, gif_path, h264_path, 0, 0)
-          movies.append(movie)
-          futures.append(executor.submit(Loader.SetMovieSize, info, movie))
-
-    all_islands = []
-    all_viewpoints = []
-    all_positions = []
-    for island_symbol in riven.islands:
-      all_islands.append(riven.islands[island_symbol])
-      viewpoints = riven.islands[island_symbol].viewpoints
-      for viewpoint_name in viewpoints:
-        all_viewpoints.append(viewpoints[viewpoint_name])
-      positions = riven.islands[island_symbol].positions
-      for position_name in positions:
-        all_positions.append(positions[position_name])
-    Loader.CreateViewpointThumbnails(all_viewpoints, images, movies)
-    futures.extend(Loader.CreateAllPositionImageThumbnails(all_positions,
-                                                           all_viewpoints,
-                                                           executor))
-    if (len(futures)):
       print('Waiting for file transcoding to finish...')
-      for f in futures:
-        f.result()
-
-    # Need thumbnails to be finished.
-    all_objects = self.LoadObjects(riven, images, movies)
-
-    riven.WriteGraphViz('riven.dot')
-
-    c.executemany('INSERT INTO islands VALUES %s' % Island.insert(),
-                  [i.sqlrow() for i in all_islands])
-    c.executemany('INSERT INTO viewpoints VALUES %s' % Viewpoint.insert(),
-                  [v.sqlrow() for v in all_viewpoints])
-    c.executemany('INSERT INTO positions VALUES %s' % Position.insert(),
-                  [p.sqlrow() for p in all_positions])
-    c.executemany('INSERT INTO rivenimgs VALUES %s' % RivenImg.insert(),
-                  [i.sqlrow() for i in images])
-    c.executemany('INSERT INTO rivenmovs VALUES %s' % RivenMovie.insert(),
-                  [m.sqlrow() for m in movies])
-    c.executemany('INSERT INTO objects VALUES %s' % Object.insert(),
-                  [o.sqlrow() for o in all_objects])
+      with tracer.Span('Wait for transcodes', 'stage'):
+        graph.Wait()
+      self.store.PrintReport()
+
+      if (len(map_futures)):
+        print('Waiting for island map rendering to finish...')
+        with tracer.Span('Wait for maps', 'stage'):
+          for f in map_futures:
+            for event in f.result():
+              tracer.AddEvent(event)
+
+  @staticmethod
+  def ReadMap(conn):
+    """Returns the Map, images and movies of the rows merged into |conn|."""
+    riven_map = Map()
+    islands = dict()  # island_id -> Island
+    for island_symbol, in conn.execute(
+        'SELECT symbol FROM islands ORDER BY island_id'):
+      island = Island(island_symbol)
+      riven_map.islands[island_symbol] = island
+      islands[island.id] = island
+    positions = dict()  # position_id -> Position
+    for row in conn.execute('''SELECT position_id, name, island, thumbnail,
+                            thumbnail_webp FROM positions
+                            ORDER BY position_id'''):
+      island = islands[row[2]]
+      position = Position(row[1], island)
+      position.id = row[0]
+      position.thumbnail, position.thumbnail_webp = row[3:5]
+      island.positions[position.name] = position
+      positions[position.id] = position
+    viewpoints = dict()  # viewpoint_id -> Viewpoint
+    rows = conn.execute('SELECT * FROM viewpoints ORDER BY viewpoint_id')
+    rows = rows.fetchall()
+    for row in rows:
+      island = islands[row[1]]
+      # The name column has INTEGER affinity: numeric names come back as
+      # numbers.
+      viewpoint = island.GetViewpoint(str(row[3]))
+      viewpoint.id = row[0]
+      viewpoint.position = positions.get(row[2])
+      if viewpoint.position:
+        viewpoint.position.viewpoints[viewpoint.name] = viewpoint
+      viewpoint.thumbnail, viewpoint.thumbnail2x = row[4:6]
+      viewpoints[viewpoint.id] = viewpoint
+    for row in rows:
+      for (direction, attr), other_id in zip(RouteIndex.directions, row[6:]):
+        setattr(viewpoints[row[0]], attr, viewpoints.get(other_id))
+    images = []
+    for row in conn.execute('''SELECT image_id, viewpoint, friendly,
+                            file_path, image_width, image_height,
+                            content_hash, store_path FROM rivenimgs
+                            ORDER BY image_id'''):
+      image = RivenImg(viewpoints[row[1]], row[2], row[3], row[4], row[5])
+      image.id = row[0]
+      image.content_hash, image.store_path = row[6:8]
+      images.append(image)
+    movies = []
+    for row in conn.execute('''SELECT movie_id, viewpoint, friendly,
+                            file_path, anim_gif_path, h264_path, movie_width,
+                            movie_height, content_hash, poster_path,
+                            preview_path, store_path FROM rivenmovs
+                            ORDER BY movie_id'''):
+      movie = RivenMovie(viewpoints[row[1]], *row[2:8])
+      movie.id = row[0]
+      (movie.content_hash, movie.poster_path, movie.preview_path,
+       movie.store_path) = row[8:12]
+      movies.append(movie)
+    return (riven_map, images, movies)
+
+  def LoadMerged(self, conn):
+    """Add what spans islands to the island rows merged into |conn|: the
+    objects, the search index, the routes between islands, the navigation
+    bundles and the packs."""
+    c = conn.cursor()
+    with tracer.Span('ReadMap', 'stage'):
+      riven, images, movies = Loader.ReadMap(conn)
+    all_viewpoints = [viewpoint for island in riven.islands.values()
+                      for viewpoint in island.viewpoints.values()]
+
+    with tracer.Span('LoadObjects', 'stage'):
+      all_objects = self.LoadObjects(riven, AssetIndex(images, movies))
+
+    with tracer.Span('WriteIslandBundles', 'stage'):
+      Loader.WriteIslandBundles(riven, images, movies, all_objects)
+
+    Loader.InsertRows(c, 'objects', Object, all_objects)
     obj_to_img = []
     obj_to_mov = []
     for obj in all_objects:
@@ -947,21 +1690,221 @@ class Loader(object):
         obj_to_img.append(ObjectImageAssocation(obj, img))
       for movie in obj.movies:
         obj_to_mov.append(ObjectMovieAssocation(obj, movie))
-    ObjectImageAssocation.InsertAll(c, obj_to_img)
-    ObjectMovieAssocation.InsertAll(c, obj_to_mov)
+    with tracer.Span('object_images', 'sql insert'):
+      ObjectImageAssocation.InsertAll(c, obj_to_img)
+    with tracer.Span('object_movies', 'sql insert'):
+      ObjectMovieAssocation.InsertAll(c, obj_to_mov)
+    with tracer.Span('search', 'sql insert'):
+      SearchIndex.InsertAll(c, all_viewpoints, images, movies, all_objects)
+    with tracer.Span('gateways', 'sql insert'):
+      print('# Gateways:%d' % RouteIndex.InsertGateways(c, riven))
+
+    if self.pack:
+      with tracer.Span('WritePacks', 'stage'):
+        Loader.InsertRows(c, 'pack_index', PackEntry,
+                          Loader.WritePacks(riven, images, movies,
+                                            all_objects))
+
+  def ShardPath(self, island_symbol):
+    return os.path.join(self.shard_dir, '%s.sqlite' % island_symbol)
 
-    conn.commit()
-
-  def CreateDB(self):
+  @staticmethod
+  def BulkLoad(path):
+    """A connection to a new database at |path|, for loading."""
     try:
-      os.remove(self.db_path)
+      os.remove(path)
     except FileNotFoundError:
       pass
-    conn = sqlite3.connect(self.db_path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    for pragma in Loader.bulk_load_pragmas:
+      conn.execute('PRAGMA ' + pragma)
+    return conn
+
+  def BuildShard(self, island_symbol):
+    """Build |island_symbol| into its shard: a database with the island's
+    rows alone, moved into place once complete."""
+    if not os.path.exists(self.shard_dir):
+      os.makedirs(self.shard_dir, exist_ok=True)
+    shard_path = self.ShardPath(island_symbol)
+    tmp_path = shard_path + '.tmp'
+    conn = Loader.BulkLoad(tmp_path)
+    conn.execute('BEGIN')
+    self.CreateTables(conn, self.ShardFingerprint(island_symbol))
+    self.LoadIsland(conn, island_symbol)
+    conn.execute('COMMIT')
+    conn.close()
+    os.replace(tmp_path, shard_path)
+
+  def BuildShards(self, island_symbols):
+    """Build the shards of |island_symbols|, each in a makedb process of its
+    own, sharing the CPUs. Each is given its island's files rather than
+    scanning them all again."""
+    workers = max(1, -(-self.workers // len(island_symbols)))
+    catalog = self.Catalog()
+    if not os.path.exists(self.shard_dir):
+      os.makedirs(self.shard_dir)
+    def Build(island_symbol):
+      catalog_path = self.ShardPath(island_symbol) + '.files.json'
+      catalog.Slice(island_symbol).Save(catalog_path)
+      cmd = [sys.executable, os.path.abspath(__file__),
+             '--shard', island_symbol, '--shard-dir', self.shard_dir,
+             '--catalog', catalog_path,
+             '--profile', self.profile.name, '--workers', str(workers)]
+      if self.lazy_derivatives:
+        cmd.append('--lazy-derivatives')
+      trace_path = self.ShardPath(island_symbol) + '.trace.json'
+      if tracer.enabled:
+        cmd.extend(['--trace', trace_path])
+      if tracer.profile_dir:
+        cmd.extend(['--cprofile', tracer.profile_dir])
+      ts = tracer.Timestamp()
+      try:
+        subprocess.check_call(cmd, stdout=sys.stdout)
+      finally:
+        os.remove(catalog_path)
+      if tracer.enabled:
+        # The shard's clock started with it.
+        with open(trace_path) as f:
+          for event in json.load(f)['traceEvents']:
+            if event['ph'] == 'M':
+              # Made again, for all the threads, by WriteChromeTrace().
+              continue
+            event['ts'] += ts
+            if event['cat'] == 'stage':
+              event['name'] = '%s %s' % (island_symbol, event['name'])
+            tracer.AddEvent(event)
+        os.remove(trace_path)
+    with ThreadPoolExecutor(max_workers=len(island_symbols)) as executor:
+      for future in [executor.submit(Build, island_symbol)
+                     for island_symbol in island_symbols]:
+        future.result()
+
+  def IslandSymbols(self):
+    """The islands of the map and of the game files."""
+    island_to_imgvpt, island_to_movvpt = self.LoadFiles()
+    riven = Loader.LoadMap('map.json')
+    return sorted(set(riven.islands) | set(island_to_imgvpt) |
+                  set(island_to_movvpt))
+
+  def MergeShards(self, island_symbols):
+    """Merge the shards of |island_symbols| into a temporary file, and move
+    it into place once complete, so readers of db_path never see a partial
+    one."""
+    for island_symbol in island_symbols:
+      profile = self.ShardProfile(island_symbol)
+      if profile is None:
+        raise Exception('The shard of %s is missing (see --shard)' %
+                        island_symbol)
+      if profile != self.profile.name:
+        raise Exception('The shard of %s was built with the %s profile' %
+                        (island_symbol, profile))
+    tmp_path = self.db_path + '.tmp'
+    conn = Loader.BulkLoad(tmp_path)
+    conn.execute('BEGIN')
     self.CreateTables(conn)
     self.CreateUsers(conn)
-    self.LoadData(conn)
+    conn.execute('COMMIT')
+    for island_symbol in island_symbols:
+      with tracer.Span(island_symbol, 'merge'):
+        # Shards can't be attached within a transaction.
+        conn.execute('ATTACH DATABASE ? AS shard',
+                     (self.ShardPath(island_symbol),))
+        conn.execute('BEGIN')
+        for table in Loader.shard_tables:
+          conn.execute('INSERT INTO main.%s (%s) SELECT %s FROM shard.%s' %
+                       (table, Loader.Columns(conn, table),
+                        Loader.Columns(conn, table), table))
+        # Islands sharing a movie may both have left its derivatives.
+        conn.execute('INSERT OR IGNORE INTO main.derivatives (%s) '
+                     'SELECT %s FROM shard.derivatives' %
+                     (Loader.Columns(conn, 'derivatives'),
+                      Loader.Columns(conn, 'derivatives')))
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE shard')
+    conn.execute('BEGIN')
+    self.LoadMerged(conn)
+    with tracer.Span('CreateIndexes', 'stage'):
+      self.CreateIndexes(conn)
+    conn.execute('COMMIT')
+    with tracer.Span('Analyze', 'stage'):
+      conn.execute('ANALYZE')
+      conn.execute('VACUUM')
     conn.close()
+    # The packs of the database being replaced are kept for the requests
+    # still reading it.
+    keep_packs = Loader.PackNames(self.db_path)
+    os.replace(tmp_path, self.db_path)
+    Loader.PrunePacks(keep_packs | Loader.PackNames(self.db_path))
+
+  @staticmethod
+  def Columns(conn, table):
+    """The columns of |table| in the main database, comma separated, so the
+    merge copies the shards' by name."""
+    return ', '.join(row[1] for row in
+                     conn.execute('PRAGMA main.table_info(%s)' % table))
+
+  def ShardProfile(self, island_symbol):
+    """The name of the profile the shard of |island_symbol| was built with,
+    or None if there is none."""
+    shard_path = self.ShardPath(island_symbol)
+    if not os.path.exists(shard_path):
+      return None
+    conn = sqlite3.connect(shard_path)
+    try:
+      return conn.execute('SELECT build_profile FROM globals').fetchone()[0]
+    finally:
+      conn.close()
+
+  def ShardFingerprint(self, island_symbol):
+    """A hash of what the shard of |island_symbol| is built from: the
+    island's game files (their paths, sizes and modification times), the map
+    numbering the viewpoints, the shard format and the build options."""
+    h = hashlib.sha1()
+    h.update(json.dumps([Loader.shard_format, self.profile.name,
+                         self.lazy_derivatives]).encode('utf-8'))
+    with open('map.json', 'rb') as f:
+      h.update(f.read())
+    catalog = self.Catalog().Slice(island_symbol)
+    for i in range(len(catalog)):
+      h.update(json.dumps(catalog.Row(i)).encode('utf-8'))
+    return h.hexdigest()
+
+  def ShardIsCurrent(self, island_symbol):
+    """True if the shard of |island_symbol| was built from what it would be
+    built from now (see ShardFingerprint()), and the content store still has
+    the sources it refers to."""
+    shard_path = self.ShardPath(island_symbol)
+    if not os.path.exists(shard_path):
+      return False
+    conn = sqlite3.connect(shard_path)
+    try:
+      fingerprint, = conn.execute(
+          'SELECT shard_fingerprint FROM globals').fetchone()
+      store_paths = [row[0] for row in conn.execute(
+          'SELECT store_path FROM rivenimgs UNION '
+          'SELECT store_path FROM rivenmovs')]
+    except sqlite3.OperationalError:
+      # Made by an older makedb.
+      return False
+    finally:
+      conn.close()
+    if fingerprint != self.ShardFingerprint(island_symbol):
+      return False
+    return all(os.path.exists(Loader.ProtectPath(path))
+               for path in store_paths if path)
+
+  def CreateDB(self, rebuild=None):
+    """Build the shards of the islands in |rebuild| (all when None), and of
+    those which aren't current, then merge them all into db_path."""
+    island_symbols = self.IslandSymbols()
+    build = [island_symbol for island_symbol in island_symbols
+             if rebuild is None or island_symbol in rebuild or
+             not self.ShardIsCurrent(island_symbol)]
+    if build:
+      with tracer.Span('BuildShards', 'stage'):
+        self.BuildShards(build)
+    with tracer.Span('MergeShards', 'stage'):
+      self.MergeShards(island_symbols)
 
   @staticmethod
   def FilterImage(info):
@@ -969,30 +1912,35 @@ class Loader(object):
       return True
     return False
 
-  def LoadFiles(self, suffix):
+  @staticmethod
+  def GroupByViewpoint(catalog, extension, island_symbol=None):
+    """Returns {island symbol: {viewpoint name: [FileInfo]}} of the files
+    with |extension| (on |island_symbol|), sorted by path so they are
+    numbered alike by every build."""
     island_to_vpt = dict()
-    finder = FileFinder()
-    for filename in finder.GetFiles(self.top_dir, suffix):
-      # Thumbnails are created by this program.
-      if 'thumbnail' in filename:
-        continue
-      dir_name = os.path.basename(os.path.dirname(filename))
-      if dir_name == 'b2_data-MHK' or dir_name == 'Extras-MHK':
-        continue
-      info = finder.ParseFilename(os.path.basename(filename))
-      info.file_path = filename
+    for info in catalog.Select(extension, island_symbol):
       if Loader.FilterImage(info):
         continue
-      if info.island in island_to_vpt:
-        vpts = island_to_vpt[info.island]
-      else:
-        vpts = dict()
-        island_to_vpt[info.island] = vpts
-      if not info.viewpoint in vpts:
-        vpts[info.viewpoint] = set()
-      vpts[info.viewpoint].add(info)
+      vpts = island_to_vpt.setdefault(info.island, dict())
+      vpts.setdefault(info.viewpoint, []).append(info)
+    for vpts in island_to_vpt.values():
+      for infos in vpts.values():
+        infos.sort(key=lambda info: info.file_path)
     return island_to_vpt
 
+  def Catalog(self):
+    """The AssetCatalog of the game files, scanned on first use."""
+    if self.catalog is None:
+      self.catalog = FileFinder().Scan(self.top_dir, ['png', 'mov'])
+    return self.catalog
+
+  def LoadFiles(self, island_symbol=None):
+    """The game files (of |island_symbol|). Returns the images and the
+    movies, each grouped by GroupByViewpoint()."""
+    catalog = self.Catalog()
+    return (Loader.GroupByViewpoint(catalog, 'png', island_symbol),
+            Loader.GroupByViewpoint(catalog, 'mov', island_symbol))
+
   @staticmethod
   def ExtractGameImagesForWebsite():
     with open('extraction_data.json') as data_file:
@@ -1003,9 +1951,108 @@ class Loader(object):
           os.mkdir(d)
         Loader.ScaleImage(image['infile'], image['outfile'], image['scale'])
 
+class Options(object):
+  def __init__(self):
+    self.trace = None
+    self.cprofile = None
+    self.lazy_derivatives = False
+    self.profile = 'dev'
+    self.pack = False
+    self.islands = None
+    self.shard = None
+    self.catalog = None
+    self.merge_only = False
+    self.shard_dir = 'shards'
+    self.workers = num_cpus
+
+  def Parse(self):
+    desc = "Create the reference browser database from the game assets."
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Write a Chrome trace of the build to FILE and '
+                             'print a summary of the slowest stages.')
+    parser.add_argument('--cprofile', metavar='DIR',
+                        help='Profile the Python code of each stage and '
+                             'SQL insert, apart from the time spent '
+                             'waiting, into DIR/<stage>.pstats.')
+    parser.add_argument('--lazy-derivatives', action='store_true',
+                        help="Don't transcode the movies, and leave it to "
+                             "the browser to do on first request.")
+    parser.add_argument('--profile', default='dev',
+                        choices=sorted(BuildProfile.profiles),
+                        help='The derivatives to make: all of them (dev, '
+                             'the default), those deploy.sh ships (prod) '
+                             'or none (findimg-only).')
+    parser.add_argument('--pack', action='store_true',
+                        help="Pack each island's files into one file, "
+                             'served from a memory mapping.')
+    parser.add_argument('--island', action='append', metavar='SYMBOL',
+                        help='Rebuild the shard of this island alone (may '
+                             'be repeated), reusing those of the others, '
+                             'and merge them.')
+    parser.add_argument('--shard', metavar='SYMBOL',
+                        help='Only build the shard of this island, to be '
+                             'merged by --merge-only, possibly on another '
+                             'machine sharing the shard directory.')
+    parser.add_argument('--catalog', metavar='FILE',
+                        help='The game files of the --shard island, as '
+                             'saved by the build running it, rather than '
+                             'scanning them.')
+    parser.add_argument('--merge-only', action='store_true',
+                        help='Only merge the shards already built.')
+    parser.add_argument('--shard-dir', default='shards',
+                        help='Where the database of each island is built '
+                             '(default shards).')
+    parser.add_argument('--workers', type=int, default=num_cpus,
+                        help='Number of jobs run at once (default %d).' %
+                             num_cpus)
+    args = parser.parse_args()
+    self.trace = args.trace
+    self.cprofile = args.cprofile
+    self.lazy_derivatives = args.lazy_derivatives
+    self.profile = args.profile
+    self.pack = args.pack
+    self.islands = args.island
+    self.shard = args.shard
+    self.catalog = args.catalog
+    self.merge_only = args.merge_only
+    self.shard_dir = args.shard_dir
+    self.workers = args.workers
+
 if __name__ == '__main__':
   import doctest
   doctest.testmod()
-  Loader.ExtractGameImagesForWebsite()
+  options = Options()
+  options.Parse()
+  if options.trace:
+    tracer.Enable()
+  if options.cprofile:
+    tracer.EnableProfiling(options.cprofile,
+                           options.shard + '.' if options.shard else '')
   loader = Loader(Loader.ProtectPath('DVD'))
-  loader.CreateDB()
+  loader.lazy_derivatives = options.lazy_derivatives
+  loader.profile = BuildProfile(options.profile)
+  loader.pack = options.pack
+  loader.shard_dir = options.shard_dir
+  loader.workers = options.workers
+  if options.catalog:
+    loader.catalog = AssetCatalog.Load(options.catalog)
+  if options.shard:
+    with tracer.Span('BuildShard', 'stage'):
+      loader.BuildShard(options.shard)
+    if options.trace:
+      tracer.WriteChromeTrace(options.trace)
+    if options.cprofile:
+      tracer.WriteProfiles(summary=False)
+    sys.exit(0)
+  Loader.ExtractGameImagesForWebsite()
+  with tracer.Span('CreateDB', 'stage'):
+    if options.merge_only:
+      loader.MergeShards(loader.IslandSymbols())
+    else:
+      loader.CreateDB(options.islands)
+  if options.trace:
+    tracer.WriteChromeTrace(options.trace)
+    tracer.PrintSummary()
+  if options.cprofile:
+    tracer.WriteProfiles()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import Future
+import threading
+
+class TaskGraph(object):
+  """Runs tasks on an executor as soon as the tasks they depend on are done.
+
+  Rather than running a build in phases separated by barriers, each task is
+  added along with the futures it depends on, and is submitted to the
+  executor the moment the last of them finishes.
+
+  At most |max_pending| tasks are unfinished at a time: Add() blocks until
+  an earlier task finishes. This bounds the work (and memory) queued ahead of
+  the workers. Add() must only be called from the thread building the graph,
+  never from a task, and dependencies must already have been added, so the
+  pending tasks can always make progress.
+
+  >>> from concurrent.futures import ThreadPoolExecutor
+  >>> graph = TaskGraph(ThreadPoolExecutor(max_workers=2), 2)
+  >>> a = graph.Add(lambda: 1)
+  >>> b = graph.Add(lambda: a.result() + 1, deps=[a])
+  >>> graph.Wait()
+  >>> b.result()
+  2
+  >>> other = Future()
+  >>> c = graph.Add(lambda: other, deps=[b], chained=True)
+  >>> other.set_result(3)
+  >>> c.result()
+  3
+  """
+
+  def __init__(self, executor, max_pending):
+    self.executor = executor
+    self.slots = threading.BoundedSemaphore(max_pending)
+    self.futures = []
+
+  def Add(self, fn, *args, deps=(), chained=False):
+    """Run fn(*args) once all of |deps| are done. Returns its Future.
+
+    If |chained|, fn returns a Future (or None) of work it handed to another
+    executor, and the task is done when that is, without holding a worker
+    while it waits.
+
+    If a dependency fails the task is not run and fails with the same
+    exception."""
+    self.slots.acquire()
+    result = Future()
+    result.add_done_callback(lambda f: self.slots.release())
+    self.futures.append(result)
+
+    lock = threading.Lock()
+    remaining = [len(deps)]
+
+    def Run():
+      for dep in deps:
+        if dep.exception():
+          result.set_exception(dep.exception())
+          return
+      if not result.set_running_or_notify_cancel():
+        return
+      future = self.executor.submit(fn, *args)
+      if chained:
+        future.add_done_callback(lambda f: TaskGraph.ChainResult(f, result))
+      else:
+        future.add_done_callback(lambda f: TaskGraph.CopyResult(f, result))
+
+    def DepDone(dep):
+      with lock:
+        remaining[0] -= 1
+        ready = remaining[0] == 0
+      if ready:
+        Run()
+
+    if deps:
+      for dep in deps:
+        dep.add_done_callback(DepDone)
+    else:
+      Run()
+    return result
+
+  @staticmethod
+  def CopyResult(src, dest):
+    if src.exception():
+      dest.set_exception(src.exception())
+    else:
+      dest.set_result(src.result())
+
+  @staticmethod
+  def ChainResult(src, dest):
+    if src.exception() or src.result() is None:
+      TaskGraph.CopyResult(src, dest)
+    else:
+      src.result().add_done_callback(lambda f: TaskGraph.CopyResult(f, dest))
+
+  def Wait(self, futures=None):
+    """Wait for |futures| (default: every task added) to finish.
+
+    Raises the exception of the first one which failed."""
+    for f in (self.futures if futures is None else futures):
+      f.result()
@@ -0,0 +1,79 @@
+"""Switching to a new database while threads read the old one (see
+browser/serving.py). Run with python3 -m pytest."""
+
+from app import create_app
+from bench_web import AppConfig, DatabaseBuilder, LoggedInClient, Options
+from browser.models import db, Globals
+from browser.serving import ServingPool
+from makedb import Island
+import contextlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+def BuildDatabase(path, viewpoints_per_island):
+  """Build a database at |path|. Returns its build ID."""
+  options = Options()
+  options.islands = 1
+  options.images = 1
+  options.objects = 5
+  with contextlib.redirect_stdout(sys.stderr):
+    DatabaseBuilder(options, viewpoints_per_island).Build(path)
+  conn = sqlite3.connect(path)
+  try:
+    return conn.execute('SELECT build_id FROM globals').fetchone()[0]
+  finally:
+    conn.close()
+
+def test_swap_while_reading(tmp_path):
+  db_path = str(tmp_path / 'riven.sqlite')
+  old_build = BuildDatabase(db_path, 10)
+  # Fewer pooled connections than threads: those beyond must not be closed
+  # under the requests using them.
+  num_threads = 8
+  app = create_app(AppConfig(db_path, SERVE_IMMUTABLE=True,
+                             SERVE_CHECK_INTERVAL=0.05, SERVE_POOL_SIZE=2,
+                             PAGE_CACHE_BYTES=1 << 20))
+  with app.app_context():
+    assert isinstance(db.engine.pool, ServingPool)
+  url = '/island/%s' % sorted(Island.info)[0]
+  stop = threading.Event()
+  errors = []
+  seen = [[] for _ in range(num_threads)]  # Build IDs, as they change.
+
+  def Read(thread_num):
+    client = LoggedInClient(app)
+    while not stop.is_set():
+      try:
+        response = client.get(url)
+        if response.status_code != 200:
+          raise Exception('island page returned %d' % response.status_code)
+        with app.app_context():
+          build_id = Globals.query.first().build_id
+        if not seen[thread_num] or seen[thread_num][-1] != build_id:
+          seen[thread_num].append(build_id)
+      except Exception as e:
+        errors.append('thread %d: %r' % (thread_num, e))
+
+  threads = [threading.Thread(target=Read, args=(n,))
+             for n in range(num_threads)]
+  for thread in threads:
+    thread.start()
+  try:
+    while not all(seen):
+      time.sleep(0.01)
+    new_build = BuildDatabase(db_path + '.new', 20)
+    os.replace(db_path + '.new', db_path)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and \
+          not all(ids[-1] == new_build for ids in seen):
+      time.sleep(0.01)
+  finally:
+    stop.set()
+    for thread in threads:
+      thread.join()
+
+  assert errors == []
+  assert seen == [[old_build, new_build]] * num_threads